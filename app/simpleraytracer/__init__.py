@@ -1,3 +1,30 @@
 from .src.raytracer import *
+from .src.bvh import *
+from .src.compiled import *
+from .src.denoise import *
+from .src.parallel import *
+from .src.sampling import *
+from .src.stats import *
+from .src.scene import *
+from .src.animation import *
+from .src.mesh import *
 from .src.objects import *
+from .src.texture import *
 from .src.geometry import *
+from .src.image import *
+
+
+def __getattr__(name):
+    # Probes for private and special names, e.g. by copy, pickle or doctest, must not import the optional modules
+    if name.startswith('_'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    # The render server pulls in asyncio and the coordinator multiprocessing, they are only imported when one of
+    # their names is used
+    from .src import distributed, server
+
+    for module in (server, distributed):
+        if hasattr(module, name):
+            return getattr(module, name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
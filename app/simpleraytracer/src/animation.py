@@ -0,0 +1,88 @@
+from .raytracer import *
+
+"""-------------------------------------------Animation--------------------------------------------------------------"""
+
+
+def render_sequence(scene, keyframes, **options):
+    """
+    Renders the frames of an animation one at a time, yielding every frame as soon as it is done.
+
+    Every keyframe lists what changed since the previous frame, e.g.
+    {"camera": {"rotation": Vector3(0, 0.1, 0)}, "objects": {2: {"position": [0, 1, 0]}}},
+    where objects are referenced by their index in scene.objects, and the changes are applied to the scene in place.
+    A scene with a list of lights moves them with a "lights" key that references them by their index in the same way.
+    Everything else is kept between frames: unchanged transforms and plane normals are not recomputed, textures
+    stay loaded and the bounding volume hierarchy is built once, only the boxes around moved objects are refitted.
+
+    An output option that is a str is formatted with the frame number, e.g. "frames/{:04d}.npy",
+    so every frame is written to its own memory-mapped file.
+
+    :param scene: Scene
+    :param keyframes: iterable<dict>
+    :param options: keyword arguments of render, override the options of the scene
+    :return: generator<numpy.ndarray>
+    """
+    options = {**scene.options, **options}
+    output = options.pop('output', None)
+    bvh = BVH(scene.objects)
+
+    for frame, changes in enumerate(keyframes):
+        moved = __apply_keyframe(scene, changes)
+
+        if moved:
+            bvh.refit(moved)
+
+        frame_output = output.format(frame) if isinstance(output, str) else output
+
+        yield render(bvh, scene.light, scene.camera, output=frame_output, **options)
+
+
+def __apply_keyframe(scene, changes):
+    """
+    Moves the camera, the lights and the objects of the scene as described by a keyframe.
+
+    :param scene: Scene
+    :param changes: dict
+    :return: array<int> indices of the objects that moved
+    """
+    for key in changes:
+        if key not in ("camera", "light", "lights", "objects"):
+            raise ValueError(f'Unknown keyframe key "{key}", expected "camera", "light", "lights" or "objects"')
+
+    if "camera" in changes:
+        __move(scene.camera, changes["camera"])
+
+    # A single light is moved with "light", a list of lights with "lights"
+    single = isinstance(scene.light, Light)
+
+    if ("light" in changes and not single) or ("lights" in changes and single):
+        raise ValueError(f'The scene has {"one light" if single else "a list of lights"}, '
+                         f'use the "{"light" if single else "lights"}" keyframe key')
+
+    if "light" in changes:
+        __move(scene.light, changes["light"])
+
+    for index, change in changes.get("lights", {}).items():
+        __move(scene.light[int(index)], change)
+
+    moved = []
+
+    for index, change in changes.get("objects", {}).items():
+        index = int(index)
+        __move(scene.objects[index], change)
+        moved.append(index)
+
+    return moved
+
+
+def __move(transform, change):
+    position, rotation = change.get("position"), change.get("rotation")
+
+    # Lists come from keyframes that were read from a file
+    if isinstance(position, (list, tuple)):
+        position = Vector3(*position)
+
+    if isinstance(rotation, (list, tuple)):
+        rotation = Vector3(*rotation)
+
+    transform.move(position, rotation)
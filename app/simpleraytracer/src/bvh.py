@@ -0,0 +1,750 @@
+import math
+
+import numpy as np
+
+from .compiled import *
+from .objects import *
+
+"""-------------------------------------------Bounding volume hierarchy----------------------------------------------"""
+
+
+class BVH:
+    """
+    Bounding volume hierarchy over the bounded shapes of a scene, built with the binned surface area heuristic.
+
+    Shapes without a bounding box (e.g. planes) are kept in a separate list and tested against every ray.
+
+    The tree is built over a CompiledGeometry, which is compiled from the shapes when they are given as a list.
+    The batch queries test all packed spheres of a leaf, and all packed unbounded planes, in one vectorized pass.
+    The scalar queries test the packed spheres and planes from tuples of their packed constants, read once from the
+    arrays, since indexing numpy arrays one float at a time is slower than the shapes' own methods. The other shapes,
+    e.g. meshes and instances, go through their methods in both kinds of queries.
+
+    The batch queries traverse the tree with packets of rays, which share the numpy calls of a node between rays
+    that take the same path. Incoherent rays, e.g. shadow rays, split the packets until the numpy overhead of a node
+    outweighs its work, so packets smaller than PACKET_MIN_RAYS continue ray by ray: every (ray, node) pair is one
+    entry of a single work list that goes down the tree one level per step, with one set of numpy calls per level.
+    """
+
+    # Relative cost of visiting a node compared to a single intersection test
+    TRAVERSAL_COST = 1.0
+
+    # Packets with fewer rays are traversed ray by ray
+    PACKET_MIN_RAYS = 256
+
+    def __init__(self, geometry_objects, leaf_size=4, bins=12):
+        """
+        :param geometry_objects: array<Shape> or CompiledGeometry
+        :param leaf_size: int
+        :param bins: int
+        """
+        if isinstance(geometry_objects, CompiledGeometry):
+            self.geometry = geometry_objects
+        else:
+            self.geometry = CompiledGeometry(geometry_objects)
+
+        self.objects = list(self.geometry.objects)
+        self.leaf_size = leaf_size
+        self.bins = bins
+
+        bounded = self.geometry.bounded()
+        self.unbounded = np.flatnonzero(~bounded).tolist()
+
+        # Nodes are stored flat as (min_x, min_y, min_z, max_x, max_y, max_z, left, right, first, count),
+        # leaves have no children and reference the range [first, first + count) of self.primitives
+        self.nodes = []
+        self.primitives = []
+
+        if bounded.any():
+            indices = np.flatnonzero(bounded)
+            self.nodes, order = BVH.build_tree(
+                self.geometry.box_min[indices],
+                self.geometry.box_max[indices],
+                leaf_size,
+                bins
+            )
+            self.primitives = indices[order].tolist()
+
+        self.unbounded_objects = [self.objects[i] for i in self.unbounded]
+        self.primitive_objects = [self.objects[i] for i in self.primitives]
+
+        # The packed primitives of the scalar queries, in the order of self.unbounded and self.primitives
+        self.__unbounded_tests = self.__scalar_tests(self.unbounded)
+        self.__primitive_tests = self.__scalar_tests(self.primitives)
+
+        # The packed primitives of the batch queries: the unbounded ones, and those of every leaf by node
+        self.__unbounded_group = self.__group(self.unbounded)
+        self.__leaf_groups = {
+            k: self.__group(self.primitives[node[8]:node[8] + node[9]])
+            for k, node in enumerate(self.nodes) if node[6] < 0
+        }
+
+        nodes = np.array(self.nodes, dtype=np.float64).reshape((-1, 10))
+        self.node_min = nodes[:, 0:3]
+        self.node_max = nodes[:, 3:6]
+
+        # Traversal ray by ray: the children of every node, and the objects of every leaf padded with -1
+        leaves = [k for k, node in enumerate(self.nodes) if node[6] < 0]
+        self.__children = nodes[:, 6:8].astype(np.intp)
+        self.__node_leaves = np.full(len(self.nodes), -1, dtype=np.intp)
+        self.__node_leaves[leaves] = np.arange(len(leaves))
+        self.__leaf_objects = np.full((len(leaves), max((self.nodes[k][9] for k in leaves), default=0)), -1, np.intp)
+
+        for leaf, k in enumerate(leaves):
+            first, count = self.nodes[k][8:10]
+            self.__leaf_objects[leaf, :count] = self.primitives[first:first + count]
+
+        # Built on the first refit
+        self.__parents = None
+        self.__leaves = None
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __scalar_tests(self, indices):
+        """
+        Reads the packed constants of objects for the scalar queries.
+
+        :param indices: array<int> indices into self.objects
+        :return: array<tuple> (SPHERE, Shape, center x, center y, center z, squared radius),
+                 (PLANE, Shape, normal x, normal y, normal z, offset) or (SHAPE, Shape)
+        """
+        geometry = self.geometry
+        tests = []
+
+        for i in indices:
+            kind, row = int(geometry.kinds[i]), geometry.rows[i]
+
+            if kind == SPHERE:
+                tests.append((SPHERE, self.objects[i], *geometry.sphere_centers[row].tolist(),
+                              float(geometry.sphere_radii_squared[row])))
+            elif kind == PLANE:
+                tests.append((PLANE, self.objects[i], *geometry.plane_normals[row].tolist(),
+                              float(geometry.plane_offsets[row])))
+            else:
+                tests.append((SHAPE, self.objects[i]))
+
+        return tests
+
+    def __group(self, indices):
+        """
+        Splits objects by how the batch queries intersect them.
+
+        :param indices: array<int> indices into self.objects
+        :return: (numpy.ndarray<int> sphere rows, numpy.ndarray<int> sphere indices,
+                  numpy.ndarray<int> plane rows, numpy.ndarray<int> plane indices, array<int> other indices)
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        kinds = self.geometry.kinds[indices]
+        spheres = indices[kinds == SPHERE]
+        planes = indices[kinds == PLANE]
+
+        return (
+            self.geometry.rows[spheres],
+            spheres,
+            self.geometry.rows[planes],
+            planes,
+            indices[kinds == SHAPE].tolist()
+        )
+
+    def refit(self, moved):
+        """
+        Updates the bounding boxes after the given objects moved, without rebuilding the tree.
+
+        Only the leaves that contain a moved object and their ancestors are recomputed, the subtrees of static
+        objects are kept as they are. The tree keeps its original structure, so it gets slower to traverse
+        the further the objects move from where it was built.
+
+        :param moved: array<int> indices into self.objects
+        """
+        self.geometry = self.geometry.update(moved)
+
+        for tests, indices in ((self.__unbounded_tests, self.unbounded), (self.__primitive_tests, self.primitives)):
+            positions = {i: p for p, i in enumerate(indices)}
+
+            for i in moved:
+                if i in positions:
+                    tests[positions[i]] = self.__scalar_tests([i])[0]
+
+        if not self.nodes:
+            return
+
+        if self.__parents is None:
+            self.__parents = [-1] * len(self.nodes)
+            self.__leaves = {}
+
+            for k, node in enumerate(self.nodes):
+                if node[6] >= 0:
+                    self.__parents[node[6]] = self.__parents[node[7]] = k
+                else:
+                    for p in range(node[8], node[8] + node[9]):
+                        self.__leaves[self.primitives[p]] = k
+
+        dirty = {self.__leaves[i] for i in moved if i in self.__leaves}
+
+        # Children are always stored after their parent, so visiting the nodes backwards refits the children first
+        while dirty:
+            k = max(dirty)
+            dirty.remove(k)
+            node = self.nodes[k]
+
+            if node[6] < 0:
+                members = self.primitives[node[8]:node[8] + node[9]]
+                box_min = self.geometry.box_min[members].min(axis=0)
+                box_max = self.geometry.box_max[members].max(axis=0)
+            else:
+                box_min = np.minimum(self.node_min[node[6]], self.node_min[node[7]])
+                box_max = np.maximum(self.node_max[node[6]], self.node_max[node[7]])
+
+            self.nodes[k] = (*box_min.tolist(), *box_max.tolist(), *node[6:])
+            self.node_min[k] = box_min
+            self.node_max[k] = box_max
+
+            if self.__parents[k] >= 0:
+                dirty.add(self.__parents[k])
+
+    @staticmethod
+    def build_tree(minimums, maximums, leaf_size=4, bins=12):
+        """
+        Builds the nodes of a tree over boxes iteratively, every entry of the stack is a node and the boxes it encloses.
+
+        The first and count of the leaves reference the returned order, which lists the indices of the boxes
+        so that the boxes of every leaf are contiguous.
+
+        :param minimums: numpy.ndarray
+        :param maximums: numpy.ndarray
+        :param leaf_size: int
+        :param bins: int
+        :return: array<tuple> nodes, numpy.ndarray<int> order
+        """
+        centroids = (minimums + maximums) / 2
+        nodes = [None]
+        order = []
+        stack = [(0, np.arange(len(minimums)))]
+
+        while stack:
+            node, members = stack.pop()
+            box_min = minimums[members].min(axis=0)
+            box_max = maximums[members].max(axis=0)
+
+            split = BVH.__find_split(members, centroids, minimums, maximums, box_min, box_max, leaf_size, bins)
+
+            if split is None:
+                nodes[node] = (*box_min.tolist(), *box_max.tolist(), -1, -1, len(order), len(members))
+                order.extend(members.tolist())
+                continue
+
+            left = len(nodes)
+            nodes.extend([None, None])
+            nodes[node] = (*box_min.tolist(), *box_max.tolist(), left, left + 1, -1, 0)
+
+            stack.append((left, members[split]))
+            stack.append((left + 1, members[~split]))
+
+        return nodes, np.array(order, dtype=np.intp)
+
+    @staticmethod
+    def __find_split(members, centroids, minimums, maximums, box_min, box_max, leaf_size, bins):
+        """
+        Finds the cheapest split of a node according to the surface area heuristic.
+
+        :param members: numpy.ndarray<int>
+        :param centroids: numpy.ndarray
+        :param minimums: numpy.ndarray
+        :param maximums: numpy.ndarray
+        :param box_min: numpy.ndarray
+        :param box_max: numpy.ndarray
+        :param leaf_size: int
+        :param bins: int
+        :return: numpy.ndarray<bool> mask of the members on the left side, or None if the node should be a leaf
+        """
+        count = len(members)
+
+        if count <= leaf_size:
+            return None
+
+        member_centroids = centroids[members]
+        low = member_centroids.min(axis=0)
+        high = member_centroids.max(axis=0)
+        extent = high - low
+
+        # All centroids coincide, split the shapes in half so the build always terminates
+        if not (extent > 0).any():
+            split = np.zeros(count, dtype=bool)
+            split[:count // 2] = True
+            return split
+
+        # Binning costs more than it saves on small nodes, they are split in half along their longest axis
+        if count <= bins * 2:
+            axis = int(np.argmax(extent))
+            split = np.zeros(count, dtype=bool)
+            split[np.argpartition(member_centroids[:, axis], count // 2)[:count // 2]] = True
+            return split
+
+        parent_area = max(BVH.__area(box_min, box_max), 1E-12)
+
+        # All three axes are binned at once, slots are offset by axis * bins so that they index a (3 * bins) table
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slots = np.nan_to_num((member_centroids - low) / extent * bins)
+
+        slots = np.minimum(slots.astype(np.intp), bins - 1) + np.arange(3) * bins
+
+        counts = np.bincount(slots.ravel(), minlength=3 * bins).reshape((3, bins))
+        bin_min = np.full((3 * bins, 3), np.inf)
+        bin_max = np.full((3 * bins, 3), -np.inf)
+        np.minimum.at(bin_min, slots.ravel(), np.repeat(minimums[members], 3, axis=0))
+        np.maximum.at(bin_max, slots.ravel(), np.repeat(maximums[members], 3, axis=0))
+        bin_min = bin_min.reshape((3, bins, 3))
+        bin_max = bin_max.reshape((3, bins, 3))
+
+        left_count = np.cumsum(counts, axis=1)[:, :-1]
+        right_count = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        left_area = BVH.__area(np.minimum.accumulate(bin_min, axis=1)[:, :-1],
+                               np.maximum.accumulate(bin_max, axis=1)[:, :-1])
+        right_area = BVH.__area(np.minimum.accumulate(bin_min[:, ::-1], axis=1)[:, ::-1][:, 1:],
+                                np.maximum.accumulate(bin_max[:, ::-1], axis=1)[:, ::-1][:, 1:])
+
+        with np.errstate(invalid='ignore'):
+            costs = (left_area * left_count + right_area * right_count) / parent_area
+
+        costs = np.where((left_count > 0) & (right_count > 0) & (extent > 0)[:, None], costs, np.inf)
+        best_axis, best_bin = np.unravel_index(np.argmin(costs), costs.shape)
+        best_cost = costs[best_axis, best_bin]
+
+        if best_cost == math.inf:
+            return None
+
+        # Splitting is not worth it when intersecting all the shapes is cheaper, unless the leaf would be too large
+        if BVH.TRAVERSAL_COST + best_cost >= count and count <= leaf_size * 4:
+            return None
+
+        return slots[:, best_axis] - best_axis * bins <= best_bin
+
+    @staticmethod
+    def __area(box_min, box_max):
+        extent = np.maximum(box_max - box_min, 0)
+        return 2 * (extent[..., 0] * extent[..., 1] + extent[..., 1] * extent[..., 2] + extent[..., 2] * extent[..., 0])
+
+    @staticmethod
+    def __slab(node, ox, oy, oz, ix, iy, iz):
+        """
+        Returns the distance at which the ray enters the node's box, or infinity if it misses it.
+        """
+        t1 = (node[0] - ox) * ix
+        t2 = (node[3] - ox) * ix
+        t_min, t_max = (t1, t2) if t1 < t2 else (t2, t1)
+
+        t1 = (node[1] - oy) * iy
+        t2 = (node[4] - oy) * iy
+        if t1 > t2:
+            t1, t2 = t2, t1
+        t_min = t1 if t1 > t_min else t_min
+        t_max = t2 if t2 < t_max else t_max
+
+        t1 = (node[2] - oz) * iz
+        t2 = (node[5] - oz) * iz
+        if t1 > t2:
+            t1, t2 = t2, t1
+        t_min = t1 if t1 > t_min else t_min
+        t_max = t2 if t2 < t_max else t_max
+
+        if t_min < 0:
+            t_min = 0
+
+        return t_min if t_max >= t_min else math.inf
+
+    @staticmethod
+    def __slab_batch(node_min, node_max, origins, inverse):
+        """
+        Vectorized version of __slab for a packet of rays, returns the entry and exit distances of the rays.
+        """
+        t1 = (node_min - origins) * inverse
+        t2 = (node_max - origins) * inverse
+
+        return np.maximum(np.minimum(t1, t2).max(axis=1), 0), np.maximum(t1, t2).min(axis=1)
+
+    @staticmethod
+    def __hit(test, ray, ox, oy, oz, dx, dy, dz):
+        """
+        Intersects a ray with an object of the scalar queries, see __scalar_tests.
+
+        :return: float distance, infinity if the ray misses
+        """
+        kind = test[0]
+
+        if kind == SPHERE:
+            # Same arithmetic as Sphere.calculate_intersection, the direction is a unit vector
+            _, _, cx, cy, cz, radius_squared = test
+            px, py, pz = ox - cx, oy - cy, oz - cz
+            b = 2 * (dx * px + dy * py + dz * pz)
+            discriminant = b * b - 4 * (px * px + py * py + pz * pz - radius_squared)
+
+            if discriminant > 0:
+                root = math.sqrt(discriminant)
+                x1 = (-b + root) / 2
+                x2 = (-b - root) / 2
+
+                if x1 > 0 and x2 > 0:
+                    return min(x1, x2)
+
+            return math.inf
+
+        if kind == PLANE:
+            # Like Plane.calculate_intersection, the direction does not have to be a unit vector
+            _, _, nx, ny, nz, offset = test
+            denominator = (dx * nx + dy * ny + dz * nz) / math.sqrt(dx * dx + dy * dy + dz * dz)
+
+            if abs(denominator) > 1E-5:
+                t = (offset - (ox * nx + oy * ny + oz * nz)) / denominator
+
+                if t >= 0:
+                    return t
+
+            return math.inf
+
+        return test[1].calculate_intersection(ray)
+
+    @staticmethod
+    def __inverse(d):
+        # A large finite value instead of infinity avoids 0 * inf for rays parallel to a slab
+        return 1.0 / d if d != 0 else 1E300
+
+    def closest_intersection(self, ray):
+        """
+        Finds the first object that the ray intersects.
+
+        :param ray: Ray
+        :return: float, Shape
+        """
+        closest, closest_obj = math.inf, None
+        hit = BVH.__hit
+        ox, oy, oz = ray.origin.x, ray.origin.y, ray.origin.z
+        dx, dy, dz = ray.direction.x, ray.direction.y, ray.direction.z
+
+        for test in self.__unbounded_tests:
+            distance = hit(test, ray, ox, oy, oz, dx, dy, dz)
+
+            if distance < closest:
+                closest, closest_obj = distance, test[1]
+
+        if not self.nodes:
+            return closest, closest_obj
+
+        nodes = self.nodes
+        primitives = self.__primitive_tests
+        slab = BVH.__slab
+        ix, iy, iz = BVH.__inverse(dx), BVH.__inverse(dy), BVH.__inverse(dz)
+
+        if slab(nodes[0], ox, oy, oz, ix, iy, iz) == math.inf:
+            return closest, closest_obj
+
+        stack = [0]
+
+        while stack:
+            node = nodes[stack.pop()]
+
+            if node[6] < 0:
+                for test in primitives[node[8]:node[8] + node[9]]:
+                    distance = hit(test, ray, ox, oy, oz, dx, dy, dz)
+
+                    if distance < closest:
+                        closest, closest_obj = distance, test[1]
+
+                continue
+
+            left = slab(nodes[node[6]], ox, oy, oz, ix, iy, iz)
+            right = slab(nodes[node[7]], ox, oy, oz, ix, iy, iz)
+
+            # Visit the nearer child first, skip children that start behind the closest hit
+            if left <= right:
+                if right < closest:
+                    stack.append(node[7])
+                if left < closest:
+                    stack.append(node[6])
+            else:
+                if left < closest:
+                    stack.append(node[6])
+                if right < closest:
+                    stack.append(node[7])
+
+        return closest, closest_obj
+
+    def find_occluder(self, ray, max_distance):
+        """
+        Finds any object that the ray intersects before max_distance, the traversal stops at the first one found.
+
+        :param ray: Ray
+        :param max_distance: float
+        :return: Shape, or None if nothing blocks the ray
+        """
+        hit = BVH.__hit
+        ox, oy, oz = ray.origin.x, ray.origin.y, ray.origin.z
+        dx, dy, dz = ray.direction.x, ray.direction.y, ray.direction.z
+
+        for test in self.__unbounded_tests:
+            if hit(test, ray, ox, oy, oz, dx, dy, dz) < max_distance:
+                return test[1]
+
+        if not self.nodes:
+            return None
+
+        nodes = self.nodes
+        primitives = self.__primitive_tests
+        slab = BVH.__slab
+        ix, iy, iz = BVH.__inverse(dx), BVH.__inverse(dy), BVH.__inverse(dz)
+
+        stack = [0]
+
+        while stack:
+            node = nodes[stack.pop()]
+
+            if slab(node, ox, oy, oz, ix, iy, iz) >= max_distance:
+                continue
+
+            if node[6] < 0:
+                for test in primitives[node[8]:node[8] + node[9]]:
+                    if hit(test, ray, ox, oy, oz, dx, dy, dz) < max_distance:
+                        return test[1]
+            else:
+                stack.append(node[7])
+                stack.append(node[6])
+
+        return None
+
+    def closest_intersection_batch(self, origins, directions):
+        """
+        Vectorized version of closest_intersection, the rays are traversed through the tree as packets.
+
+        :param origins: numpy.ndarray
+        :param directions: numpy.ndarray
+        :return: numpy.ndarray<float> distances, numpy.ndarray<int> indices into self.objects or -1 for misses
+        """
+        origins = np.broadcast_to(origins, directions.shape)
+        distances = np.full(len(directions), np.inf)
+        indices = np.full(len(directions), -1, dtype=np.intp)
+
+        if self.unbounded:
+            group_distances, group_indices = self.__intersect_group(self.__unbounded_group, origins, directions)
+            nearest = group_distances.argmin(axis=1)
+            distances = group_distances[np.arange(len(directions)), nearest]
+            indices = np.where(np.isfinite(distances), group_indices[nearest], -1)
+
+        if not self.nodes:
+            return distances, indices
+
+        inverse = np.divide(1.0, directions, out=np.full(directions.shape, 1E300), where=directions != 0)
+        stack = [(0, np.arange(len(directions)))]
+        deferred = []
+
+        while stack:
+            k, rays = stack.pop()
+            node = self.nodes[k]
+
+            if len(rays) < BVH.PACKET_MIN_RAYS:
+                deferred.append((k, rays))
+                continue
+
+            t_min, t_max = BVH.__slab_batch(self.node_min[k], self.node_max[k], origins[rays], inverse[rays])
+            rays = rays[(t_max >= t_min) & (t_min < distances[rays])]
+
+            if not rays.size:
+                continue
+
+            if node[6] >= 0:
+                stack.append((node[7], rays))
+                stack.append((node[6], rays))
+                continue
+
+            group_distances, group_indices = self.__intersect_group(self.__leaf_groups[k], origins[rays],
+                                                                    directions[rays])
+            nearest = group_distances.argmin(axis=1)
+            leaf_distances = group_distances[np.arange(len(rays)), nearest]
+            closer = leaf_distances < distances[rays]
+
+            distances[rays[closer]] = leaf_distances[closer]
+            indices[rays[closer]] = group_indices[nearest[closer]]
+
+        if deferred:
+            self.__closest_per_ray(deferred, origins, directions, inverse, distances, indices)
+
+        return distances, indices
+
+    def occluded_batch(self, origins, directions, max_distances):
+        """
+        Vectorized version of find_occluder, rays leave the traversal as soon as they are found to be occluded.
+
+        :param origins: numpy.ndarray
+        :param directions: numpy.ndarray
+        :param max_distances: numpy.ndarray<float>
+        :return: numpy.ndarray<bool>
+        """
+        origins = np.broadcast_to(origins, directions.shape)
+        occluded = np.zeros(len(directions), dtype=bool)
+
+        if self.unbounded:
+            distances, _ = self.__intersect_group(self.__unbounded_group, origins, directions)
+            occluded = (distances < max_distances[:, None]).any(axis=1)
+
+        if not self.nodes:
+            return occluded
+
+        inverse = np.divide(1.0, directions, out=np.full(directions.shape, 1E300), where=directions != 0)
+        stack = [(0, np.flatnonzero(~occluded))]
+        deferred = []
+
+        while stack:
+            k, rays = stack.pop()
+            rays = rays[~occluded[rays]]
+
+            if not rays.size:
+                continue
+
+            if len(rays) < BVH.PACKET_MIN_RAYS:
+                deferred.append((k, rays))
+                continue
+
+            node = self.nodes[k]
+            t_min, t_max = BVH.__slab_batch(self.node_min[k], self.node_max[k], origins[rays], inverse[rays])
+            rays = rays[(t_max >= t_min) & (t_min < max_distances[rays])]
+
+            if not rays.size:
+                continue
+
+            if node[6] >= 0:
+                stack.append((node[7], rays))
+                stack.append((node[6], rays))
+                continue
+
+            distances, _ = self.__intersect_group(self.__leaf_groups[k], origins[rays], directions[rays])
+            occluded[rays] = (distances < max_distances[rays, None]).any(axis=1)
+
+        if deferred:
+            self.__occluded_per_ray(deferred, origins, directions, inverse, max_distances, occluded)
+
+        return occluded
+
+    def __closest_per_ray(self, deferred, origins, directions, inverse, distances, indices):
+        """
+        Finishes the closest hit traversal of the packets that were deferred, ray by ray.
+
+        :param deferred: array<(int node, numpy.ndarray<int> rays)>
+        :param origins: numpy.ndarray
+        :param directions: numpy.ndarray
+        :param inverse: numpy.ndarray
+        :param distances: numpy.ndarray<float> closest distances so far, updated in place
+        :param indices: numpy.ndarray<int> closest objects so far, updated in place
+        """
+        rays, nodes = BVH.__pairs(deferred)
+
+        while rays.size:
+            t_min, t_max = BVH.__slab_batch(self.node_min[nodes], self.node_max[nodes], origins[rays], inverse[rays])
+            hit = (t_max >= t_min) & (t_min < distances[rays])
+            rays, nodes = rays[hit], nodes[hit]
+
+            leaves = self.__node_leaves[nodes] >= 0
+            hit_rays, hit_objects, hit_distances = self.__intersect_leaves(
+                rays[leaves], nodes[leaves], origins, directions
+            )
+
+            # The nearest hit of every ray is the first one after sorting by ray and distance
+            order = np.lexsort((hit_distances, hit_rays))
+            hit_rays, hit_objects, hit_distances = hit_rays[order], hit_objects[order], hit_distances[order]
+            first = np.ones(len(hit_rays), dtype=bool)
+            first[1:] = hit_rays[1:] != hit_rays[:-1]
+            closer = first & (hit_distances < distances[hit_rays])
+
+            distances[hit_rays[closer]] = hit_distances[closer]
+            indices[hit_rays[closer]] = hit_objects[closer]
+
+            rays, nodes = np.tile(rays[~leaves], 2), self.__children[nodes[~leaves]].T.ravel()
+
+    def __occluded_per_ray(self, deferred, origins, directions, inverse, max_distances, occluded):
+        """
+        Finishes the occlusion traversal of the packets that were deferred, ray by ray.
+
+        :param deferred: array<(int node, numpy.ndarray<int> rays)>
+        :param origins: numpy.ndarray
+        :param directions: numpy.ndarray
+        :param inverse: numpy.ndarray
+        :param max_distances: numpy.ndarray<float>
+        :param occluded: numpy.ndarray<bool> updated in place
+        """
+        rays, nodes = BVH.__pairs(deferred)
+
+        while rays.size:
+            t_min, t_max = BVH.__slab_batch(self.node_min[nodes], self.node_max[nodes], origins[rays], inverse[rays])
+            hit = (t_max >= t_min) & (t_min < max_distances[rays]) & ~occluded[rays]
+            rays, nodes = rays[hit], nodes[hit]
+
+            leaves = self.__node_leaves[nodes] >= 0
+            hit_rays, _, hit_distances = self.__intersect_leaves(rays[leaves], nodes[leaves], origins, directions)
+            occluded[hit_rays[hit_distances < max_distances[hit_rays]]] = True
+
+            rays, nodes = np.tile(rays[~leaves], 2), self.__children[nodes[~leaves]].T.ravel()
+
+    @staticmethod
+    def __pairs(deferred):
+        """
+        :param deferred: array<(int node, numpy.ndarray<int> rays)>
+        :return: numpy.ndarray<int> rays, numpy.ndarray<int> nodes of the (ray, node) pairs
+        """
+        rays = np.concatenate([rays for _, rays in deferred])
+        nodes = np.repeat([k for k, _ in deferred], [len(rays) for _, rays in deferred])
+
+        return rays, nodes
+
+    def __intersect_leaves(self, rays, nodes, origins, directions):
+        """
+        Intersects every ray with the objects of its own leaf.
+
+        :param rays: numpy.ndarray<int> (N,)
+        :param nodes: numpy.ndarray<int> (N,) leaf nodes
+        :param origins: numpy.ndarray
+        :param directions: numpy.ndarray
+        :return: numpy.ndarray<int> rays, numpy.ndarray<int> objects, numpy.ndarray<float> distances of the hits
+        """
+        members = self.__leaf_objects[self.__node_leaves[nodes]]
+        pairs, slots = np.nonzero(members >= 0)
+        rays, objects = rays[pairs], members[pairs, slots]
+        distances = np.full(len(rays), np.inf)
+
+        spheres = self.geometry.kinds[objects] == SPHERE
+        distances[spheres] = self.geometry.intersect_sphere_pairs(
+            self.geometry.rows[objects[spheres]], origins[rays[spheres]], directions[rays[spheres]]
+        )
+
+        # Leaves hold few other shapes, e.g. meshes and instances, each one tests all of its rays at once
+        for k in np.unique(objects[~spheres]).tolist():
+            tested = objects == k
+            distances[tested] = self.objects[k].calculate_intersection_batch(
+                origins[rays[tested]], directions[rays[tested]]
+            )
+
+        hits = distances < np.inf
+
+        return rays[hits], objects[hits], distances[hits]
+
+    def __intersect_group(self, group, origins, directions):
+        """
+        Intersects rays with a group of objects made by __group, the packed spheres and planes are tested at once.
+
+        :param group: tuple
+        :param origins: numpy.ndarray (N, 3)
+        :param directions: numpy.ndarray (N, 3)
+        :return: numpy.ndarray (N, M) distances, numpy.ndarray<int> (M,) indices into self.objects of the M objects
+        """
+        sphere_rows, spheres, plane_rows, planes, others = group
+        columns = []
+
+        if len(spheres):
+            columns.append(self.geometry.intersect_spheres(sphere_rows, origins, directions))
+
+        if len(planes):
+            columns.append(self.geometry.intersect_planes(plane_rows, origins, directions))
+
+        for k in others:
+            columns.append(self.objects[k].calculate_intersection_batch(origins, directions)[:, None])
+
+        distances = columns[0] if len(columns) == 1 else np.concatenate(columns, axis=1)
+
+        return distances, np.concatenate([spheres, planes, np.array(others, dtype=np.intp)])
@@ -0,0 +1,157 @@
+import argparse
+import contextlib
+import functools
+import os
+import sys
+import time
+
+from .image import *
+from .raytracer import *
+from .scene import *
+
+# Environment variable with the key that the coordinator and its workers authenticate each other with
+AUTHKEY_VARIABLE = "SIMPLERAYTRACER_AUTHKEY"
+
+"""-------------------------------------------Command line-----------------------------------------------------------"""
+
+
+def main(argv=None):
+    """
+    Renders a scene file to an image file, the entry point of the simpleraytracer command.
+
+    :param argv: array<str>, None uses the arguments of the process
+    :return: int exit status
+    """
+    parser = argparse.ArgumentParser(
+        prog="simpleraytracer",
+        description="Renders a JSON, TOML or binary scene file to an image file"
+    )
+    parser.add_argument("scene", help="scene file")
+    parser.add_argument("-o", "--output", required=True,
+                        help=f"image file, {', '.join(BUILTIN_IMAGE_FORMATS)} need no optional dependencies")
+    parser.add_argument("--shadow-samples", type=int, help="shadow rays per surface point")
+    parser.add_argument("--backend", choices=("python", "numpy"))
+    parser.add_argument("--workers", type=int, help="worker processes, 0 uses all CPU cores")
+    parser.add_argument("--tile-size", type=int)
+    parser.add_argument("--antialiasing", choices=("fixed", "adaptive"))
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--tone-mapping", choices=TONE_MAPPINGS)
+    parser.add_argument("--exposure", type=float)
+    parser.add_argument("--gamma", type=float)
+    parser.add_argument("--denoise", action="store_true", default=None,
+                        help="filters the shadow noise, so far fewer shadow samples are needed")
+    parser.add_argument("--progress", action="store_true", help="prints every finished tile to stderr")
+    parser.add_argument("--listen", type=parse_address, metavar="HOST:PORT",
+                        help=f"renders the tiles on simpleraytracer-worker processes that connect to this address, "
+                             f"authenticated with the key in ${AUTHKEY_VARIABLE}")
+    parser.add_argument("--tile-timeout", type=float,
+                        help="seconds after which a tile that a worker did not return is rendered by another one")
+    parser.add_argument("--idle-timeout", type=float, default=60.0,
+                        help="seconds after which the render fails when no worker is connected and no tile was "
+                             "finished")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+
+    # Errors of the scene file, the render and the output are reported without a traceback, SceneError is a ValueError
+    errors = (OSError, ImportError, ValueError)
+    open_coordinator = contextlib.nullcontext
+
+    if args.listen is not None:
+        authkey = os.environ.get(AUTHKEY_VARIABLE)
+
+        if not authkey:
+            print(f"simpleraytracer: --listen needs a shared key in ${AUTHKEY_VARIABLE}", file=sys.stderr)
+            return 1
+
+        from .distributed import RemoteRenderError, RenderCoordinator  # Only imported when rendering on workers
+
+        errors += (RemoteRenderError,)
+        open_coordinator = functools.partial(RenderCoordinator, args.listen, authkey.encode(), args.tile_timeout,
+                                             args.idle_timeout)
+
+    # Options given on the command line override the ones stored in the scene
+    options = {
+        name: getattr(args, name)
+        for name in ("shadow_samples", "backend", "workers", "tile_size", "antialiasing", "seed", "tone_mapping",
+                     "exposure", "gamma", "denoise")
+        if getattr(args, name) is not None
+    }
+
+    if options.get("workers") == 0:
+        options["workers"] = None
+
+    if args.progress:
+        def progress(rows, cols, finished, total):
+            print(f"tile {finished}/{total} rows {rows.start}:{rows.stop} cols {cols.start}:{cols.stop} "
+                  f"{time.perf_counter() - start:.3f}s", file=sys.stderr, flush=True)
+
+        options["progress"] = progress
+
+    try:
+        with open_coordinator() as active:
+            scene = Scene.load(args.scene)
+
+            if active is not None:
+                host, port = active.address
+                print(f"simpleraytracer: waiting for workers on {host}:{port}", file=sys.stderr, flush=True)
+                options["coordinator"] = active
+
+            save_image(args.output, scene.render(**options))
+    except errors as error:
+        print(f"simpleraytracer: {error}", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+def worker_main(argv=None):
+    """
+    Renders tiles for a coordinator started with simpleraytracer --listen, the entry point of the
+    simpleraytracer-worker command.
+
+    :param argv: array<str>, None uses the arguments of the process
+    :return: int exit status
+    """
+    parser = argparse.ArgumentParser(
+        prog="simpleraytracer-worker",
+        description=f"Renders tiles for a simpleraytracer coordinator until it disconnects, authenticated with the key "
+                    f"in ${AUTHKEY_VARIABLE}"
+    )
+    parser.add_argument("address", type=parse_address, metavar="HOST:PORT", help="address of the coordinator")
+    parser.add_argument("--connect-timeout", type=float, default=10.0,
+                        help="seconds to keep retrying while the coordinator is not listening yet")
+    args = parser.parse_args(argv)
+
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+
+    if not authkey:
+        print(f"simpleraytracer-worker: a shared key is needed in ${AUTHKEY_VARIABLE}", file=sys.stderr)
+        return 1
+
+    from multiprocessing import AuthenticationError
+
+    from .distributed import run_worker
+
+    try:
+        rendered = run_worker(args.address, authkey.encode(), args.connect_timeout)
+    except (OSError, AuthenticationError) as error:
+        print(f"simpleraytracer-worker: {error}", file=sys.stderr)
+        return 1
+
+    print(f"simpleraytracer-worker: rendered {rendered} tiles", file=sys.stderr)
+
+    return 0
+
+
+def parse_address(value):
+    """
+    :param value: str HOST:PORT
+    :return: (str host, int port)
+    """
+    host, separator, port = value.rpartition(":")
+
+    if not separator or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"expected HOST:PORT, got {value!r}")
+
+    return host or "127.0.0.1", int(port)
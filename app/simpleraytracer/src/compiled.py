@@ -0,0 +1,235 @@
+import copy
+
+import numpy as np
+
+from .objects import *
+
+# Primitive types of CompiledGeometry, shapes of any other type are intersected through their own methods
+PRIMITIVE_TYPES = ("sphere", "plane", "shape")
+SPHERE, PLANE, SHAPE = range(len(PRIMITIVE_TYPES))
+
+"""-------------------------------------------Compiled geometry------------------------------------------------------"""
+
+
+class CompiledGeometry:
+    """
+    The shapes of a scene packed into contiguous read-only arrays, grouped by primitive type, with the constants of
+    their intersection tests computed once: the center and squared radius of every sphere, and the unit normal and
+    offset along it of every plane. The diffuse color of the material of every object is packed for the auxiliary
+    buffers of the denoiser.
+
+    The packed tests expect unit ray directions, which every ray of the renderer has, so unlike
+    Plane.calculate_intersection they do not normalize them again. Shapes that are not exactly a Sphere or a Plane,
+    e.g. meshes and instances, keep their own intersection methods.
+
+    The arrays are never written after they are built, moving shapes produces a new CompiledGeometry with update.
+    They pickle as plain arrays, and parallel renders place the large ones in shared memory so that every worker
+    views the same copy.
+    """
+
+    # Arrays that parallel renders move into shared memory when they are large
+    SHARED_ARRAYS = (
+        "kinds", "rows", "box_min", "box_max", "sphere_objects", "sphere_centers", "sphere_radii_squared",
+        "plane_objects", "plane_normals", "plane_offsets", "diffuse"
+    )
+
+    def __init__(self, objects):
+        """
+        :param objects: array<Shape>
+        """
+        self.objects = tuple(objects)
+        count = len(self.objects)
+
+        # Type of every object and its row in the arrays of that type
+        self.kinds = np.array([CompiledGeometry.__kind(obj) for obj in self.objects], dtype=np.int8).reshape(count)
+        self.rows = np.zeros(count, dtype=np.intp)
+
+        self.sphere_objects = np.flatnonzero(self.kinds == SPHERE)
+        self.plane_objects = np.flatnonzero(self.kinds == PLANE)
+        self.rows[self.sphere_objects] = np.arange(len(self.sphere_objects))
+        self.rows[self.plane_objects] = np.arange(len(self.plane_objects))
+
+        # Unbounded objects have an empty box from +inf to -inf
+        self.box_min = np.full((count, 3), np.inf)
+        self.box_max = np.full((count, 3), -np.inf)
+
+        self.sphere_centers = np.zeros((len(self.sphere_objects), 3))
+        self.sphere_radii_squared = np.zeros(len(self.sphere_objects))
+        self.plane_normals = np.zeros((len(self.plane_objects), 3))
+        self.plane_offsets = np.zeros(len(self.plane_objects))
+
+        # Materials are not moved, they are only packed once
+        self.diffuse = np.array([Color.to_array(obj.material.diffuse) for obj in self.objects]).reshape((count, 3))
+
+        self.__pack(range(count))
+        self.__freeze()
+
+    def __len__(self):
+        return len(self.objects)
+
+    @staticmethod
+    def __kind(obj):
+        # Subclasses may intersect differently, only the exact types are packed
+        if type(obj) is Sphere:
+            return SPHERE
+
+        if type(obj) is Plane:
+            return PLANE
+
+        return SHAPE
+
+    def __pack(self, indices):
+        for i in indices:
+            obj = self.objects[i]
+            box = obj.bounding_box()
+
+            if box is not None:
+                self.box_min[i] = Vector3.to_array(box.minimum)
+                self.box_max[i] = Vector3.to_array(box.maximum)
+
+            row = self.rows[i]
+
+            if self.kinds[i] == SPHERE:
+                self.sphere_centers[row] = Vector3.to_array(obj.position)
+                self.sphere_radii_squared[row] = obj.radius ** 2
+            elif self.kinds[i] == PLANE:
+                normal = Vector3.to_array(obj.surface_normal)
+                self.plane_normals[row] = normal
+                self.plane_offsets[row] = Vector3.to_array(obj.position) @ normal
+
+    def __freeze(self):
+        for name in CompiledGeometry.SHARED_ARRAYS:
+            getattr(self, name).flags.writeable = False
+
+    def update(self, moved):
+        """
+        Packs the moved objects again, the arrays of this geometry stay as they are.
+
+        :param moved: array<int> indices into self.objects
+        :return: CompiledGeometry
+        """
+        geometry = copy.copy(self)
+
+        for name in ("box_min", "box_max", "sphere_centers", "sphere_radii_squared", "plane_normals", "plane_offsets"):
+            setattr(geometry, name, getattr(self, name).copy())
+
+        geometry.__pack(moved)
+        geometry.__freeze()
+
+        return geometry
+
+    def bounded(self):
+        """
+        :return: numpy.ndarray<bool> the objects that have a bounding box
+        """
+        return self.box_min[:, 0] <= self.box_max[:, 0]
+
+    def intersect_spheres(self, rows, origins, directions):
+        """
+        Intersects every ray with every one of the given spheres.
+
+        :param rows: numpy.ndarray<int> rows of the sphere arrays
+        :param origins: numpy.ndarray (N, 3)
+        :param directions: numpy.ndarray (N, 3) unit vectors
+        :return: numpy.ndarray (N, len(rows)) distances, infinity where a ray misses
+        """
+        return CompiledGeometry.__sphere_distances(
+            origins[:, None, :] - self.sphere_centers[rows], directions[:, None, :], self.sphere_radii_squared[rows]
+        )
+
+    def intersect_sphere_pairs(self, rows, origins, directions):
+        """
+        Intersects every ray with its own sphere, the i-th ray with the sphere in rows[i].
+
+        :param rows: numpy.ndarray<int> (N,) rows of the sphere arrays
+        :param origins: numpy.ndarray (N, 3)
+        :param directions: numpy.ndarray (N, 3) unit vectors
+        :return: numpy.ndarray (N,) distances, infinity where a ray misses
+        """
+        return CompiledGeometry.__sphere_distances(
+            origins - self.sphere_centers[rows], directions, self.sphere_radii_squared[rows]
+        )
+
+    @staticmethod
+    def __sphere_distances(offset, directions, radii_squared):
+        # a = 1, since the directions are unit vectors
+        b = 2 * Vector3.dot_batch(directions, offset)
+        c = Vector3.dot_batch(offset, offset) - radii_squared
+        discriminant = b ** 2 - 4 * c
+
+        root = np.sqrt(np.maximum(discriminant, 0))
+        x1 = (-b + root) / 2
+        x2 = (-b - root) / 2
+
+        return np.where((discriminant > 0) & (x1 > 0) & (x2 > 0), np.minimum(x1, x2), np.inf)
+
+    def intersect_planes(self, rows, origins, directions):
+        """
+        Intersects every ray with every one of the given planes.
+
+        :param rows: numpy.ndarray<int> rows of the plane arrays
+        :param origins: numpy.ndarray (N, 3)
+        :param directions: numpy.ndarray (N, 3) unit vectors
+        :return: numpy.ndarray (N, len(rows)) distances, infinity where a ray misses
+        """
+        normals = self.plane_normals[rows]
+        denominator = directions @ normals.T
+        valid = np.abs(denominator) > 1E-5
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (self.plane_offsets[rows] - origins @ normals.T) / denominator
+
+        return np.where(valid & (t >= 0), t, np.inf)
+
+
+"""-------------------------------------------Compiled scene---------------------------------------------------------"""
+
+
+class CompiledScene:
+    """
+    A scene frozen for rendering: its compiled geometry, the bounding volume hierarchy over it, its lights and camera.
+    """
+
+    def __init__(self, geometry, bvh, lights, camera):
+        """
+        :param geometry: CompiledGeometry
+        :param bvh: BVH over the geometry
+        :param lights: tuple<Light>
+        :param camera: Camera
+        """
+        self.geometry = geometry
+        self.bvh = bvh
+        self.lights = lights
+        self.camera = camera
+
+    def render(self, **options):
+        """
+        Renders the scene with the given keyword arguments of render.
+
+        :return: numpy.ndarray
+        """
+        from .raytracer import render  # The raytracer imports this module through the BVH
+
+        return render(self.bvh, list(self.lights), self.camera, **options)
+
+
+def compile_scene(objects, light, camera):
+    """
+    Compiles the shapes of a scene into packed arrays and builds the bounding volume hierarchy over them once,
+    so a scene that is rendered many times is only prepared once.
+
+    :param objects: array<Shape>
+    :param light: Light or array<Light>
+    :param camera: Camera
+    :return: CompiledScene
+    """
+    from .bvh import BVH  # The BVH is built over the compiled geometry
+
+    lights = (light,) if isinstance(light, Light) else tuple(light)
+
+    if not lights:
+        raise ValueError('A scene needs at least one light')
+
+    geometry = CompiledGeometry(objects)
+
+    return CompiledScene(geometry, BVH(geometry), lights, camera)
@@ -0,0 +1,229 @@
+import numpy as np
+
+# Channels of the auxiliary buffers in the order the tiles carry them after their radiance
+AUXILIARY_FIELDS = (("normal", 3), ("depth", 1), ("object", 1), ("albedo", 3), ("unshadowed", 3))
+AUXILIARY_CHANNELS = sum(channels for _, channels in AUXILIARY_FIELDS)
+AUXILIARY_SLICES = {
+    name: slice(end - channels, end)
+    for (name, channels), end in zip(AUXILIARY_FIELDS, np.cumsum([channels for _, channels in AUXILIARY_FIELDS]))
+}
+
+# B3 spline taps of the 5x5 a-trous kernel
+ATROUS_KERNEL = (1 / 16, 1 / 4, 3 / 8, 1 / 4, 1 / 16)
+
+"""-------------------------------------------Auxiliary buffers------------------------------------------------------"""
+
+
+class AuxiliaryBuffers:
+    """
+    Noise free per pixel features of a frame that guide the denoiser, filled in when it is passed to
+    render(auxiliary=...) or when render denoises.
+
+    normal and depth are the average unit normal and camera distance of the surfaces seen through the 4 anti-aliasing
+    sub-pixels, object is the index into BVH.objects of the surface seen by the first sub-pixel, albedo is the diffuse
+    color of the material plus the texture color, and unshadowed is the radiance of the pixel if no light was
+    blocked. Pixels that see the background have a zero normal and depth, object -1 and the background radiance.
+    """
+
+    def __init__(self):
+        self.normal = None
+        self.depth = None
+        self.object = None
+        self.albedo = None
+        self.unshadowed = None
+
+    def allocate(self, height, width):
+        """
+        :param height: int
+        :param width: int
+        """
+        self.normal = np.zeros((height, width, 3), np.float32)
+        self.depth = np.zeros((height, width), np.float32)
+        self.object = np.full((height, width), -1, np.int64)
+        self.albedo = np.zeros((height, width, 3), np.float32)
+        self.unshadowed = np.zeros((height, width, 3), np.float32)
+
+    def add_tile(self, values, rows, cols):
+        """
+        Places the auxiliary channels of a tile in the buffers of the frame.
+
+        :param values: numpy.ndarray (height, width, AUXILIARY_CHANNELS)
+        :param rows: slice
+        :param cols: slice
+        """
+        for name, channels in AUXILIARY_FIELDS:
+            channel = values[:, :, AUXILIARY_SLICES[name]]
+            getattr(self, name)[rows, cols] = channel if channels > 1 else channel[:, :, 0]
+
+
+def reduce_auxiliary_samples(samples):
+    """
+    Combines the auxiliary channels of the anti-aliasing sub-pixels into the channels of their pixels.
+
+    :param samples: numpy.ndarray (height, width, sub-pixels, AUXILIARY_CHANNELS)
+    :return: numpy.ndarray<float32> (height, width, AUXILIARY_CHANNELS)
+    """
+    pixels = samples.mean(axis=2, dtype=np.float64)
+
+    # Object indices are not averaged, the first sub-pixel names the object of the pixel
+    pixels[:, :, AUXILIARY_SLICES["object"]] = samples[:, :, 0, AUXILIARY_SLICES["object"]]
+
+    normals = pixels[:, :, AUXILIARY_SLICES["normal"]]
+    lengths = np.linalg.norm(normals, axis=2, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+
+    return pixels.astype(np.float32)
+
+
+"""-------------------------------------------Denoiser---------------------------------------------------------------"""
+
+
+def denoise_radiance(
+        radiance,
+        auxiliary,
+        iterations=2,
+        sigma_color=5.0,
+        sigma_normal=64.0,
+        sigma_depth=2.0,
+        sigma_albedo=0.2
+):
+    """
+    Filters the noise of the soft shadows out of linear radiance with an edge-avoiding a-trous wavelet filter.
+
+    The radiance is first divided by the unshadowed radiance, which carries the lighting and texture detail of the
+    image without noise, leaving the fraction of light that reaches every pixel. That fraction is smoothed by
+    iterations passes of a 5x5 B3 spline kernel whose taps are 2^i pixels apart, so the filter covers
+    4 * (2^iterations - 1) + 1 pixels with 25 taps per pass. A tap is weighted down when its normal, albedo or depth
+    differ from the center pixel, and ignored when it sees a different object. Depth is compared with the change the
+    depth gradient of the pixel predicts, so slanted surfaces are filtered along their slope.
+
+    Taps are also weighted down when their filtered value differs from the center pixel by more than the noise of the
+    pixel, so the strength of the filter follows the variance of every pixel: pixels in full light or shadow are kept,
+    and penumbras are filtered less as the number of shadow samples grows. Every pass averages the noise down, the
+    next one uses the variance left in the weighted average of its taps. The result is multiplied by the unshadowed
+    radiance again, pixels that see the background are left as they are. The defaults were chosen with
+    benchmarks/denoise.py.
+
+    :param radiance: numpy.ndarray (height, width, 3) linear radiance
+    :param auxiliary: AuxiliaryBuffers of the same frame
+    :param iterations: int
+    :param sigma_color: float difference of the filtered values in standard deviations of their noise
+    :param sigma_normal: float exponent of the cosine between the normals
+    :param sigma_depth: float depth difference in multiples of the one predicted by the depth gradient
+    :param sigma_albedo: float
+    :return: numpy.ndarray<float32> (height, width, 3)
+    """
+    radiance = np.asarray(radiance, dtype=np.float32)
+    height, width = radiance.shape[:2]
+    unshadowed = auxiliary.unshadowed
+    demodulated = unshadowed > 1E-4
+    hits = auxiliary.object >= 0
+
+    values = np.divide(radiance, unshadowed, out=np.ones_like(radiance), where=demodulated)
+    depth = auxiliary.depth
+    # Depth that changes along a slanted surface is expected, the taps are compared with the depth gradient
+    gradient_y, gradient_x = np.gradient(depth)
+    gradient_y, gradient_x = np.abs(gradient_y), np.abs(gradient_x)
+
+    variance = __shadow_variance(values.mean(axis=2), auxiliary.object)
+
+    for i in range(iterations):
+        step = 1 << i
+        pad = 2 * step
+
+        def padded(array, fill=0):
+            return np.pad(array, ((pad, pad), (pad, pad)) + ((0, 0),) * (array.ndim - 2), constant_values=fill)
+
+        padded_values = padded(values)
+        padded_normal = padded(auxiliary.normal)
+        padded_depth = padded(depth)
+        padded_object = padded(auxiliary.object, -2)
+        padded_albedo = padded(auxiliary.albedo)
+
+        # The center tap is always taken, so every pixel keeps a weight
+        total = values * np.float32(ATROUS_KERNEL[2] ** 2)
+        weights = np.full((height, width), ATROUS_KERNEL[2] ** 2, np.float32)
+        padded_variance = padded(variance)
+        total_variance = variance * np.float32(ATROUS_KERNEL[2] ** 4)
+
+        color_scale = -1 / (sigma_color ** 2 * variance + 1E-8)
+        albedo_scale = np.float32(-1 / sigma_albedo ** 2)
+
+        for dy in range(-2, 3):
+            for dx in range(-2, 3):
+                if dy == dx == 0:
+                    continue
+
+                window = (slice(pad + dy * step, pad + dy * step + height),
+                          slice(pad + dx * step, pad + dx * step + width))
+                tap_values = padded_values[window]
+
+                exponent = color_scale * np.mean(tap_values - values, axis=2) ** 2
+                expected_depth = sigma_depth * step * (abs(dy) * gradient_y + abs(dx) * gradient_x) + 1E-6
+                exponent -= np.abs(padded_depth[window] - depth) / expected_depth
+                exponent += albedo_scale * np.sum((padded_albedo[window] - auxiliary.albedo) ** 2, axis=2)
+
+                cosine = np.maximum(np.sum(padded_normal[window] * auxiliary.normal, axis=2), 0)
+                weight = np.exp(exponent) * cosine ** sigma_normal
+                weight *= (padded_object[window] == auxiliary.object) * np.float32(ATROUS_KERNEL[dy + 2] *
+                                                                                   ATROUS_KERNEL[dx + 2])
+
+                total += weight[:, :, None] * tap_values
+                weights += weight
+                total_variance += weight ** 2 * padded_variance[window]
+
+        # The variance left in the average of the taps guides the next pass
+        values = total / weights[:, :, None]
+        variance = total_variance / weights ** 2
+
+    denoised = np.where(demodulated, values * unshadowed, radiance)
+
+    return np.where(hits[:, :, None], denoised, radiance).astype(np.float32, copy=False)
+
+
+def __window_sum(values, objects, radius):
+    """
+    Sums the values of the (2 * radius + 1)^2 window around every pixel over the pixels that see the same object.
+
+    :param values: numpy.ndarray (height, width)
+    :param objects: numpy.ndarray (height, width) object indices
+    :param radius: int
+    :return: tuple of numpy.ndarray (height, width) sums and pixel counts
+    """
+    size = 2 * radius + 1
+    windows = np.lib.stride_tricks.sliding_window_view(np.pad(values, radius), (size, size))
+    same = np.lib.stride_tricks.sliding_window_view(np.pad(objects, radius, constant_values=-2), (size, size))
+    same = same == objects[:, :, None, None]
+
+    return np.sum(windows, axis=(2, 3), where=same), same.sum(axis=(2, 3))
+
+
+def __shadow_variance(values, objects):
+    """
+    Estimates the variance of the noise of the fraction of light that reaches every pixel.
+
+    A pixel averages shadow rays that either reach the light or not, so its variance is proportional to p * (1 - p)
+    for a fraction p of the light, with a factor that shrinks with the number of shadow samples. p is the mean of the
+    3x3 neighbourhood of the pixel, and the factor the median over the penumbras of the squared difference between a
+    pixel and the mean of its neighbours, which cancels the gradients of the shadows, divided by p * (1 - p). The
+    sharp shadows near contact points neither raise the variance of their pixels nor, through the median, the factor.
+
+    :param values: numpy.ndarray (height, width) demodulated values
+    :param objects: numpy.ndarray (height, width) object indices
+    :return: numpy.ndarray (height, width)
+    """
+    sums, counts = __window_sum(values, objects, 1)
+    neighbours = counts - 1
+    mean = np.clip(sums / counts, 0, 1)
+
+    # The difference to the mean of n neighbours has n + 1 / n times the variance of a pixel
+    residual = np.divide(sums - values, neighbours, out=np.zeros_like(values), where=neighbours > 0) - values
+    residual = np.where(neighbours > 0, residual ** 2 * neighbours / (neighbours + 1), 0)
+    residual_sums, _ = __window_sum(residual, objects, 1)
+
+    spread = mean * (1 - mean)
+    penumbra = (spread > 0.05) & (objects >= 0)
+    if not penumbra.any():
+        return np.zeros_like(values)
+
+    return spread * np.median(residual_sums[penumbra] / counts[penumbra] / spread[penumbra])
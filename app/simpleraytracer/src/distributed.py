@@ -0,0 +1,371 @@
+import collections
+import os
+import pickle
+import queue
+import socket
+import struct
+import threading
+import time
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+# Seconds that a worker keeps trying to reach a coordinator that is not listening yet
+CONNECT_TIMEOUT = 10.0
+# Seconds that a frame waits for a tile while no worker is connected
+IDLE_TIMEOUT = 60.0
+# Seconds that a connection has to authenticate itself in
+HANDSHAKE_TIMEOUT = 10.0
+
+
+class RemoteRenderError(RuntimeError):
+    """
+    Raised by a render when a worker fails to render a tile, with the traceback of the worker.
+    """
+
+
+def _check_authkey(authkey):
+    """
+    Raises a ValueError unless authkey is a non-empty key, since without one anybody who reaches the port could run
+    code through the pickled messages.
+
+    :param authkey: bytes
+    """
+    if not isinstance(authkey, bytes) or not authkey:
+        raise ValueError("A non-empty bytes authkey shared by the coordinator and its workers is required")
+
+
+def _set_timeout(connection, seconds):
+    """
+    Makes the reads and writes of a connection fail with an OSError after seconds, 0 blocks again.
+
+    :param connection: multiprocessing.connection.Connection of a socket
+    :param seconds: float
+    """
+    interval = struct.pack('ll', int(seconds), int(seconds % 1 * 1E6))
+
+    with socket.socket(fileno=os.dup(connection.fileno())) as shared:
+        shared.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, interval)
+        shared.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, interval)
+
+
+"""-------------------------------------------Coordinator------------------------------------------------------------"""
+
+
+class RenderCoordinator:
+    """
+    Hands out the tiles of a render to worker processes that connect over TCP, possibly from other machines,
+    and assembles the frame from their results. Pass it to render(coordinator=...), and start workers with
+    run_worker or the simpleraytracer-worker command.
+
+    Every worker is sent the pickled scene once per frame, then one tile at a time along with its background.
+    A tile whose worker disconnects, or does not answer within tile_timeout seconds, goes back to the queue
+    and is rendered by another worker, so the frame is finished as long as one worker stays alive. Since every pixel
+    draws its random numbers from its own keyed stream, a seeded frame is the same whichever worker renders a tile.
+
+    Workers may connect and leave at any time, they stay connected between frames. The messages are pickled, which
+    runs code on the receiving side, so the coordinator and its workers authenticate each other with a shared
+    authkey and should only be reachable from a trusted network.
+    """
+
+    def __init__(self, address=("127.0.0.1", 0), authkey=None, tile_timeout=None, idle_timeout=IDLE_TIMEOUT):
+        """
+        :param address: (str host, int port), port 0 picks a free port
+        :param authkey: bytes shared with the workers, required
+        :param tile_timeout: float seconds after which a worker that did not return its tile is dropped, None waits
+        :param idle_timeout: float seconds after which a frame fails when no worker is connected and no tile was
+                             finished, None waits
+        """
+        _check_authkey(authkey)
+
+        self.tile_timeout = tile_timeout
+        self.idle_timeout = idle_timeout
+        self.requeued_tiles = 0
+        # The connections authenticate on their own threads, so a client that never answers only holds up itself
+        self.__authkey = authkey
+        self.__listener = Listener(address, family='AF_INET')
+        self.__condition = threading.Condition()
+        self.__frame = None
+        self.__frames = 0
+        self.__connections = set()
+        self.__closed = False
+
+        self.__accept_thread = threading.Thread(target=self.__accept, name='coordinator', daemon=True)
+        self.__accept_thread.start()
+
+    @property
+    def address(self):
+        """
+        :return: (str host, int port) that the workers connect to
+        """
+        return self.__listener.address
+
+    @property
+    def workers(self):
+        """
+        :return: int number of connected workers
+        """
+        with self.__condition:
+            return len(self.__connections)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """
+        Stops accepting workers and disconnects the connected ones, which makes them exit.
+        """
+        with self.__condition:
+            self.__closed = True
+            connections = list(self.__connections)
+            self.__condition.notify_all()
+
+            if self.__frame is not None:
+                self.__frame.results.put(('closed', None, None))
+
+        # Closing the listener does not wake a thread blocked in accept, a connection of its own does
+        try:
+            with socket.create_connection(self.address, timeout=1):
+                pass
+        except OSError:
+            pass
+
+        self.__accept_thread.join()
+        self.__listener.close()
+
+        # Shutting the sockets down also wakes the threads that wait for a tile, which then close them
+        for connection in connections:
+            try:
+                with socket.socket(fileno=os.dup(connection.fileno())) as shared:
+                    shared.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def render_tiles(self, render_tile, scene, image, tiles, merge=None, read_background=None):
+        """
+        Renders the tiles of an image on the connected workers, with the arguments of render_tiles_parallel.
+        Waits for workers to connect when there are none, and raises a TimeoutError when none connected and no tile
+        was finished for idle_timeout seconds.
+
+        :param render_tile: function(*scene, background, rows, cols) -> numpy.ndarray or result passed to merge,
+                            importable by the workers
+        :param scene: tuple
+        :param image: numpy.ndarray
+        :param tiles: array<(slice, slice)>
+        :param merge: function(result, rows, cols) -> numpy.ndarray, None when render_tile returns the tile itself
+        :param read_background: function(rows, cols) -> numpy.ndarray, None reads the background from the image
+        :return: numpy.ndarray
+        """
+        if read_background is None:
+            def read_background(rows, cols):
+                return image[rows, cols]
+
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError('The coordinator is closed')
+
+            self.__frames += 1
+            frame = _Frame(
+                self.__frames, pickle.dumps((render_tile, scene), protocol=pickle.HIGHEST_PROTOCOL), tiles,
+                read_background
+            )
+            self.__frame = frame
+            self.__condition.notify_all()
+
+        try:
+            idle_since = time.monotonic()
+
+            while len(frame.finished) < len(tiles):
+                timeout = None
+
+                if self.idle_timeout is not None:
+                    timeout = max(idle_since + self.idle_timeout - time.monotonic(), 0)
+
+                try:
+                    kind, index, value = frame.results.get(timeout=timeout)
+                except queue.Empty:
+                    # Connected workers are busy with their tiles, tile_timeout deals with the ones that hang
+                    if self.workers:
+                        idle_since = time.monotonic()
+                        continue
+
+                    raise TimeoutError(f'No worker connected and no tile finished within {self.idle_timeout}s')
+
+                idle_since = time.monotonic()
+
+                if kind == 'error':
+                    raise RemoteRenderError(f'A worker failed to render a tile:\n{value}')
+
+                if kind == 'closed':
+                    raise RuntimeError('The coordinator was closed during the render')
+
+                # A tile that was handed out again after a timeout may come back twice
+                if index in frame.finished:
+                    continue
+
+                frame.finished.add(index)
+                rows, cols = tiles[index]
+                image[rows, cols] = value if merge is None else merge(value, rows, cols)
+        finally:
+            with self.__condition:
+                frame.pending.clear()
+                self.__frame = None
+
+        return image
+
+    def __accept(self):
+        while True:
+            try:
+                connection = self.__listener.accept()
+            except OSError:
+                with self.__condition:
+                    if self.__closed:
+                        return
+
+                continue
+
+            with self.__condition:
+                if self.__closed:
+                    connection.close()
+                    return
+
+            threading.Thread(target=self.__serve, args=(connection,), name='coordinator worker', daemon=True).start()
+
+    def __serve(self, connection):
+        """
+        Authenticates a worker, then feeds it tiles until it disconnects or the coordinator closes.
+
+        :param connection: multiprocessing.connection.Connection
+        """
+        try:
+            _set_timeout(connection, HANDSHAKE_TIMEOUT)
+            deliver_challenge(connection, self.__authkey)
+            answer_challenge(connection, self.__authkey)
+            _set_timeout(connection, 0)
+        except (OSError, EOFError, AuthenticationError):
+            # Clients that fail to authenticate in time are turned away
+            connection.close()
+            return
+
+        with self.__condition:
+            if self.__closed:
+                connection.close()
+                return
+
+            self.__connections.add(connection)
+
+        sent_frame = None
+
+        try:
+            while True:
+                with self.__condition:
+                    while not self.__closed and (self.__frame is None or not self.__frame.pending):
+                        self.__condition.wait()
+
+                    if self.__closed:
+                        return
+
+                    frame = self.__frame
+                    index = frame.pending.popleft()
+
+                try:
+                    if sent_frame != frame.number:
+                        connection.send(('scene', frame.payload))
+                        sent_frame = frame.number
+
+                    rows, cols = frame.tiles[index]
+                    connection.send(('tile', index, rows, cols, frame.read_background(rows, cols)))
+
+                    if self.tile_timeout is not None and not connection.poll(self.tile_timeout):
+                        raise TimeoutError(f'No answer within {self.tile_timeout}s')
+
+                    frame.results.put(connection.recv())
+                except (OSError, EOFError, TimeoutError):
+                    self.__requeue(frame, index)
+                    return
+        finally:
+            with self.__condition:
+                self.__connections.discard(connection)
+
+            connection.close()
+
+    def __requeue(self, frame, index):
+        with self.__condition:
+            if frame is self.__frame:
+                frame.pending.appendleft(index)
+                self.requeued_tiles += 1
+                self.__condition.notify()
+
+
+class _Frame:
+    """
+    Tiles of the frame that the coordinator is rendering.
+    """
+
+    def __init__(self, number, payload, tiles, read_background):
+        self.number = number
+        self.payload = payload
+        self.tiles = tiles
+        self.read_background = read_background
+        self.pending = collections.deque(range(len(tiles)))
+        self.finished = set()
+        # (kind, tile index, tile or traceback) sent back by the workers, or put there by close
+        self.results = queue.SimpleQueue()
+
+
+"""-------------------------------------------Worker-----------------------------------------------------------------"""
+
+
+def run_worker(address, authkey=None, connect_timeout=CONNECT_TIMEOUT):
+    """
+    Connects to a RenderCoordinator and renders the tiles it hands out until it disconnects.
+
+    :param address: (str host, int port)
+    :param authkey: bytes shared with the coordinator, required
+    :param connect_timeout: float seconds to keep retrying while the coordinator is not listening yet
+    :return: int number of rendered tiles
+    """
+    _check_authkey(authkey)
+
+    deadline = time.monotonic() + connect_timeout
+
+    while True:
+        try:
+            connection = Client(tuple(address), family='AF_INET', authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() >= deadline:
+                raise
+
+            time.sleep(0.1)
+
+    render_tile = scene = None
+    rendered = 0
+
+    with connection:
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                return rendered
+
+            if message[0] == 'scene':
+                render_tile, scene = pickle.loads(message[1])
+                continue
+
+            _, index, rows, cols, background = message
+
+            try:
+                result = ('result', index, render_tile(*scene, background, rows, cols))
+            except Exception:
+                result = ('error', index, traceback.format_exc())
+
+            try:
+                connection.send(result)
+            except (EOFError, OSError):
+                return rendered
+
+            rendered += 1
@@ -1,9 +1,13 @@
 import math
 
+import numpy as np
+
 """-------------------------------------------Vectors, Points, Tuples------------------------------------------------"""
 
 
 class Tuple:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -37,13 +41,25 @@ class Tuple:
     def cross(a, b):
         return Vector3((a.y * b.z) - (a.z * b.y), (a.z * b.x) - (a.x * b.z), (a.x * b.y) - (a.y * b.x))
 
+    # Fused operations, they skip the temporary vectors of the equivalent chain of calls
+
+    @staticmethod
+    def madd(a, s, b):
+        # a + s * b
+        return Vector3(a.x + s * b.x, a.y + s * b.y, a.z + s * b.z)
+
+    @staticmethod
+    def sub_dot(a, b, c):
+        # (a - b) . c
+        return (a.x - b.x) * c.x + (a.y - b.y) * c.y + (a.z - b.z) * c.z
+
+    @staticmethod
+    def to_array(v):
+        return np.array([v.x, v.y, v.z], dtype=np.float64)
+
 
 class Point(Tuple):
-    def __init__(self, x, y, z):
-        super().__init__(x, y, z)
-        self.x = x
-        self.y = y
-        self.z = z
+    __slots__ = ()
 
     @staticmethod
     def zeros():
@@ -58,8 +74,12 @@ class Point(Tuple):
 
 
 class Vector3(Tuple):
+    __slots__ = ('w',)
+
     def __init__(self, x, y, z, w=1):
-        super().__init__(x, y, z)
+        self.x = x
+        self.y = y
+        self.z = z
         self.w = w
 
     @staticmethod
@@ -72,11 +92,11 @@ class Vector3(Tuple):
 
     @staticmethod
     def magnitude(v):
-        return math.sqrt(pow(v.x, 2) + pow(v.y, 2) + pow(v.z, 2))
+        return math.sqrt(v.x * v.x + v.y * v.y + v.z * v.z)
 
     @staticmethod
     def normalize(v):
-        mag = math.sqrt(pow(v.x, 2) + pow(v.y, 2) + pow(v.z, 2))
+        mag = math.sqrt(v.x * v.x + v.y * v.y + v.z * v.z)
 
         try:
             return Vector3(v.x / mag, v.y / mag, v.z / mag)
@@ -84,6 +104,27 @@ class Vector3(Tuple):
             print("Division by zero! Returning zero vector...")
             return Vector3(0, 0, 0)
 
+    @staticmethod
+    def sub_normalize(a, b):
+        # normalize(a - b)
+        x, y, z = a.x - b.x, a.y - b.y, a.z - b.z
+        mag = math.sqrt(x * x + y * y + z * z)
+
+        try:
+            return Vector3(x / mag, y / mag, z / mag)
+        except ZeroDivisionError:
+            print("Division by zero! Returning zero vector...")
+            return Vector3(0, 0, 0)
+
+    @staticmethod
+    def normalize_batch(v):
+        mag = np.sqrt(np.sum(v * v, axis=-1, keepdims=True))
+        return np.divide(v, mag, out=np.zeros_like(v, dtype=np.float64), where=mag > 0)
+
+    @staticmethod
+    def dot_batch(a, b):
+        return np.sum(a * b, axis=-1)
+
     @staticmethod
     def dot4(a, b):
         return a.x * b.x + a.y * b.y + a.z * b.z + a.w * b.w
@@ -96,10 +137,16 @@ class Vector3(Tuple):
 
 
 class Color:
+    """
+    RGB color, the channels are not clamped so lighting can be accumulated without losing energy.
+    Colors are clamped to [0, 1] with Color.clamp once they are written to the image.
+    """
+    __slots__ = ('r', 'g', 'b')
+
     def __init__(self, r, g, b):
-        self.r = max(0, min(1, r))
-        self.g = max(0, min(1, g))
-        self.b = max(0, min(1, b))
+        self.r = r
+        self.g = g
+        self.b = b
 
     @staticmethod
     def white():
@@ -111,19 +158,32 @@ class Color:
 
     @staticmethod
     def add(a, b):
-        return Color(min(1, a.r + b.r), min(1, a.g + b.g), min(1, a.b + b.b))
+        return Color(a.r + b.r, a.g + b.g, a.b + b.b)
 
     @staticmethod
     def multiply(a, b):
-        return Color(min(1, a.r * b.r), min(1, a.g * b.g), min(1, a.b * b.b))
+        return Color(a.r * b.r, a.g * b.g, a.b * b.b)
 
     @staticmethod
     def scalar_multiply(a, b):
-        return Color(min(1, a * b.r), min(1, a * b.g), min(1, a * b.b))
+        return Color(a * b.r, a * b.g, a * b.b)
 
     @staticmethod
     def subtract(a, b):
-        return Color(max(0, a.r - b.r), max(0, a.g - b.g), max(0, a.b - b.b))
+        return Color(a.r - b.r, a.g - b.g, a.b - b.b)
+
+    @staticmethod
+    def madd(a, s, b):
+        # a + s * b
+        return Color(a.r + s * b.r, a.g + s * b.g, a.b + s * b.b)
+
+    @staticmethod
+    def clamp(c):
+        return Color(max(0, min(1, c.r)), max(0, min(1, c.g)), max(0, min(1, c.b)))
+
+    @staticmethod
+    def to_array(c):
+        return np.array([c.r, c.g, c.b], dtype=np.float64)
 
     def __repr__(self):
         return f'Color("{self.r}", "{self.g}", "{self.b}")'
@@ -133,6 +193,8 @@ class Color:
 
 
 class Ray:
+    __slots__ = ('origin', 'direction')
+
     def __init__(self, origin, direction):
         self.origin = origin
         self.direction = direction
@@ -141,33 +203,121 @@ class Ray:
         return f'Ray({self.origin}, {self.direction})'
 
 
+"""-------------------------------------------Bounding boxes---------------------------------------------------------"""
+
+
+class AABB:
+    __slots__ = ('minimum', 'maximum')
+
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @staticmethod
+    def union(a, b):
+        return AABB(
+            Vector3(min(a.minimum.x, b.minimum.x), min(a.minimum.y, b.minimum.y), min(a.minimum.z, b.minimum.z)),
+            Vector3(max(a.maximum.x, b.maximum.x), max(a.maximum.y, b.maximum.y), max(a.maximum.z, b.maximum.z))
+        )
+
+    @staticmethod
+    def surface_area(box):
+        extent = Vector3.subtract(box.maximum, box.minimum)
+        return 2 * (extent.x * extent.y + extent.y * extent.z + extent.z * extent.x)
+
+    def __repr__(self):
+        return f'AABB({self.minimum}, {self.maximum})'
+
+
 """-------------------------------------------Matrices---------------------------------------------------------------"""
 
 
 class Matrix4X4:
+    __slots__ = ('row1', 'row2', 'row3', 'row4', '__columns', '__inverse')
+
     def __init__(self, row1=Vector3.zeros(), row2=Vector3.zeros(), row3=Vector3.zeros(), row4=Vector3(0, 0, 0, 1)):
         self.row1 = row1
         self.row2 = row2
         self.row3 = row3
         self.row4 = row4
-        self.column1 = Vector3(row1.x, row2.x, row3.x, row4.x)
-        self.column2 = Vector3(row1.y, row2.y, row3.y, row4.y)
-        self.column3 = Vector3(row1.z, row2.z, row3.z, row4.z)
-        self.column4 = Vector3(row1.w, row2.w, row3.w, row4.w)
+        self.__columns = None
+        self.__inverse = None
+
+    # Columns are only built when they are first accessed
+    def __get_columns(self):
+        if self.__columns is None:
+            row1, row2, row3, row4 = self.row1, self.row2, self.row3, self.row4
+            self.__columns = (
+                Vector3(row1.x, row2.x, row3.x, row4.x),
+                Vector3(row1.y, row2.y, row3.y, row4.y),
+                Vector3(row1.z, row2.z, row3.z, row4.z),
+                Vector3(row1.w, row2.w, row3.w, row4.w)
+            )
+
+        return self.__columns
+
+    @property
+    def column1(self):
+        return self.__get_columns()[0]
+
+    @property
+    def column2(self):
+        return self.__get_columns()[1]
+
+    @property
+    def column3(self):
+        return self.__get_columns()[2]
+
+    @property
+    def column4(self):
+        return self.__get_columns()[3]
+
+    # Inverse of an affine matrix (the last row is 0, 0, 0, 1), computed on first access and kept with the matrix
+    @property
+    def inverse(self):
+        if self.__inverse is None:
+            (a, b, c, tx), (d, e, f, ty), (g, h, i, tz) = (
+                (r.x, r.y, r.z, r.w) for r in (self.row1, self.row2, self.row3)
+            )
+
+            # Cofactors of the 3x3 part
+            ca, cb, cc = e * i - f * h, f * g - d * i, d * h - e * g
+            determinant = a * ca + b * cb + c * cc
+
+            if determinant == 0:
+                raise ZeroDivisionError('the matrix is not invertible')
+
+            s = 1 / determinant
+            r1 = (ca * s, (c * h - b * i) * s, (b * f - c * e) * s)
+            r2 = (cb * s, (a * i - c * g) * s, (c * d - a * f) * s)
+            r3 = (cc * s, (b * g - a * h) * s, (a * e - b * d) * s)
+
+            self.__inverse = Matrix4X4(
+                *(Vector3(*r, -(r[0] * tx + r[1] * ty + r[2] * tz)) for r in (r1, r2, r3))
+            )
+
+        return self.__inverse
 
     @staticmethod
     def mul_vector3(m, v):
-        return Vector3(Vector3.dot4(v, m.row1), Vector3.dot4(v, m.row2), Vector3.dot4(v, m.row3))
+        x, y, z, w = v.x, v.y, v.z, v.w
+        r1, r2, r3 = m.row1, m.row2, m.row3
+
+        return Vector3(x * r1.x + y * r1.y + z * r1.z + w * r1.w,
+                       x * r2.x + y * r2.y + z * r2.z + w * r2.w,
+                       x * r3.x + y * r3.y + z * r3.z + w * r3.w)
 
     @staticmethod
     def mul_mat(a, b):
-        r1 = Vector3(Vector3.dot4(a.row1, b.column1), Vector3.dot4(a.row1, b.column2), Vector3.dot4(a.row1, b.column3),
-                     Vector3.dot4(a.row1, b.column4))
-        r2 = Vector3(Vector3.dot4(a.row2, b.column1), Vector3.dot4(a.row2, b.column2), Vector3.dot4(a.row2, b.column3),
-                     Vector3.dot4(a.row2, b.column4))
-        r3 = Vector3(Vector3.dot4(a.row3, b.column1), Vector3.dot4(a.row3, b.column2), Vector3.dot4(a.row3, b.column3),
-                     Vector3.dot4(a.row3, b.column4))
-        return Matrix4X4(r1, r2, r3)
+        b1, b2, b3, b4 = b.row1, b.row2, b.row3, b.row4
+
+        def row(r):
+            return Vector3(r.x * b1.x + r.y * b2.x + r.z * b3.x + r.w * b4.x,
+                           r.x * b1.y + r.y * b2.y + r.z * b3.y + r.w * b4.y,
+                           r.x * b1.z + r.y * b2.z + r.z * b3.z + r.w * b4.z,
+                           r.x * b1.w + r.y * b2.w + r.z * b3.w + r.w * b4.w)
+
+        return Matrix4X4(row(a.row1), row(a.row2), row(a.row3))
 
     @staticmethod
     def rotation_mat(angle, axis):
@@ -196,5 +346,14 @@ class Matrix4X4:
     def identity_mat():
         return Matrix4X4(Vector3(1, 0, 0, 0), Vector3(0, 1, 0, 0), Vector3(0, 0, 1, 0))
 
+    @staticmethod
+    def to_array(m):
+        return np.array([
+            [m.row1.x, m.row1.y, m.row1.z, m.row1.w],
+            [m.row2.x, m.row2.y, m.row2.z, m.row2.w],
+            [m.row3.x, m.row3.y, m.row3.z, m.row3.w],
+            [m.row4.x, m.row4.y, m.row4.z, m.row4.w]
+        ], dtype=np.float64)
+
     def __repr__(self):
         return f'Matrix:[\n{self.row1}, \n{self.row2}, \n{self.row3}, \n{self.row4}]'
@@ -0,0 +1,80 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+# Extensions that save_image writes without optional dependencies, other formats need PIL
+BUILTIN_IMAGE_FORMATS = ('.npy', '.png', '.ppm')
+
+"""-------------------------------------------Image files------------------------------------------------------------"""
+
+
+def save_image(path, image):
+    """
+    Writes a rendered image, with values in the 0-255 range, to a file whose format follows from its extension.
+
+    .npy files keep the values and dtype of the image as they are. .png and .ppm files are written with 8 bits per
+    channel by the standard library alone, other formats like .jpg are written with PIL, which is only imported then.
+
+    :param path: str
+    :param image: numpy.ndarray (height, width, 3) or (height, width, 4)
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.npy':
+        np.save(path, image)
+        return
+
+    pixels = np.clip(np.rint(image), 0, 255).astype(np.uint8)
+
+    if extension == '.png':
+        content = __encode_png(pixels)
+    elif extension == '.ppm':
+        content = __encode_ppm(pixels)
+    else:
+        from PIL import Image  # Only needed for formats without a built-in writer
+
+        Image.fromarray(pixels).save(path)
+        return
+
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+def __encode_png(pixels):
+    """
+    :param pixels: numpy.ndarray<uint8> (height, width, 3 or 4)
+    :return: bytes
+    """
+    height, width, channels = pixels.shape
+
+    if channels not in (3, 4):
+        raise ValueError(f'PNG images need 3 or 4 channels, got {channels}')
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    # 8 bits per channel, RGB or RGBA, no interlacing
+    header = struct.pack('>IIBBBBB', width, height, 8, 2 if channels == 3 else 6, 0, 0, 0)
+
+    # Every row starts with filter type 0, the row is stored as it is
+    rows = np.zeros((height, width * channels + 1), np.uint8)
+    rows[:, 1:] = pixels.reshape((height, -1))
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', header),
+        chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)),
+        chunk(b'IEND', b'')
+    ])
+
+
+def __encode_ppm(pixels):
+    """
+    :param pixels: numpy.ndarray<uint8> (height, width, 3 or more), channels after the third are dropped
+    :return: bytes
+    """
+    height, width = pixels.shape[:2]
+
+    return f'P6\n{width} {height}\n255\n'.encode('ascii') + np.ascontiguousarray(pixels[:, :, :3]).tobytes()
@@ -0,0 +1,428 @@
+import numpy as np
+
+from .bvh import *
+from .objects import *
+
+"""-------------------------------------------Triangle meshes--------------------------------------------------------"""
+
+
+class TriangleMesh(Shape):
+    """
+    Triangles stored as flat vertex and face arrays, with a BVH of its own over the triangles.
+
+    The triangles are kept in world space and in the order of the leaves of the tree, so that every leaf is a slice of
+    the triangle arrays and is intersected with a packet of rays in a single vectorized test. Moving the mesh
+    transforms the vertices again and refits the tree instead of rebuilding it.
+
+    A closed mesh takes about 170 bytes per triangle with its vertices and tree, plus 16 bytes per uv or normal.
+    """
+
+    def __init__(self, position, rotation, vertices, faces, material, uvs=None, normals=None, leaf_size=8):
+        """
+        :param position: Vector3
+        :param rotation: Vector3
+        :param vertices: numpy.ndarray (V, 3) vertex positions in object space
+        :param faces: numpy.ndarray<int> (F, 3) vertex indices of every triangle
+        :param material: Material
+        :param uvs: numpy.ndarray (V, 2) texture coordinates of every vertex, v grows downwards like image rows,
+                    None if the mesh is not textured
+        :param normals: numpy.ndarray (V, 3) vertex normals in object space, None shades with flat face normals
+        :param leaf_size: int
+        """
+        super().__init__(position, rotation, material)
+
+        self.local_vertices = np.ascontiguousarray(vertices, dtype=np.float64).reshape((-1, 3))
+        faces = np.asarray(faces, dtype=np.int32).reshape((-1, 3))
+
+        if not len(faces):
+            raise ValueError('a triangle mesh needs at least one face')
+
+        if faces.min() < 0 or faces.max() >= len(self.local_vertices):
+            raise ValueError(f'face indices must be in [0, {len(self.local_vertices)})')
+
+        self.uvs = None if uvs is None else np.ascontiguousarray(uvs, dtype=np.float64).reshape((-1, 2))
+        self.local_normals = None
+
+        if normals is not None:
+            self.local_normals = np.ascontiguousarray(normals, dtype=np.float64).reshape((-1, 3))
+
+        corners = self.local_vertices[faces]
+        nodes, order = BVH.build_tree(corners.min(axis=1), corners.max(axis=1), leaf_size)
+        nodes = np.array(nodes, dtype=np.float64)
+
+        self.faces = faces[order]
+        self.children = nodes[:, 6:8].astype(np.intp)
+        self.first = nodes[:, 8].astype(np.intp)
+        self.count = nodes[:, 9].astype(np.intp)
+        self.node_min = nodes[:, 0:3].copy()
+        self.node_max = nodes[:, 3:6].copy()
+
+        # Inner nodes grouped by depth, deepest first, every group can be refitted at once
+        depth = np.zeros(len(nodes), dtype=np.intp)
+        inner = np.flatnonzero(self.children[:, 0] >= 0)
+
+        for k in inner:
+            depth[self.children[k]] = depth[k] + 1
+
+        self.__refit_order = [inner[depth[inner] == d] for d in np.unique(depth[inner])[::-1]]
+        self.__leaves = np.flatnonzero(self.children[:, 0] < 0)
+        self.__leaves = self.__leaves[np.argsort(self.first[self.__leaves])]
+
+        # World units to uv units on every triangle, the transform is rigid so this never changes
+        corners = corners[order]
+        area = np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1)
+
+        if self.uvs is None:
+            self.uv_scale = None
+        else:
+            uv = self.uvs[self.faces]
+            a, b = uv[:, 1] - uv[:, 0], uv[:, 2] - uv[:, 0]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.uv_scale = np.nan_to_num(np.sqrt(np.abs(a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]) / area),
+                                              posinf=0.0)
+
+        self.__update()
+
+    def move(self, position=None, rotation=None):
+        super().move(position, rotation)
+        self.__update()
+
+    def __update(self):
+        """
+        Transforms the triangles to world space and refits the tree around them.
+        """
+        matrix = Matrix4X4.to_array(self.modelMat)
+        self.vertices = self.local_vertices @ matrix[:3, :3].T + matrix[:3, 3]
+
+        if self.local_normals is not None:
+            self.normals = Vector3.normalize_batch(self.local_normals @ matrix[:3, :3].T)
+
+        corners = self.vertices[self.faces]
+        self.v0 = corners[:, 0]
+        self.e1 = corners[:, 1] - self.v0
+        self.e2 = corners[:, 2] - self.v0
+
+        cross = np.cross(self.e1, self.e2)
+        length = np.linalg.norm(cross, axis=1)
+        self.face_normals = cross / np.where(length > 0, length, 1)[:, None]
+        # Square root of twice the area, the size of a triangle when measuring how far a point is outside of it
+        self.__sizes = np.sqrt(length)
+
+        leaves = self.__leaves
+        self.node_min[leaves] = np.minimum.reduceat(corners.min(axis=1), self.first[leaves])
+        self.node_max[leaves] = np.maximum.reduceat(corners.max(axis=1), self.first[leaves])
+
+        for nodes in self.__refit_order:
+            left, right = self.children[nodes, 0], self.children[nodes, 1]
+            self.node_min[nodes] = np.minimum(self.node_min[left], self.node_min[right])
+            self.node_max[nodes] = np.maximum(self.node_max[left], self.node_max[right])
+
+        # Points closer than this to a triangle lie on it
+        self.__tolerance = 1E-6 * max(float(np.linalg.norm(self.node_max[0] - self.node_min[0])), 1.0)
+
+    @property
+    def triangle_count(self):
+        return len(self.faces)
+
+    def bounding_box(self):
+        return AABB(Vector3(*self.node_min[0].tolist()), Vector3(*self.node_max[0].tolist()))
+
+    def calculate_intersection(self, ray):
+        origin = Vector3.to_array(ray.origin)[None]
+        direction = Vector3.to_array(ray.direction)[None]
+
+        return float(self.calculate_intersection_batch(origin, direction)[0])
+
+    def calculate_intersection_batch(self, origins, directions):
+        return self.intersect_batch(origins, directions)[0]
+
+    def intersect_batch(self, origins, directions):
+        """
+        Finds the closest triangle hit by every ray, the rays are traversed through the tree as packets.
+
+        :param origins: numpy.ndarray
+        :param directions: numpy.ndarray
+        :return: numpy.ndarray<float> distances, numpy.ndarray<int> triangle indices or -1 for misses
+        """
+        origins = np.broadcast_to(origins, directions.shape)
+        distances = np.full(len(directions), np.inf)
+        triangles = np.full(len(directions), -1, dtype=np.intp)
+
+        inverse = np.divide(1.0, directions, out=np.full(directions.shape, 1E300), where=directions != 0)
+        stack = [(0, np.arange(len(directions)))]
+
+        while stack:
+            k, rays = stack.pop()
+
+            t1 = (self.node_min[k] - origins[rays]) * inverse[rays]
+            t2 = (self.node_max[k] - origins[rays]) * inverse[rays]
+            t_min = np.maximum(np.minimum(t1, t2).max(axis=1), 0)
+            t_max = np.maximum(t1, t2).min(axis=1)
+            rays = rays[(t_max >= t_min) & (t_min < distances[rays])]
+
+            if not rays.size:
+                continue
+
+            left, right = self.children[k]
+
+            if left >= 0:
+                stack.append((right, rays))
+                stack.append((left, rays))
+                continue
+
+            leaf = slice(self.first[k], self.first[k] + self.count[k])
+            hits = TriangleMesh.__intersect_triangles(
+                origins[rays], directions[rays], self.v0[leaf], self.e1[leaf], self.e2[leaf]
+            )
+
+            closest = hits.argmin(axis=1)
+            hit_distances = hits[np.arange(len(rays)), closest]
+            closer = hit_distances < distances[rays]
+
+            distances[rays[closer]] = hit_distances[closer]
+            triangles[rays[closer]] = self.first[k] + closest[closer]
+
+        return distances, triangles
+
+    @staticmethod
+    def __intersect_triangles(origins, directions, v0, e1, e2):
+        """
+        Möller–Trumbore test of every ray against every triangle, triangles are hit from both sides.
+
+        :return: numpy.ndarray<float> (rays, triangles) distances, infinity where the ray misses
+        """
+        p = np.cross(directions[:, None], e2[None])
+        determinant = np.einsum('rtk,tk->rt', p, e1)
+        offset = origins[:, None] - v0[None]
+        q = np.cross(offset, e1[None])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1.0 / determinant
+            u = np.einsum('rtk,rtk->rt', offset, p) * inverse
+            v = np.einsum('rk,rtk->rt', directions, q) * inverse
+            t = np.einsum('tk,rtk->rt', e2, q) * inverse
+
+        hit = (np.abs(determinant) > 1E-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+
+        return np.where(hit, t, np.inf)
+
+    def locate(self, points):
+        """
+        Finds the triangles that points on the surface of the mesh lie on.
+
+        :param points: numpy.ndarray
+        :return: numpy.ndarray<int> triangle indices, numpy.ndarray (N, 2) barycentric coordinates along e1 and e2
+        """
+        scores = np.full(len(points), np.inf)
+        triangles = np.zeros(len(points), dtype=np.intp)
+        barycentrics = np.zeros((len(points), 2))
+        tolerance = self.__tolerance
+
+        stack = [(0, np.arange(len(points)))]
+
+        while stack:
+            k, members = stack.pop()
+            inside = ((points[members] >= self.node_min[k] - tolerance)
+                      & (points[members] <= self.node_max[k] + tolerance)).all(axis=1)
+            members = members[inside]
+
+            if not members.size:
+                continue
+
+            left, right = self.children[k]
+
+            if left >= 0:
+                stack.append((right, members))
+                stack.append((left, members))
+                continue
+
+            leaf = slice(self.first[k], self.first[k] + self.count[k])
+            e1, e2 = self.e1[leaf], self.e2[leaf]
+            offset = points[members][:, None] - self.v0[leaf][None]
+
+            d00 = np.einsum('tk,tk->t', e1, e1)
+            d01 = np.einsum('tk,tk->t', e1, e2)
+            d11 = np.einsum('tk,tk->t', e2, e2)
+            d20 = np.einsum('ptk,tk->pt', offset, e1)
+            d21 = np.einsum('ptk,tk->pt', offset, e2)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                denominator = d00 * d11 - d01 * d01
+                b1 = np.nan_to_num((d11 * d20 - d01 * d21) / denominator)
+                b2 = np.nan_to_num((d00 * d21 - d01 * d20) / denominator)
+
+            # Distance to the plane of the triangle, plus how far the point is outside of its edges
+            outside = np.maximum(np.maximum(-b1, -b2), np.maximum(b1 + b2 - 1, 0))
+            leaf_scores = (np.abs(np.einsum('ptk,tk->pt', offset, self.face_normals[leaf]))
+                           + outside * self.__sizes[leaf])
+
+            best = leaf_scores.argmin(axis=1)
+            rows = np.arange(len(members))
+            better = leaf_scores[rows, best] < scores[members]
+            members, best, rows = members[better], best[better], rows[better]
+
+            scores[members] = leaf_scores[rows, best]
+            triangles[members] = self.first[k] + best
+            barycentrics[members, 0] = b1[rows, best]
+            barycentrics[members, 1] = b2[rows, best]
+
+        return triangles, np.clip(barycentrics, 0, 1)
+
+    def __interpolate(self, values, triangles, barycentrics):
+        corners = values[self.faces[triangles]]
+        b1, b2 = barycentrics[:, 0, None], barycentrics[:, 1, None]
+
+        return corners[:, 0] * (1 - b1 - b2) + corners[:, 1] * b1 + corners[:, 2] * b2
+
+    def __shading_normals(self, triangles, barycentrics):
+        if self.local_normals is None:
+            return self.face_normals[triangles]
+
+        return Vector3.normalize_batch(self.__interpolate(self.normals, triangles, barycentrics))
+
+    def normal(self, intersection):
+        return Vector3(*self.normal_batch(Vector3.to_array(intersection)[None])[0].tolist())
+
+    def normal_batch(self, intersections):
+        return self.__shading_normals(*self.locate(intersections))
+
+    def uv_map_batch(self, triangles, barycentrics):
+        uv = self.__interpolate(self.uvs, triangles, barycentrics)
+        return uv[:, 0], uv[:, 1]
+
+    def color(self, light, camera_position, intersection, footprint=0.0):
+        return Color(*self.color_batch(light, camera_position, Vector3.to_array(intersection)[None], footprint)[0]
+                     .tolist())
+
+    def __texture_color(self, triangles, barycentrics, footprints):
+        tex = self.material.texture
+
+        if tex is None or self.uvs is None:
+            return np.zeros((len(triangles), 3))
+
+        u, v = self.uv_map_batch(triangles, barycentrics)
+        footprint = np.asarray(footprints) * self.uv_scale[triangles]
+
+        return tex.sample(u, v, tex.level_of_detail(footprint, footprint))
+
+    def texture_color(self, intersection, footprint=0.0):
+        return Color(*self.texture_color_batch(Vector3.to_array(intersection)[None], footprint)[0].tolist())
+
+    def texture_color_batch(self, intersections, footprints=0.0):
+        return self.__texture_color(*self.locate(intersections), footprints)
+
+    def color_batch(self, light, camera_position, intersections, footprints=0.0):
+        triangles, barycentrics = self.locate(intersections)
+
+        normals = self.__shading_normals(triangles, barycentrics)
+        illumination = self.phong_batch(light, camera_position, intersections, normals)
+
+        return illumination + self.__texture_color(triangles, barycentrics, footprints)
+
+    def shade(self, lights, camera_position, intersection, footprint=0.0):
+        lighting, texture, normals = self.shade_batch(lights, camera_position, Vector3.to_array(intersection)[None],
+                                                      footprint)
+
+        return ([Color(*color.tolist()) for color in lighting[0]], Color(*texture[0].tolist()),
+                Vector3(*normals[0].tolist()))
+
+    # The points are located once for the normals and the texture colors
+    def shade_batch(self, lights, camera_position, intersections, footprints=0.0):
+        triangles, barycentrics = self.locate(intersections)
+
+        normals = self.__shading_normals(triangles, barycentrics)
+        lighting = self.illumination_batch(lights, camera_position, intersections, normals)
+
+        return lighting, self.__texture_color(triangles, barycentrics, footprints), normals
+
+    @staticmethod
+    def load_obj(path, position, rotation, material, leaf_size=8):
+        """
+        Loads a mesh from a Wavefront OBJ file, polygons are split into triangle fans.
+
+        Corners that share a position but not a texture coordinate or normal become separate vertices.
+        Texture coordinates and normals are only kept when every corner of every face has one.
+
+        :param path: str
+        :param position: Vector3
+        :param rotation: Vector3
+        :param material: Material
+        :param leaf_size: int
+        :return: TriangleMesh
+        """
+        positions, uvs, normals, corners = [], [], [], []
+
+        with open(path) as file:
+            for line_number, line in enumerate(file, 1):
+                values = line.split()
+
+                if not values:
+                    continue
+
+                kind = values[0]
+
+                try:
+                    if kind == 'v':
+                        positions.append(values[1:4])
+                    elif kind == 'vt':
+                        uvs.append(values[1:3])
+                    elif kind == 'vn':
+                        normals.append(values[1:4])
+                    elif kind == 'f':
+                        polygon = [TriangleMesh.__parse_corner(value, positions, uvs, normals) for value in values[1:]]
+
+                        for i in range(1, len(polygon) - 1):
+                            corners.extend((polygon[0], polygon[i], polygon[i + 1]))
+                except (ValueError, IndexError) as error:
+                    raise ValueError(f'{path}:{line_number}: invalid "{kind}" line, {error}') from None
+
+        if not corners:
+            raise ValueError(f'{path}: no faces')
+
+        try:
+            positions = np.array(positions, dtype=np.float64).reshape((-1, 3))
+            uvs = np.array(uvs, dtype=np.float64).reshape((-1, 2))
+            normals = np.array(normals, dtype=np.float64).reshape((-1, 3))
+        except ValueError:
+            raise ValueError(f'{path}: vertices with missing coordinates') from None
+
+        # Every distinct (position, uv, normal) triple becomes one vertex, indices are 1-based and 0 means missing
+        keys, faces = np.unique(np.array(corners, dtype=np.int64), axis=0, return_inverse=True)
+        vertex_uvs = vertex_normals = None
+
+        if (keys[:, 1] > 0).all():
+            # OBJ texture coordinates start at the bottom of the image
+            vertex_uvs = uvs[keys[:, 1] - 1] * [1, -1] + [0, 1]
+
+        if (keys[:, 2] > 0).all():
+            vertex_normals = normals[keys[:, 2] - 1]
+
+        return TriangleMesh(position, rotation, positions[keys[:, 0] - 1], faces.reshape((-1, 3)), material,
+                            vertex_uvs, vertex_normals, leaf_size)
+
+    @staticmethod
+    def __parse_corner(value, positions, uvs, normals):
+        """
+        Parses a v, v/vt, v//vn or v/vt/vn face corner into 1-based indices, negative indices count from the end.
+
+        :return: (int, int, int) position, uv and normal index, 0 when the corner has none
+        """
+        indices = value.split('/')
+        corner = []
+
+        for i, elements in enumerate((positions, uvs, normals)):
+            index = int(indices[i]) if i < len(indices) and indices[i] else 0
+
+            if index < 0:
+                index += len(elements) + 1
+
+            if not 0 <= index <= len(elements) or (i == 0 and index == 0):
+                raise IndexError(f'index {indices[i]} out of range')
+
+            corner.append(index)
+
+        return tuple(corner)
+
+    def __repr__(self):
+        return f'TriangleMesh({self.position}, {self.rotation}, {self.triangle_count} triangles)'
@@ -1,6 +1,20 @@
+import functools
+import os
 from abc import abstractmethod
 
+import numpy as np
+
 from .geometry import *
+from .texture import *
+
+# Number of primary ray tables that Camera.ray_directions keeps, the least recently used one is evicted first
+RAY_TABLE_CACHE_SIZE = 4
+
+# Offsets of the primary rays of the anti-aliasing patterns, in quarter pixel steps
+RAY_PATTERNS = {
+    "fixed": ((1, 1), (-1, 1), (1, -1), (-1, -1)),
+    "center": ((0, 0),)
+}
 
 """-------------------------------------------Shapes-----------------------------------------------------------------"""
 
@@ -10,7 +24,15 @@ class Transform:
         self.position = position
         self.rotation = rotation
         self.scale = scale
-        self.rotation_mat = Matrix4X4.mul_mat(
+        self.rotation_mat = Transform.__rotation_matrix(rotation, scale)
+        self.modelMat = Matrix4X4.mul_mat(
+            Matrix4X4.translation_mat(position),
+            self.rotation_mat
+        )
+
+    @staticmethod
+    def __rotation_matrix(rotation, scale):
+        return Matrix4X4.mul_mat(
             Matrix4X4.rotation_mat(rotation.z, Vector3(0, 0, 1)),
             Matrix4X4.mul_mat(
                 Matrix4X4.rotation_mat(rotation.y, Vector3(0, 1, 0)),
@@ -20,8 +42,23 @@ class Transform:
                 )
             )
         )
+
+    def move(self, position=None, rotation=None):
+        """
+        Moves the transform in place, the rotation matrix is only rebuilt when the rotation changes.
+
+        :param position: Vector3, None keeps the position
+        :param rotation: Vector3, None keeps the rotation
+        """
+        if rotation is not None:
+            self.rotation = rotation
+            self.rotation_mat = Transform.__rotation_matrix(rotation, self.scale)
+
+        if position is not None:
+            self.position = position
+
         self.modelMat = Matrix4X4.mul_mat(
-            Matrix4X4.translation_mat(position),
+            Matrix4X4.translation_mat(self.position),
             self.rotation_mat
         )
 
@@ -31,43 +68,129 @@ class Shape(Transform):
         super().__init__(position, rotation, Vector3(1, 1, 1))
         self.material = material
 
+    # The returned illumination is not clamped, the renderer clamps the final color when it writes it to the image
     def phong(self, light, camera_position, intersection, normal):
-        # attenuation = 1 / Vector3.magnitude(Vector3.subtract(light.position, intersection))
-        light_direction = Vector3.normalize(Vector3.subtract(light.position, intersection))
+        light_direction = light.direction(intersection)
+        material = self.material
+
+        # ambient
+        illumination = Color.multiply(material.ambient, light.ambient)
+
+        # diffuse, surfaces facing away from the light receive none
+        lambert = max(0.0, Vector3.dot(light_direction, normal))
+        illumination = Color.madd(illumination, lambert, Color.multiply(material.diffuse, light.diffuse))
+
+        # specular
+        view_direction = Vector3.sub_normalize(camera_position, intersection)
+        h = light.half_vector(intersection, view_direction)
+        highlight = max(0.0, Vector3.dot(normal, h)) ** (material.shininess / 4)
+        illumination = Color.madd(illumination, highlight, Color.multiply(material.specular, light.specular))
 
-        # RGB
-        illumination = Color.black()
+        attenuation = light.attenuation(intersection)
+
+        return illumination if attenuation == 1 else Color.scalar_multiply(attenuation, illumination)
+
+    def phong_batch(self, light, camera_position, intersections, normals):
+        light_direction = light.direction_batch(intersections)
 
         # ambient
-        illumination = Color.add(Color.multiply(self.material.ambient, light.ambient), illumination)
+        illumination = np.empty_like(intersections, dtype=np.float64)
+        illumination[:] = Color.to_array(self.material.ambient) * Color.to_array(light.ambient)
 
         # diffuse
-        illumination = Color.add(
-            Color.scalar_multiply(
-                Vector3.dot(light_direction, normal),
-                Color.multiply(self.material.diffuse, light.diffuse)
-            ),
-            illumination
-        )
+        diffuse = Color.to_array(self.material.diffuse) * Color.to_array(light.diffuse)
+        lambert = np.maximum(Vector3.dot_batch(light_direction, normals), 0)
+        illumination += lambert[:, None] * diffuse
 
         # specular
-        view_direction = Vector3.normalize(Vector3.subtract(camera_position, intersection))
-        h = Vector3.normalize(Vector3.add(light.position, view_direction))
-
-        illumination = Color.add(
-            Color.scalar_multiply(
-                Vector3.dot(normal, h) ** (self.material.shininess / 4),
-                Color.multiply(self.material.specular, light.specular)
-            ),
-            illumination
-        )
+        view_direction = Vector3.normalize_batch(Vector3.to_array(camera_position) - intersections)
+        h = light.half_vector_batch(intersections, view_direction)
+        specular = Color.to_array(self.material.specular) * Color.to_array(light.specular)
+        highlight = np.maximum(Vector3.dot_batch(normals, h), 0) ** (self.material.shininess / 4)
+        illumination += highlight[:, None] * specular
+
+        return illumination * light.attenuation_batch(intersections)[:, None]
+
+    # Illumination of every light, lights whose attenuation is 0 at the point are culled and left black
+    def illumination(self, lights, camera_position, intersection, normal):
+        return [
+            self.phong(light, camera_position, intersection, normal) if light.attenuation(intersection) > 0
+            else Color.black()
+            for light in lights
+        ]
+
+    def illumination_batch(self, lights, camera_position, intersections, normals):
+        lighting = np.zeros((len(intersections), len(lights), 3))
+
+        for k, light in enumerate(lights):
+            reached = light.attenuation_batch(intersections) > 0
+
+            if reached.all():
+                lighting[:, k] = self.phong_batch(light, camera_position, intersections, normals)
+            elif reached.any():
+                lighting[reached, k] = self.phong_batch(
+                    light, camera_position, intersections[reached], normals[reached]
+                )
+
+        return lighting
 
-        return illumination
+    def shade(self, lights, camera_position, intersection, footprint=0.0):
+        """
+        Shades a point without shadows, color is the sum of the illuminations and the texture color.
+
+        :param lights: array<Light>
+        :param camera_position: Vector3
+        :param intersection: Vector3
+        :param footprint: float
+        :return: array<Color> illumination of every light, Color texture color, Vector3 normal
+        """
+        normal = self.normal(intersection)
+        lighting = self.illumination(lights, camera_position, intersection, normal)
+
+        return lighting, self.texture_color(intersection, footprint), normal
+
+    def shade_batch(self, lights, camera_position, intersections, footprints=0.0):
+        """
+        Vectorized version of shade.
+
+        :param lights: array<Light>
+        :param camera_position: Vector3
+        :param intersections: numpy.ndarray
+        :param footprints: numpy.ndarray<float> or float
+        :return: numpy.ndarray (N, lights, 3), numpy.ndarray (N, 3) texture colors, numpy.ndarray (N, 3) normals
+        """
+        normals = self.normal_batch(intersections)
+        lighting = self.illumination_batch(lights, camera_position, intersections, normals)
+
+        return lighting, self.texture_color_batch(intersections, footprints), normals
+
+    # Unbounded shapes (e.g. planes) return None and are kept outside the acceleration structure
+    def bounding_box(self):
+        return None
+
+    # Texture color that color adds to the illumination, black for shapes without a texture
+    def texture_color(self, intersection, footprint=0.0):
+        return Color.black()
+
+    def texture_color_batch(self, intersections, footprints=0.0):
+        return np.zeros_like(intersections, dtype=np.float64)
 
     @abstractmethod
     def normal(self, intersection):
         pass
 
+    @abstractmethod
+    def calculate_intersection_batch(self, origins, directions):
+        pass
+
+    @abstractmethod
+    def normal_batch(self, intersections):
+        pass
+
+    @abstractmethod
+    def color_batch(self, light, camera_position, intersections, footprints=0.0):
+        pass
+
 
 class Sphere(Shape):
     def __init__(self, position, rotation, radius, material):
@@ -77,27 +200,53 @@ class Sphere(Shape):
         self.equator = Vector3(-1, 0, 0)
 
     def calculate_intersection(self, ray):
+        direction, position = ray.direction, self.position
+
+        # O - c, kept in locals to avoid allocating a vector
+        ox = ray.origin.x - position.x
+        oy = ray.origin.y - position.y
+        oz = ray.origin.z - position.z
+
         # 2 * (d x O - c)
-        b = 2 * Vector3.dot(ray.direction, Vector3.subtract(ray.origin, self.position))
+        b = 2 * (direction.x * ox + direction.y * oy + direction.z * oz)
 
         # || O - c ||**2 - r**2
-        c = Vector3.magnitude(Vector3.subtract(ray.origin, self.position)) ** 2 - self.radius ** 2
+        c = ox * ox + oy * oy + oz * oz - self.radius * self.radius
 
         # D = b**2 - 4ac, a = 1, since it's a unit vector
-        discriminant = b ** 2 - 4 * c
+        discriminant = b * b - 4 * c
 
         if discriminant > 0:
-            x1 = (-b + math.sqrt(discriminant)) / 2  # x1 = (-b + D**1/2) / 2a
-            x2 = (-b - math.sqrt(discriminant)) / 2  # x2 = (-b + D**1/2) / 2a
+            root = math.sqrt(discriminant)
+            x1 = (-b + root) / 2  # x1 = (-b + D**1/2) / 2a
+            x2 = (-b - root) / 2  # x2 = (-b + D**1/2) / 2a
 
             if x1 > 0 and x2 > 0:  # Check if intersects
                 return min(x1, x2)
 
         return math.inf
 
+    # Vectorized version of calculate_intersection, rays are given as (N, 3) arrays
+    def calculate_intersection_batch(self, origins, directions):
+        offset = origins - Vector3.to_array(self.position)
+
+        b = 2 * Vector3.dot_batch(directions, offset)
+        c = Vector3.dot_batch(offset, offset) - self.radius ** 2
+        discriminant = b ** 2 - 4 * c
+
+        root = np.sqrt(np.maximum(discriminant, 0))
+        x1 = (-b + root) / 2
+        x2 = (-b - root) / 2
+
+        return np.where((discriminant > 0) & (x1 > 0) & (x2 > 0), np.minimum(x1, x2), np.inf)
+
+    def bounding_box(self):
+        extent = Vector3(self.radius, self.radius, self.radius)
+        return AABB(Vector3.subtract(self.position, extent), Vector3.add(self.position, extent))
+
     # Returns the surface normal specified on any point of the sphere
     def normal(self, intersection):
-        return Vector3.normalize(Vector3.subtract(intersection, self.position))
+        return Vector3.sub_normalize(intersection, self.position)
 
     # Returns a u, v coordinates given a point on a sphere
     def spherical_map(self, intersection):
@@ -116,24 +265,60 @@ class Sphere(Shape):
 
         return u, v
 
+    def normal_batch(self, intersections):
+        return Vector3.normalize_batch(intersections - Vector3.to_array(self.position))
+
+    def spherical_map_batch(self, intersections):
+        normal = self.normal_batch(intersections)
+        pole = Vector3.to_array(self.pole)
+        equator = Vector3.to_array(self.equator)
+
+        phi = np.arccos(np.clip(normal @ pole, -1, 1))
+        v = phi / math.pi
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            theta = np.arccos(np.clip(normal @ equator / np.sin(phi), -1, 1)) / (2 * math.pi)
+
+        theta = np.nan_to_num(theta)
+        u = np.where(normal @ Vector3.to_array(Vector3.cross(self.pole, self.equator)) > 0, theta, 1 - theta)
+
+        return u, v
+
+    # Returns the mip level for a footprint given as the world-space width covered by a sample
+    def texture_lod(self, footprint):
+        circumference = 2 * math.pi * self.radius
+        return self.material.texture.level_of_detail(footprint / circumference, 2 * footprint / circumference)
+
     # Returns a texture color given an intersection point on a sphere
-    def color(self, light, camera_position, intersection):
-        u, v = self.spherical_map(intersection)
+    def texture_color(self, intersection, footprint=0.0):
         tex = self.material.texture
-        col = Color.black()
 
-        if tex is not None:
-            height, width, channels = tex.shape
+        if tex is None:
+            return Color.black()
 
-            y = int(v * (height - 1))
-            x = int(u * (width - 1))
+        u, v = self.spherical_map(intersection)
+        val = tex.sample(u, v, self.texture_lod(footprint))
 
-            val = tex[y, x] / 256
-            col = Color(val[0], val[1], val[2])
+        return Color(float(val[0]), float(val[1]), float(val[2]))
 
+    def color(self, light, camera_position, intersection, footprint=0.0):
         illumination = self.phong(light, camera_position, intersection, self.normal(intersection))
 
-        return Color.add(illumination, col)
+        return Color.add(illumination, self.texture_color(intersection, footprint))
+
+    def texture_color_batch(self, intersections, footprints=0.0):
+        tex = self.material.texture
+
+        if tex is None:
+            return super().texture_color_batch(intersections)
+
+        u, v = self.spherical_map_batch(intersections)
+        return tex.sample(u, v, self.texture_lod(footprints))
+
+    def color_batch(self, light, camera_position, intersections, footprints=0.0):
+        illumination = self.phong_batch(light, camera_position, intersections, self.normal_batch(intersections))
+
+        return illumination + self.texture_color_batch(intersections, footprints)
 
     def __repr__(self):
         return f'Sphere({self.position}, {self.rotation}, {self.radius})'
@@ -144,47 +329,331 @@ class Plane(Shape):
         super().__init__(position, rotation, material)
         self.surface_normal = Vector3.normalize(Matrix4X4.mul_vector3(self.rotation_mat, Vector3(0, 1, 0)))
 
+    def move(self, position=None, rotation=None):
+        super().move(position, rotation)
+
+        if rotation is not None:
+            self.surface_normal = Vector3.normalize(Matrix4X4.mul_vector3(self.rotation_mat, Vector3(0, 1, 0)))
+
     def calculate_intersection(self, ray):
-        denominator = Vector3.dot(Vector3.normalize(ray.direction), self.surface_normal)
+        # Same as dot(normalize(d), n) without allocating the normalized direction
+        denominator = Vector3.dot(ray.direction, self.surface_normal) / Vector3.magnitude(ray.direction)
 
         if abs(denominator) > 1E-5:
-            t = Vector3.dot(Vector3.subtract(self.position, ray.origin), self.surface_normal) / denominator
+            t = Vector3.sub_dot(self.position, ray.origin, self.surface_normal) / denominator
 
             if t >= 0:
                 return t
 
         return math.inf
 
+    def calculate_intersection_batch(self, origins, directions):
+        surface_normal = Vector3.to_array(self.surface_normal)
+        denominator = Vector3.normalize_batch(directions) @ surface_normal
+        valid = np.abs(denominator) > 1E-5
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((Vector3.to_array(self.position) - origins) @ surface_normal) / denominator
+
+        return np.where(valid & (t >= 0), t, np.inf)
+
     def normal(self, intersection):
         return self.surface_normal
 
-    def color(self, light, camera_position, intersection):
+    def normal_batch(self, intersections):
+        return np.broadcast_to(Vector3.to_array(self.surface_normal), intersections.shape)
+
+    def color(self, light, camera_position, intersection, footprint=0.0):
         return self.phong(light, camera_position, intersection, self.surface_normal)
 
+    def color_batch(self, light, camera_position, intersections, footprints=0.0):
+        return self.phong_batch(light, camera_position, intersections, self.normal_batch(intersections))
+
     def __repr__(self):
         return f'Plane({self.position}, {self.rotation}, {self.surface_normal})'
 
 
+class Instance(Shape):
+    """
+    Places a shared base shape with a transform of its own, the base keeps the geometry and material of every copy.
+
+    Rays are moved into the object space of the base with the inverse of the model matrix, which is cached,
+    and the distances the base returns are scaled back to world space. In a BVH the instances are the leaves
+    of the scene tree, and a mesh base traverses its own tree below them.
+    """
+
+    def __init__(self, base, position, rotation, scale=Vector3(1, 1, 1)):
+        """
+        :param base: Shape, usually placed at the origin
+        :param position: Vector3
+        :param rotation: Vector3
+        :param scale: Vector3
+        """
+        Transform.__init__(self, position, rotation, scale)
+        self.base = base
+        self.__update()
+
+    @property
+    def material(self):
+        return self.base.material
+
+    def move(self, position=None, rotation=None):
+        super().move(position, rotation)
+        self.__update()
+
+    def __update(self):
+        inverse = Matrix4X4.to_array(self.modelMat.inverse)
+        self.__inverse_linear = inverse[:3, :3]
+        self.__inverse_translation = inverse[:3, 3]
+        # World space widths are divided by this to measure them in object space
+        self.__footprint_scale = abs(self.scale.x * self.scale.y * self.scale.z) ** (1 / 3)
+
+    def to_object(self, point):
+        return Matrix4X4.mul_vector3(self.modelMat.inverse, point)
+
+    def to_object_batch(self, points):
+        return points @ self.__inverse_linear.T + self.__inverse_translation
+
+    def calculate_intersection(self, ray):
+        direction = Matrix4X4.mul_vector3(self.modelMat.inverse, Vector3(ray.direction.x, ray.direction.y,
+                                                                          ray.direction.z, 0))
+        length = Vector3.magnitude(direction)
+
+        if length == 0:
+            return math.inf
+
+        distance = self.base.calculate_intersection(
+            Ray(self.to_object(ray.origin), Vector3.scalar_div(length, direction))
+        )
+
+        return distance / length
+
+    def calculate_intersection_batch(self, origins, directions):
+        directions = directions @ self.__inverse_linear.T
+        lengths = np.linalg.norm(directions, axis=1)
+        origins = self.to_object_batch(np.broadcast_to(origins, directions.shape))
+
+        # Zero length directions miss, like in calculate_intersection
+        valid = lengths > 0
+        lengths = np.where(valid, lengths, 1.0)
+        distances = self.base.calculate_intersection_batch(origins, directions / lengths[:, None]) / lengths
+
+        return np.where(valid, distances, np.inf)
+
+    def bounding_box(self):
+        box = self.base.bounding_box()
+
+        if box is None:
+            return None
+
+        # The box of the eight transformed corners of the base's box
+        low, high = Vector3.to_array(box.minimum), Vector3.to_array(box.maximum)
+        corners = np.array([[(low, high)[(k >> axis) & 1][axis] for axis in range(3)] for k in range(8)])
+        matrix = Matrix4X4.to_array(self.modelMat)
+        corners = corners @ matrix[:3, :3].T + matrix[:3, 3]
+
+        return AABB(Vector3(*corners.min(axis=0).tolist()), Vector3(*corners.max(axis=0).tolist()))
+
+    def normal(self, intersection):
+        return Vector3(*self.normal_batch(Vector3.to_array(intersection)[None])[0].tolist())
+
+    def normal_batch(self, intersections):
+        # Normals are transformed by the inverse transpose so that they stay perpendicular under non uniform scaling
+        normals = np.asarray(self.base.normal_batch(self.to_object_batch(intersections)))
+        return Vector3.normalize_batch(normals @ self.__inverse_linear)
+
+    def texture_color(self, intersection, footprint=0.0):
+        return Color(*self.texture_color_batch(Vector3.to_array(intersection)[None], footprint)[0].tolist())
+
+    def texture_color_batch(self, intersections, footprints=0.0):
+        return self.base.texture_color_batch(self.to_object_batch(intersections),
+                                             np.asarray(footprints) / self.__footprint_scale)
+
+    def color(self, light, camera_position, intersection, footprint=0.0):
+        return Color(*self.color_batch(light, camera_position, Vector3.to_array(intersection)[None], footprint)[0]
+                     .tolist())
+
+    def color_batch(self, light, camera_position, intersections, footprints=0.0):
+        illumination = self.phong_batch(light, camera_position, intersections, self.normal_batch(intersections))
+
+        return illumination + self.texture_color_batch(intersections, footprints)
+
+    def __repr__(self):
+        return f'Instance({self.base!r}, {self.position}, {self.rotation}, {self.scale})'
+
+
 """-------------------------------------------Lights-----------------------------------------------------------------"""
 
 
 class Light(Transform):
-    def __init__(self, position, rotation):
-        super().__init__(position, rotation, Vector3.zeros())
-
+    """
+    Light source that shapes are shaded with, every method has a scalar version for Vector3 points
+    and a vectorized version for (N, 3) arrays of points.
+    """
 
-class PointLight(Light):
-    def __init__(self, position, rotation, radius, ambient, diffuse, specular):
-        super().__init__(position, rotation)
-        self.radius = radius
+    def __init__(self, position, rotation, ambient, diffuse, specular):
+        super().__init__(position, rotation, Vector3(1, 1, 1))
         self.ambient = ambient
         self.diffuse = diffuse
         self.specular = specular
 
+    # Unit vector from a point towards the light
+    @abstractmethod
+    def direction(self, point):
+        pass
+
+    @abstractmethod
+    def direction_batch(self, points):
+        pass
+
+    # Distance that a shadow ray from a point has to travel to reach the light
+    @abstractmethod
+    def distance(self, point):
+        pass
+
+    @abstractmethod
+    def distance_batch(self, points):
+        pass
+
+    # Vector that the specular highlight is centered on, given the unit vector from the point to the camera
+    @abstractmethod
+    def half_vector(self, point, view_direction):
+        pass
+
+    @abstractmethod
+    def half_vector_batch(self, points, view_directions):
+        pass
+
+    # Cosine of the half angle of the cone that the light covers seen from a point, the cone is centered on
+    # the given direction towards the light
+    @abstractmethod
+    def cone(self, point, light_direction):
+        pass
+
+    @abstractmethod
+    def cone_batch(self, points, light_directions):
+        pass
+
+    # Factor in [0, 1] that the illumination of a point is multiplied with
+    def attenuation(self, point):
+        return 1.0
+
+    def attenuation_batch(self, points):
+        return np.ones(len(points))
+
+
+class PointLight(Light):
+    """
+    Spherical light, shadows are soft according to its radius.
+
+    Without a range the light reaches the whole scene with the same intensity. With a range the intensity falls off
+    smoothly to 0 at that distance, and the light is never sampled by points outside of it.
+    """
+
+    def __init__(self, position, rotation, radius, ambient, diffuse, specular, range=None):
+        super().__init__(position, rotation, ambient, diffuse, specular)
+        self.radius = radius
+        self.range = range
+
+    def direction(self, point):
+        return Vector3.sub_normalize(self.position, point)
+
+    def direction_batch(self, points):
+        return Vector3.normalize_batch(Vector3.to_array(self.position) - points)
+
+    def distance(self, point):
+        return Vector3.magnitude(Vector3.subtract(self.position, point))
+
+    def distance_batch(self, points):
+        offsets = Vector3.to_array(self.position) - points
+        return np.sqrt(Vector3.dot_batch(offsets, offsets))
+
+    # The highlight of a point light is centered between the view direction and the position vector of the light
+    def half_vector(self, point, view_direction):
+        return Vector3.normalize(Vector3.add(self.position, view_direction))
+
+    def half_vector_batch(self, points, view_directions):
+        return Vector3.normalize_batch(Vector3.to_array(self.position) + view_directions)
+
+    def cone(self, point, light_direction):
+        perp_l = Vector3.cross(light_direction, Vector3(0, 1, 0))
+
+        if perp_l.x == 0.0 and perp_l.y == 0.0 and perp_l.z == 0.0:
+            perp_l.x = 1
+
+        # The vector that points in the direction of the light's edge
+        light_edge = Vector3.sub_normalize(Vector3.madd(self.position, self.radius, perp_l), point)
+
+        # Rounding can push the cosine of a tiny angle past 1
+        return math.cos(math.acos(min(max(Vector3.dot(light_direction, light_edge), -1.0), 1.0)) * 2.0)
+
+    def cone_batch(self, points, light_directions):
+        perp_l = np.cross(light_directions, np.array([0.0, 1.0, 0.0]))
+        perp_l[~perp_l.any(axis=1), 0] = 1
+
+        light_edge = Vector3.normalize_batch(self.radius * perp_l + Vector3.to_array(self.position) - points)
+
+        return np.cos(np.arccos(np.clip(Vector3.dot_batch(light_directions, light_edge), -1, 1)) * 2.0)
+
+    def attenuation(self, point):
+        if self.range is None:
+            return 1.0
+
+        # Windowed falloff, 1 at the light and 0 from the range onwards
+        ratio = Vector3.magnitude(Vector3.subtract(self.position, point)) / self.range
+        return max(1.0 - ratio ** 4, 0.0) ** 2
+
+    def attenuation_batch(self, points):
+        if self.range is None:
+            return super().attenuation_batch(points)
+
+        ratio = self.distance_batch(points) / self.range
+        return np.maximum(1.0 - ratio ** 4, 0.0) ** 2
+
 
 class DirectionalLight(Light):
-    def __init__(self, position, rotation):
-        super().__init__(position, rotation)
+    """
+    Light infinitely far away that shines along a single direction, (0, -1, 0) turned by its rotation.
+
+    The angle is the angular radius of the light seen from the scene, 0 casts hard shadows.
+    """
+
+    def __init__(self, position, rotation, ambient, diffuse, specular, angle=0.0):
+        super().__init__(position, rotation, ambient, diffuse, specular)
+        self.angle = angle
+        self.__update()
+
+    def move(self, position=None, rotation=None):
+        super().move(position, rotation)
+        self.__update()
+
+    def __update(self):
+        # Points towards the light, against the direction it shines in
+        self.to_light = Vector3.normalize(Matrix4X4.mul_vector3(self.rotation_mat, Vector3(0, 1, 0, 0)))
+
+    def direction(self, point):
+        return self.to_light
+
+    def direction_batch(self, points):
+        return np.broadcast_to(Vector3.to_array(self.to_light), points.shape)
+
+    def distance(self, point):
+        return math.inf
+
+    def distance_batch(self, points):
+        return np.full(len(points), np.inf)
+
+    def half_vector(self, point, view_direction):
+        return Vector3.normalize(Vector3.add(self.to_light, view_direction))
+
+    def half_vector_batch(self, points, view_directions):
+        return Vector3.normalize_batch(Vector3.to_array(self.to_light) + view_directions)
+
+    def cone(self, point, light_direction):
+        return math.cos(self.angle)
+
+    def cone_batch(self, points, light_directions):
+        return np.full(len(points), math.cos(self.angle))
 
 
 """-------------------------------------------Camera-----------------------------------------------------------------"""
@@ -200,6 +669,78 @@ class Camera(Transform):
         self.bottom = Vector3(0, -1 / (float(width) / height), -1)
         self.width = width
         self.height = height
+        # Angle between the rays of two neighbouring pixels, used to estimate texture footprints
+        self.pixel_spread = 2 * fov / max(width - 1, 1) / 0.5
+
+    def move(self, position=None, rotation=None):
+        super().move(position, rotation)
+        self.center = Matrix4X4.mul_vector3(self.modelMat, Vector3.zeros())
+
+    def directions_through(self, xs, ys):
+        """
+        Returns the unit directions of the rays from the center of the camera through points of its view plane.
+
+        :param xs: numpy.ndarray<float>
+        :param ys: numpy.ndarray<float>
+        :return: numpy.ndarray (N, 3)
+        """
+        return Camera.__directions_through(Matrix4X4.to_array(self.modelMat), xs, ys)
+
+    def ray_directions(self, pattern="fixed"):
+        """
+        Returns the unit directions of the primary rays of every pixel as one contiguous read-only array of shape
+        (height, width, samples, 3). "fixed" holds the 4 anti-aliasing sub-pixels of every pixel and "center" a single
+        ray through the center of every pixel.
+
+        The arrays are cached by the camera transform, the resolution and the pattern, so renders of the same view
+        skip the ray setup, and worker processes forked after a table was built inherit it.
+
+        :param pattern: str, a key of RAY_PATTERNS
+        :return: numpy.ndarray
+        """
+        if pattern not in RAY_PATTERNS:
+            raise ValueError(f'Unknown ray pattern "{pattern}", expected one of {", ".join(RAY_PATTERNS)}')
+
+        return Camera.__ray_table(
+            tuple(Matrix4X4.to_array(self.modelMat).ravel().tolist()),
+            self.width,
+            self.height,
+            (self.left.x, self.right.x, self.top.y, self.bottom.y),
+            pattern
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=RAY_TABLE_CACHE_SIZE)
+    def __ray_table(matrix, width, height, bounds, pattern):
+        left, right, top, bottom = bounds
+        samples_y = np.linspace(top, bottom, height)
+        samples_x, sample_size_x = np.linspace(left, right, width, retstep=True)
+
+        # Both axes step by a quarter of the horizontal pixel size
+        offsets = np.array(RAY_PATTERNS[pattern]) * sample_size_x / 4
+        shape = (height, width, len(offsets))
+
+        points_x = np.broadcast_to(samples_x[None, :, None] + offsets[:, 0], shape)
+        points_y = np.broadcast_to(samples_y[:, None, None] + offsets[:, 1], shape)
+
+        directions = Camera.__directions_through(np.reshape(matrix, (4, 4)), points_x.ravel(), points_y.ravel())
+        directions = directions.reshape(shape + (3,))
+        directions.flags.writeable = False
+
+        return directions
+
+    @staticmethod
+    def __directions_through(model, xs, ys):
+        points = np.empty((len(xs), 4))
+        points[:, 0] = xs
+        points[:, 1] = ys
+        points[:, 2] = -0.5
+        points[:, 3] = 1
+
+        pixels = points @ model[:3].T
+
+        # The center of the camera is its translation
+        return Vector3.normalize_batch(pixels - model[:3, 3])
 
 
 """-------------------------------------------Material---------------------------------------------------------------"""
@@ -214,8 +755,23 @@ class Material:
             shininess=Color.white(),
             texture=None
     ):
+        """
+        :param texture: Texture, numpy.ndarray image or str path to an image,
+                        paths are loaded through the texture cache when the texture is first used
+        """
         self.ambient = ambient
         self.diffuse = diffuse
         self.specular = specular
         self.shininess = shininess
         self.texture = texture
+
+    @property
+    def texture(self):
+        if isinstance(self.__texture, (str, os.PathLike)):
+            self.__texture = Texture.load(self.__texture)
+
+        return self.__texture
+
+    @texture.setter
+    def texture(self, texture):
+        self.__texture = texture if isinstance(texture, (str, os.PathLike)) else Texture.create(texture)
@@ -0,0 +1,221 @@
+import pickle
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+
+# Textures and arrays smaller than this are pickled along with the scene instead of being placed in shared memory
+SHARED_TEXTURE_MIN_BYTES = 1 << 16
+
+# Per-process state of the pool workers
+__worker_render_tile = None
+__worker_scene = None
+
+
+def split_tiles(height, width, tile_size):
+    """
+    Splits an image into row-major tiles of at most tile_size x tile_size pixels.
+
+    :param height: int
+    :param width: int
+    :param tile_size: int, None renders the whole image as a single tile
+    :return: array<(slice, slice)>
+    """
+    if tile_size is None or tile_size <= 0:
+        tile_size = max(height, width, 1)
+
+    return [
+        (slice(y, min(y + tile_size, height)), slice(x, min(x + tile_size, width)))
+        for y in range(0, height, tile_size)
+        for x in range(0, width, tile_size)
+    ]
+
+
+class SharedTexture:
+    """
+    Stands in for a texture level or another large array while the scene is pickled,
+    a worker unpickles it as a read-only array viewing the shared block.
+    """
+
+    # Blocks attached by this process, they must stay open for as long as the arrays viewing them are used
+    attached = []
+
+    def __init__(self, block, shape, dtype):
+        self.name = block.name
+        self.shape = shape
+        self.dtype = dtype
+
+    @staticmethod
+    def create(texture):
+        """
+        Copies a texture into a new shared memory block.
+
+        :param texture: numpy.ndarray
+        :return: SharedTexture, multiprocessing.shared_memory.SharedMemory
+        """
+        from multiprocessing import shared_memory  # Only parallel renders share memory
+
+        block = shared_memory.SharedMemory(create=True, size=max(texture.nbytes, 1))
+        np.ndarray(texture.shape, texture.dtype, buffer=block.buf)[:] = texture
+
+        return SharedTexture(block, texture.shape, texture.dtype.str), block
+
+    @staticmethod
+    def attach(name, shape, dtype):
+        from multiprocessing import shared_memory
+
+        block = shared_memory.SharedMemory(name=name)
+        SharedTexture.attached.append(block)
+
+        texture = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        texture.flags.writeable = False
+
+        return texture
+
+    def __reduce__(self):
+        return SharedTexture.attach, (self.name, self.shape, self.dtype)
+
+
+def render_tiles_parallel(
+        render_tile,
+        scene,
+        materials,
+        image,
+        tiles,
+        workers,
+        merge=None,
+        read_background=None,
+        shared=()
+):
+    """
+    Renders the tiles of an image on a pool of worker processes.
+
+    The scene is pickled once and sent to every worker when it starts, the tasks only carry the tile coordinates
+    and background. Large textures of the given materials, and the large arrays named by the SHARED_ARRAYS of the
+    shared objects, are placed in shared memory instead of being pickled.
+    At most two tiles per worker are in flight, so the backgrounds and results waiting in the pool stay small
+    however large the image is. When merge raises, the tiles that did not start yet are dropped before the
+    exception is passed on.
+
+    :param render_tile: function(*scene, background, rows, cols) -> numpy.ndarray or result passed to merge
+    :param scene: tuple
+    :param materials: array<Material>
+    :param image: numpy.ndarray
+    :param tiles: array<(slice, slice)>
+    :param workers: int
+    :param merge: function(result, rows, cols) -> numpy.ndarray, turns what render_tile returned into the tile,
+                  None when render_tile returns the tile itself
+    :param read_background: function(rows, cols) -> numpy.ndarray, None reads the background from the image
+    :param shared: array<object> objects of the scene with a SHARED_ARRAYS attribute, e.g. CompiledGeometry
+    :return: numpy.ndarray
+    """
+    # Worker processes pull in multiprocessing, serial renders never import it
+    from concurrent.futures import ProcessPoolExecutor
+
+    if read_background is None:
+        def read_background(rows, cols):
+            return image[rows, cols]
+
+    blocks = []
+
+    try:
+        payload = __pickle_scene(render_tile, scene, materials, shared, blocks)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=__init_worker, initargs=(payload,)) as pool:
+            pending = iter(tiles)
+            futures = {}
+
+            while True:
+                while len(futures) < 2 * workers:
+                    tile = next(pending, None)
+
+                    if tile is None:
+                        break
+
+                    rows, cols = tile
+                    futures[pool.submit(__render_worker_tile, read_background(rows, cols), rows, cols)] = tile
+
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+                try:
+                    for future in done:
+                        rows, cols = futures.pop(future)
+                        result = future.result()
+                        image[rows, cols] = result if merge is None else merge(result, rows, cols)
+                except BaseException:
+                    pool.shutdown(cancel_futures=True)
+                    raise
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return image
+
+
+def __pickle_scene(render_tile, scene, materials, shared, blocks):
+    """
+    Pickles the scene with the mip levels of its large textures and its other large arrays replaced by references to
+    shared memory blocks.
+
+    :param render_tile: function
+    :param scene: tuple
+    :param materials: array<Material>
+    :param shared: array<object>
+    :param blocks: array<SharedMemory> the created blocks are appended here, the caller has to unlink them
+    :return: bytes
+    """
+    originals = {}
+    arrays = []
+
+    try:
+        for owner in shared:
+            for name in owner.SHARED_ARRAYS:
+                array = getattr(owner, name)
+
+                if array.nbytes < SHARED_TEXTURE_MIN_BYTES:
+                    continue
+
+                arrays.append((owner, name, array))
+                shared_array, block = SharedTexture.create(array)
+                setattr(owner, name, shared_array)
+                blocks.append(block)
+
+        for material in materials:
+            texture = material.texture
+
+            # Materials that use the same texture share its blocks
+            if texture is None or id(texture) in originals or texture.levels[0].nbytes < SHARED_TEXTURE_MIN_BYTES:
+                continue
+
+            originals[id(texture)] = (texture, texture.levels)
+            texture.levels = []
+
+            for level in originals[id(texture)][1]:
+                if level.nbytes < SHARED_TEXTURE_MIN_BYTES:
+                    texture.levels.append(level)
+                    continue
+
+                shared_level, block = SharedTexture.create(level)
+                texture.levels.append(shared_level)
+                blocks.append(block)
+
+        return pickle.dumps((render_tile, scene), protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        for texture, levels in originals.values():
+            texture.levels = levels
+
+        for owner, name, array in arrays:
+            setattr(owner, name, array)
+
+
+def __init_worker(payload):
+    global __worker_render_tile, __worker_scene
+
+    __worker_render_tile, __worker_scene = pickle.loads(payload)
+
+
+def __render_worker_tile(background, rows, cols):
+    return __worker_render_tile(*__worker_scene, background, rows, cols)
@@ -1,9 +1,66 @@
+import bisect
+import copy
+import functools
 import math
-import random
+import os
+import sys
+import time
 
 import numpy as np
 
+from .bvh import *
+from .denoise import *
 from .objects import *
+from .parallel import *
+from .sampling import *
+from .stats import *
+
+# Maximum number of primary rays traced at once by the numpy backend
+RAY_CHUNK_SIZE = 1 << 16
+
+# Curves that tonemap maps linear radiance to the displayable [0, 1] range with
+TONE_MAPPINGS = ("clip", "reinhard", "none")
+
+
+class RenderSettings:
+    """
+    Sampling settings of a render, shared by every tile of the frame.
+    """
+
+    def __init__(
+            self,
+            shadow_samples=10,
+            backend="python",
+            antialiasing="fixed",
+            adaptive_threshold=0.1,
+            max_subsamples=4,
+            shadow_sampling="fixed",
+            shadow_probes=4,
+            shadow_tolerance=0.05,
+            seed=None,
+            auxiliary=False
+    ):
+        if backend not in ("python", "numpy"):
+            raise ValueError(f'Unknown backend "{backend}", expected "python" or "numpy"')
+
+        if antialiasing not in ("fixed", "adaptive"):
+            raise ValueError(f'Unknown anti-aliasing mode "{antialiasing}", expected "fixed" or "adaptive"')
+
+        if shadow_sampling not in ("fixed", "adaptive"):
+            raise ValueError(f'Unknown shadow sampling mode "{shadow_sampling}", expected "fixed" or "adaptive"')
+
+        self.shadow_samples = shadow_samples
+        self.backend = backend
+        self.antialiasing = antialiasing
+        self.adaptive_threshold = adaptive_threshold
+        self.max_subsamples = max_subsamples
+        # None casts shadow_samples rays from every surface point
+        self.shadow_probes = max(1, min(shadow_probes, shadow_samples)) if shadow_sampling == "adaptive" else None
+        self.shadow_tolerance = shadow_tolerance
+        # Unseeded renders draw a seed here, so every tile of the frame uses the same one
+        self.seed = resolve_seed(seed)
+        # Tiles carry the AUXILIARY_CHANNELS of the denoiser after their radiance
+        self.auxiliary = auxiliary
 
 
 def render(
@@ -11,184 +68,1084 @@ def render(
         light,
         camera,
         background_image=None,
-        shadow_samples=10
+        shadow_samples=10,
+        backend="python",
+        workers=1,
+        tile_size=32,
+        antialiasing="fixed",
+        adaptive_threshold=0.1,
+        max_subsamples=4,
+        shadow_sampling="fixed",
+        shadow_probes=4,
+        shadow_tolerance=0.05,
+        seed=None,
+        stats=None,
+        output=None,
+        dtype=None,
+        tone_mapping="clip",
+        exposure=1.0,
+        gamma=1.0,
+        progress=None,
+        denoise=False,
+        auxiliary=None,
+        coordinator=None
 ):
     """
     Renders a scene visible to the camera
 
+    The "python" backend traces every ray separately, the "numpy" backend traces whole batches of rays as arrays.
+    Both backends query a bounding volume hierarchy that is built once per frame, unless a BVH is passed in place of
+    the objects. The hierarchy is built over the objects compiled into packed arrays, see compile_scene, and parallel
+    renders share the large arrays with the workers instead of copying them.
+    The image is rendered in square tiles, with more than one worker the tiles are distributed over a process pool.
+    With a RenderCoordinator the tiles are handed out to the worker processes connected to it instead, which may run
+    on other machines, and workers is ignored.
+
+    Only the tiles in flight are held in memory: the background is read one tile at a time, so a background loaded
+    with numpy.load(..., mmap_mode='r') or given as the path of a .npy file is never read whole, and with an output
+    path every finished tile is written to a memory-mapped .npy file instead of an array in memory.
+
+    With "fixed" anti-aliasing every pixel is sampled with 4 sub-pixel rays. With "adaptive" anti-aliasing every pixel
+    is sampled with one center ray, and only the pixels whose color differs from a neighbour by more than
+    adaptive_threshold, that border a different object or that lie in a penumbra are refined with up to
+    max_subsamples sub-pixel rays on a regular grid.
+
+    With "fixed" shadow sampling every surface point casts shadow_samples shadow rays. With "adaptive" shadow sampling
+    every point casts shadow_probes shadow rays first and stops if they agree, points in a penumbra keep casting
+    rounds of shadow_probes rays until the 95% confidence interval of the shadow value is narrower than
+    shadow_tolerance on either side, or shadow_samples rays were cast.
+
+    Shadow rays follow a Halton sequence over the cone towards the light, randomly shifted at every surface point.
+    The shifts are a hash of the seed, the pixel and the index of the sample in the pixel, see sample_uniform, so with
+    a seed every pixel renders to the same bits regardless of the tile size, the order the tiles are rendered in,
+    the backend or the worker that renders it.
+
+    With several lights every shadow ray goes to a single light, chosen with a probability proportional to the
+    unshadowed illumination of that light at the surface point, so the number of shadow rays does not grow with the
+    number of lights. Lights whose attenuation is 0 at a point, e.g. point lights out of range, are never chosen.
+
+    The samples of a tile are accumulated unclamped in a float32 buffer of linear radiance, where 1 is full white and
+    the background counts as its value / 255. Every finished tile goes through a single tonemap pass that applies
+    the exposure, tone mapping and gamma and quantizes it to the dtype of the output, in the 0-255 range of the
+    background. A float dtype with tone_mapping "none" keeps the high dynamic range values above 255.
+
+    A RenderStats passed as stats is filled with the ray counts, timings and pixel costs of the frame.
+    The pixel costs of the python backend are measured per pixel, the other modes spread the time of a tile evenly
+    over its pixels.
+
+    A progress function is called in the calling process whenever a tile is finished, an exception raised by it stops
+    the render and is passed on to the caller.
+
+    An AuxiliaryBuffers passed as auxiliary is filled with the normals, depths, objects, albedos and unshadowed
+    radiance of the frame, traced by a pass of the sub-pixel rays without shadows that draws no random numbers, so
+    the image itself does not change. With denoise the frame is also kept as linear radiance and filtered with
+    denoise_radiance guided by those buffers before it is tonemapped again, so a denoised frame needs far fewer
+    shadow_samples. The denoiser sees the whole frame, which is then held in memory regardless of the output.
+
+    :param geometry_objects: array<Shape> or BVH
+    :param light: Light or array<Light>
+    :param camera: Camera
+    :param background_image: numpy.ndarray or str path to a .npy file
+    :param shadow_samples: int
+    :param backend: str
+    :param workers: int, None uses all CPU cores
+    :param tile_size: int
+    :param antialiasing: str
+    :param adaptive_threshold: float
+    :param max_subsamples: int
+    :param shadow_sampling: str
+    :param shadow_probes: int
+    :param shadow_tolerance: float
+    :param seed: int, None draws a different image every time
+    :param stats: RenderStats, None does not collect statistics
+    :param output: numpy.ndarray to render into, str path of a .npy file to create, or None
+    :param dtype: numpy.dtype of the image, None uses the dtype of the background or uint16 without one
+    :param tone_mapping: str, one of TONE_MAPPINGS
+    :param exposure: float
+    :param gamma: float
+    :param progress: function(rows, cols, finished, total) with the slices of the tile and the number of finished tiles
+    :param denoise: bool
+    :param auxiliary: AuxiliaryBuffers, None only creates them to denoise
+    :param coordinator: RenderCoordinator, None renders on this machine
+    :return: numpy.ndarray, a numpy.memmap when output is a path
+    """
+    settings = RenderSettings(
+        shadow_samples,
+        backend,
+        antialiasing,
+        adaptive_threshold,
+        max_subsamples,
+        shadow_sampling,
+        shadow_probes,
+        shadow_tolerance,
+        seed,
+        denoise or auxiliary is not None
+    )
+    lights = __get_lights(light)
+
+    if tone_mapping not in TONE_MAPPINGS:
+        raise ValueError(f'Unknown tone mapping "{tone_mapping}", expected one of {", ".join(TONE_MAPPINGS)}')
+
+    if isinstance(background_image, (str, os.PathLike)):
+        background_image = np.load(background_image, mmap_mode='r')
+
+    # If no background image given the background is black
+    if background_image is None:
+        shape = (camera.height, camera.width, 3)
+        dtype = np.dtype(np.uint16 if dtype is None else dtype)
+    else:
+        shape = background_image.shape
+        dtype = background_image.dtype if dtype is None else np.dtype(dtype)
+
+    image = __create_output(output, shape, dtype)
+
+    def read_background(rows, cols):
+        if background_image is None:
+            return np.zeros((rows.stop - rows.start, cols.stop - cols.start) + shape[2:], np.float32)
+
+        return np.array(background_image[rows, cols])
+
+    bvh = geometry_objects if isinstance(geometry_objects, BVH) else BVH(geometry_objects)
+    tiles = split_tiles(camera.height, camera.width, tile_size)
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    render_tile = __render_tile
+
+    if stats is not None:
+        stats.pixel_cost = np.zeros((camera.height, camera.width))
+        render_tile = __render_tile_with_stats
+
+    if settings.auxiliary and auxiliary is None:
+        auxiliary = AuxiliaryBuffers()
+
+    if settings.auxiliary:
+        auxiliary.allocate(camera.height, camera.width)
+
+    # The denoiser filters the whole frame, so its radiance is kept until every tile is finished
+    frame = np.zeros(shape, np.float32) if denoise else None
+    finished = 0
+
+    def merge(result, rows, cols):
+        nonlocal finished
+
+        # The tiles come back as linear radiance and are only quantized here, once
+        if stats is not None:
+            result, tile_stats, pixel_cost = result
+            stats.add_tile(tile_stats, rows, cols, pixel_cost)
+
+        if settings.auxiliary:
+            auxiliary.add_tile(result[:, :, -AUXILIARY_CHANNELS:], rows, cols)
+            result = result[:, :, :-AUXILIARY_CHANNELS]
+
+        if frame is not None:
+            frame[rows, cols] = result
+
+        tile = tonemap(result, dtype, tone_mapping, exposure, gamma)
+        finished += 1
+
+        if progress is not None:
+            progress(rows, cols, finished, len(tiles))
+
+        return tile
+
+    if coordinator is not None:
+        coordinator.render_tiles(render_tile, (bvh, lights, camera, settings), image, tiles, merge, read_background)
+    elif workers > 1:
+        # Worker processes forked from here inherit the cached primary rays instead of building their own
+        camera.ray_directions("center" if settings.antialiasing == "adaptive" else "fixed")
+
+        render_tiles_parallel(
+            render_tile,
+            (bvh, lights, camera, settings),
+            [obj.material for obj in bvh.objects],
+            image,
+            tiles,
+            workers,
+            merge,
+            read_background,
+            [bvh.geometry]
+        )
+    else:
+        for rows, cols in tiles:
+            result = render_tile(bvh, lights, camera, settings, read_background(rows, cols), rows, cols)
+            image[rows, cols] = merge(result, rows, cols)
+
+    if frame is not None:
+        image[:, :, :3] = tonemap(denoise_radiance(frame[:, :, :3], auxiliary), dtype, tone_mapping, exposure, gamma)
+
+    if isinstance(image, np.memmap):
+        image.flush()
+
+    return image
+
+
+def tonemap(radiance, dtype=np.uint16, tone_mapping="clip", exposure=1.0, gamma=1.0):
+    """
+    Turns linear radiance, where 1 is full white, into image values in the 0-255 range in a single vectorized pass.
+
+    "clip" clamps the radiance to [0, 1], "reinhard" compresses it with x / (1 + x) so highlights keep their detail,
+    and "none" leaves it as is. Integer dtypes are always clamped to [0, 255] and rounded.
+
+    :param radiance: numpy.ndarray
+    :param dtype: numpy.dtype
+    :param tone_mapping: str, one of TONE_MAPPINGS
+    :param exposure: float factor the radiance is scaled with first
+    :param gamma: float, the values are raised to 1 / gamma
+    :return: numpy.ndarray
+    """
+    dtype = np.dtype(dtype)
+    values = np.multiply(radiance, exposure, dtype=np.float32)
+
+    if tone_mapping == "reinhard":
+        np.maximum(values, 0, out=values)
+        values /= 1 + values
+
+    if tone_mapping != "none" or dtype.kind in "iu":
+        np.clip(values, 0, 1, out=values)
+
+    if gamma != 1:
+        np.power(np.maximum(values, 0, out=values), 1 / gamma, out=values)
+
+    values *= 255
+
+    if dtype.kind in "iu":
+        np.rint(values, out=values)
+
+    return values.astype(dtype, copy=False)
+
+
+def __get_lights(light):
+    """
+    Returns the lights of a scene as a list.
+
+    :param light: Light or array<Light>
+    :return: array<Light>
+    """
+    lights = [light] if isinstance(light, Light) else list(light)
+
+    if not lights:
+        raise ValueError('A scene needs at least one light')
+
+    return lights
+
+
+def __create_output(output, shape, dtype):
+    """
+    Returns the array that the tiles are written to.
+
+    :param output: numpy.ndarray, str path of a .npy file to create, or None
+    :param shape: tuple<int>
+    :param dtype: numpy.dtype
+    :return: numpy.ndarray
+    """
+    if output is None:
+        return np.empty(shape, dtype)
+
+    if isinstance(output, (str, os.PathLike)):
+        return np.lib.format.open_memmap(output, mode='w+', dtype=dtype, shape=shape)
+
+    if output.shape != shape:
+        raise ValueError(f'The output has the shape {output.shape}, expected {shape}')
+
+    return output
+
+
+def render_progressive(
+        geometry_objects,
+        light,
+        camera,
+        background_image=None,
+        shadow_samples=10,
+        preview_stride=4,
+        seed=None
+):
+    """
+    Renders a scene visible to the camera in passes, yielding a refined image after every pass.
+
+    The first pass traces a single ray with one shadow sample for every preview_stride x preview_stride block.
+    The next four passes trace one anti-aliasing sub-pixel of every pixel each, and the remaining passes add one
+    shadow sample to every sub-pixel until shadow_samples is reached. The passes are traced with the numpy backend,
+    and the caller can stop iterating at any time.
+
     :param geometry_objects: array<Shape>
-    :param light: Light
+    :param light: Light or array<Light>
     :param camera: Camera
     :param background_image: numpy.ndarray
     :param shadow_samples: int
-    :return: numpy.ndarray
+    :param preview_stride: int
+    :param seed: int, None draws a different image every time
+    :return: generator<(numpy.ndarray, float)> running average image as float32 and the fraction of work done
     """
-    # If no background image given we create a black background
+    height, width = camera.height, camera.width
+
     if background_image is None:
-        background_image = np.zeros((camera.height, camera.width, 3), np.uint16)
+        background = np.zeros((height, width, 3), np.float32)
+    else:
+        background = np.asarray(background_image, dtype=np.float32)[:, :, :3]
+
+    lights = __get_lights(light)
+    bvh = BVH(geometry_objects)
+    seed = resolve_seed(seed)
+    first_shadow_samples = min(shadow_samples, 1)
+
+    # The anti-aliasing passes use the keys of the fixed sub-pixels, every shadow pass the 4 keys after the last ones
+    keys = sample_keys(slice(0, height), slice(0, width), width, 4)
+
+    directions = camera.ray_directions("fixed")
+    center = Vector3.to_array(camera.center)
+
+    # Every sub-pixel keeps its unshadowed lighting and surface, so later passes can add shadow samples to it
+    lighting = np.zeros((height, width, 4, len(lights), 3))
+    textures = np.zeros((height, width, 4, 3))
+    probabilities = np.zeros((height, width, 4, len(lights)))
+    intersections = np.zeros((height, width, 4, 3))
+    normals = np.zeros((height, width, 4, 3))
+    hits = np.zeros((height, width, 4), dtype=bool)
+    visible = np.zeros((height, width, 4, len(lights)))
+    shadow_counts = np.zeros((height, width, 4))
+
+    # Progress is measured in rays, assuming that every primary ray hits a surface
+    preview = background[::preview_stride, ::preview_stride]
+    total = (
+        (preview.shape[0] * preview.shape[1] + 4 * height * width) * (1 + first_shadow_samples) +
+        4 * height * width * (shadow_samples - first_shadow_samples)
+    )
+    done = 0
 
-    shadow_texture = np.ones((camera.height, camera.width, 3), np.uint16)
-    shadow_texture.fill(255)
-    image = np.copy(background_image)
-    image.flags.writeable = True
+    def trace(pixel_directions):
+        # Returns the hits, unshadowed lighting, texture colors, intersections and normals of a set of sub-pixel rays
+        results = [
+            __shade_surface_numpy(
+                np.broadcast_to(center, chunk.shape), chunk, camera.center, bvh, lights, camera.pixel_spread
+            )
+            for chunk in np.split(pixel_directions, range(RAY_CHUNK_SIZE, len(pixel_directions), RAY_CHUNK_SIZE))
+        ]
+
+        return [np.concatenate([result[k] for result in results]) for k in range(5)]
+
+    # Preview pass, the value of every block is shown until its pixels are traced
+    pixel_directions = directions[::preview_stride, ::preview_stride, 0].reshape((-1, 3))
+    preview_hits, preview_lighting, preview_textures, preview_points, preview_normals = trace(pixel_directions)
+    preview_probabilities = __get_light_probabilities(preview_lighting)
+    preview_keys = keys[::preview_stride, ::preview_stride, 0].ravel() | np.uint64((1 << SAMPLE_INDEX_BITS) - 1)
+    preview_visible = __calculate_soft_shadow_numpy(
+        preview_points,
+        preview_normals,
+        preview_probabilities,
+        bvh,
+        lights,
+        first_shadow_samples,
+        __get_shadow_shifts_numpy(seed, preview_keys[preview_hits], lights)
+    )
+    preview_colors, _ = __combine_lighting_numpy(
+        preview_lighting,
+        preview_textures,
+        preview_probabilities,
+        preview_visible,
+        np.full(len(preview_points), first_shadow_samples)
+    )
+
+    preview = preview.reshape((-1, 3)) / 255
+    preview[preview_hits] = preview_colors
+    preview = tonemap(preview, np.float32).reshape((*background[::preview_stride, ::preview_stride].shape[:2], 3))
+    preview = np.repeat(np.repeat(preview, preview_stride, axis=0), preview_stride, axis=1)[:height, :width]
+
+    done += len(pixel_directions) * (1 + first_shadow_samples)
+    yield preview.astype(np.float32), done / total
+
+    def resolve(traced_sub_pixels):
+        # Average the traced sub-pixels, rays that missed every object take the value of the background
+        traced = slice(None, traced_sub_pixels)
+        colors, _ = __combine_lighting_numpy(
+            lighting[:, :, traced], textures[:, :, traced], probabilities[:, :, traced], visible[:, :, traced],
+            shadow_counts[:, :, traced]
+        )
+        values = np.where(hits[:, :, traced, None], colors, background[:, :, None, :] / 255)
+
+        return tonemap(np.mean(values, axis=2), np.float32)
+
+    # Anti-aliasing passes
+    for sub_pixel in range(4):
+        pixel_hits, pixel_lighting, pixel_textures, pixel_points, pixel_normals = trace(
+            directions[:, :, sub_pixel].reshape((-1, 3))
+        )
+        pixel_probabilities = __get_light_probabilities(pixel_lighting)
+
+        hits[:, :, sub_pixel] = pixel_hits.reshape((height, width))
+        mask = hits[:, :, sub_pixel]
+        lighting[:, :, sub_pixel][mask] = pixel_lighting
+        textures[:, :, sub_pixel][mask] = pixel_textures
+        probabilities[:, :, sub_pixel][mask] = pixel_probabilities
+        intersections[:, :, sub_pixel][mask] = pixel_points
+        normals[:, :, sub_pixel][mask] = pixel_normals
+
+        if first_shadow_samples:
+            visible[:, :, sub_pixel][mask] = __calculate_soft_shadow_numpy(
+                pixel_points,
+                pixel_normals,
+                pixel_probabilities,
+                bvh,
+                lights,
+                first_shadow_samples,
+                __get_shadow_shifts_numpy(seed, keys[:, :, sub_pixel][mask], lights)
+            )
+            shadow_counts[:, :, sub_pixel][mask] = first_shadow_samples
+
+        done += height * width * (1 + first_shadow_samples)
+        yield resolve(sub_pixel + 1), done / total
+
+    # Shadow passes
+    for shadow_pass in range(1, shadow_samples - first_shadow_samples + 1):
+        if hits.any():
+            pass_keys = keys[hits] + np.uint64(4 * shadow_pass)
+            visible[hits] += __calculate_soft_shadow_numpy(
+                intersections[hits],
+                normals[hits],
+                probabilities[hits],
+                bvh,
+                lights,
+                1,
+                __get_shadow_shifts_numpy(seed, pass_keys, lights)
+            )
+            shadow_counts[hits] += 1
+
+        done += 4 * height * width
+        yield resolve(4), done / total
+
+
+def __render_tile(bvh, lights, camera, settings, background, rows, cols, pixel_cost=None):
+    """
+    Renders a rectangular tile of the image, pixels whose rays miss every object keep the value of the background.
+
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param camera: Camera
+    :param settings: RenderSettings
+    :param background: numpy.ndarray
+    :param rows: slice
+    :param cols: slice
+    :param pixel_cost: numpy.ndarray<float> receives the seconds spent on every pixel by the python backend
+    :return: numpy.ndarray<float32> linear radiance, followed by the AUXILIARY_CHANNELS with settings.auxiliary
+    """
+    # The samples are accumulated in linear radiance, the background is in the 0-255 range of the image
+    tile = np.asarray(background, dtype=np.float32) / np.float32(255)
 
-    samples_y, sample_size_y = np.linspace(camera.top.y, camera.bottom.y, camera.height, retstep=True)
-    samples_x, sample_size_x = np.linspace(camera.left.x, camera.right.x, camera.width, retstep=True)
+    if settings.auxiliary:
+        auxiliary = __render_auxiliary(bvh, lights, camera, tile, rows, cols)
+        settings = copy.copy(settings)
+        settings.auxiliary = False
 
-    # Calculate sub-step sizes for anti-aliasing
-    substep_x = sample_size_x / 4
-    substep_y = sample_size_x / 4
+        return np.concatenate([__render_tile(bvh, lights, camera, settings, background, rows, cols, pixel_cost),
+                               auxiliary], axis=2)
+
+    if settings.antialiasing == "adaptive":
+        return __render_tile_adaptive(bvh, lights, camera, settings, tile, rows, cols)
+
+    if settings.backend == "numpy":
+        return __render_tile_numpy(bvh, lights, camera, settings, tile, rows, cols)
+
+    backgrounds = tile[:, :, :3].tolist()
+
+    # The anti-aliasing sub-pixel rays of the tile and the shifts of their shadow rays, shared with the numpy backend
+    directions = camera.ray_directions("fixed")[rows, cols].tolist()
+    shifts = __get_shadow_shifts_numpy(settings.seed, sample_keys(rows, cols, camera.width, 4), lights).tolist()
 
     """ For every pixel along a view plane shoot a ray and trace back the color"""
-    for i, y in enumerate(samples_y):
-        for j, x in enumerate(samples_x):
-            # Anti-aliasing sub-pixels
-            sub_pixels = [
-                Matrix4X4.mul_vector3(camera.modelMat, Vector3(x + substep_x, y + substep_y, -0.5)),
-                Matrix4X4.mul_vector3(camera.modelMat, Vector3(x - substep_x, y + substep_y, -0.5)),
-                Matrix4X4.mul_vector3(camera.modelMat, Vector3(x + substep_x, y - substep_y, -0.5)),
-                Matrix4X4.mul_vector3(camera.modelMat, Vector3(x - substep_x, y - substep_y, -0.5))
-            ]
-
-            values = []
-            for pixel in sub_pixels:
+    for i, row in enumerate(directions):
+        for j, sub_pixels in enumerate(row):
+            if pixel_cost is not None:
+                start = time.perf_counter()
+
+            red = green = blue = 0.0
+            last_occluder = None
+            for k, direction in enumerate(sub_pixels):
                 # Define primary ray
-                primary_ray = Ray(camera.center, Vector3.normalize(Vector3.subtract(pixel, camera.center)))
+                primary_ray = Ray(camera.center, Vector3(*direction))
 
-                color = __sample_surface(primary_ray, camera.center, geometry_objects, light, shadow_samples)
+                color, _, _, last_occluder = __sample_surface(
+                    primary_ray,
+                    camera.center,
+                    bvh,
+                    lights,
+                    settings.shadow_samples,
+                    last_occluder,
+                    camera.pixel_spread,
+                    settings.shadow_probes,
+                    settings.shadow_tolerance,
+                    shifts[i][j][k]
+                )
 
+                # Lighting is accumulated unclamped, the color is only clamped when the tile is tonemapped
                 if color is None:
-                    back_val = image[i, j]
-                    values.append(back_val)
+                    back_red, back_green, back_blue = backgrounds[i][j]
+                    red, green, blue = red + back_red, green + back_green, blue + back_blue
                 else:
-                    values.append(np.array([color.r * 255, color.g * 255, color.b * 255]))
+                    red, green, blue = red + color.r, green + color.g, blue + color.b
 
-            # Save the final value to the buffer image
-            image[i, j] = tuple(__calculate_average_sample(np.array(values)))
+            # Save the average of the sub-pixels to the buffer image
+            tile[i, j, :3] = (red / 4, green / 4, blue / 4)
 
-    return image
+            if pixel_cost is not None:
+                pixel_cost[i, j] = time.perf_counter() - start
+
+    return tile
+
+
+def __render_tile_with_stats(bvh, lights, camera, settings, background, rows, cols):
+    """
+    Renders a tile while collecting its statistics.
+
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param camera: Camera
+    :param settings: RenderSettings
+    :param background: numpy.ndarray
+    :param rows: slice
+    :param cols: slice
+    :return: numpy.ndarray, RenderStats, numpy.ndarray<float> seconds spent on every pixel
+    """
+    tile_stats = RenderStats()
+    pixel_cost = np.zeros(background.shape[:2])
+
+    with tile_stats.collect(__get_stats_probes(bvh)):
+        start = time.perf_counter()
+        tile = __render_tile(bvh, lights, camera, settings, background, rows, cols, pixel_cost)
+        elapsed = time.perf_counter() - start
+
+    # Only the python backend measures single pixels
+    if not pixel_cost.any():
+        pixel_cost[:] = elapsed / max(pixel_cost.size, 1)
+
+    tile_stats.total_time = elapsed
+    tile_stats.tile_times.append((rows.start, rows.stop, cols.start, cols.stop, elapsed))
+
+    return tile, tile_stats, pixel_cost
+
+
+def __get_stats_probes(bvh):
+    """
+    Returns the functions that RenderStats.collect wraps to count and time the work of a render.
+
+    :param bvh: BVH
+    :return: array<(object, str, str, function)>
+    """
+    probes = [
+        (BVH, "closest_intersection", "intersection", __count_primary_ray),
+        (BVH, "closest_intersection_batch", "intersection", __count_primary_rays),
+        (sys.modules[__name__], "is_occluded", "shadows", __count_shadow_ray),
+        (BVH, "occluded_batch", "shadows", __count_shadow_rays),
+        (BVH, "_BVH__slab", None, __count_node_visit),
+        (BVH, "_BVH__slab_batch", None, __count_node_visits),
+        (Shape, "phong", "phong", None),
+        (Shape, "phong_batch", "phong", None),
+        (Texture, "sample", "texture", __count_texture_lookups)
+    ]
+
+    # Intersection tests are wrapped where they are defined and counted by the type of the shape they are called on
+    for name, count in (
+            ("calculate_intersection", __count_intersection_test),
+            ("calculate_intersection_batch", __count_intersection_tests)
+    ):
+        owners = {next(cls for cls in type(obj).__mro__ if name in cls.__dict__) for obj in bvh.objects}
+        probes.extend((owner, name, None, count) for owner in owners)
+
+    # The packed shapes are tested many at a time, every ray and shape pair counts as one test
+    probes.extend([
+        (BVH, "_BVH__hit", None, __count_scalar_packed_test),
+        (CompiledGeometry, "intersect_spheres", None, __count_packed_tests(Sphere)),
+        (CompiledGeometry, "intersect_sphere_pairs", None, __count_packed_pairs(Sphere)),
+        (CompiledGeometry, "intersect_planes", None, __count_packed_tests(Plane))
+    ])
+
+    return probes
 
 
-def __calculate_average_sample(samples):
+def __count_primary_ray(stats, *_):
+    stats.primary_rays += 1
+
+
+def __count_primary_rays(stats, bvh, origins, directions):
+    stats.primary_rays += len(directions)
+
+
+def __count_shadow_ray(stats, *_):
+    stats.shadow_rays += 1
+
+
+def __count_shadow_rays(stats, bvh, origins, directions, max_distances):
+    stats.shadow_rays += len(directions)
+
+
+def __count_node_visit(stats, *_):
+    stats.bvh_node_visits += 1
+
+
+def __count_node_visits(stats, node_min, node_max, origins, inverse):
+    stats.bvh_node_visits += len(origins)
+
+
+def __count_texture_lookups(stats, texture, u, *_):
+    stats.texture_lookups += np.size(u)
+
+
+def __count_intersection_test(stats, shape, *_):
+    stats.count_intersection_tests(type(shape).__name__)
+
+
+def __count_intersection_tests(stats, shape, origins, directions):
+    stats.count_intersection_tests(type(shape).__name__, len(directions))
+
+
+def __count_scalar_packed_test(stats, test, *_):
+    # The other shapes are counted by the probes of their own methods
+    if test[0] != SHAPE:
+        stats.count_intersection_tests(type(test[1]).__name__)
+
+
+def __count_packed_tests(shape_type):
+    def count(stats, geometry, rows, origins, directions):
+        stats.count_intersection_tests(shape_type.__name__, len(rows) * len(directions))
+
+    return count
+
+
+def __count_packed_pairs(shape_type):
+    def count(stats, geometry, rows, origins, directions):
+        stats.count_intersection_tests(shape_type.__name__, len(rows))
+
+    return count
+
+
+def __render_tile_adaptive(bvh, lights, camera, settings, tile, rows, cols):
     """
-    Average all the samples of the surface.
+    Renders a tile with one center ray per pixel, then refines the pixels on edges, high contrast areas and penumbras
+    with a regular grid of up to settings.max_subsamples sub-pixel rays.
 
-    :param samples: numpy.ndarray<numpy.ndarray<int>>
-    :return: numpy.ndarray<int>
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param camera: Camera
+    :param settings: RenderSettings
+    :param tile: numpy.ndarray
+    :param rows: slice
+    :param cols: slice
+    :return: numpy.ndarray
     """
-    height, width = samples.shape
-    return np.round(np.sum(samples, axis=0) / height)
+    height, width = tile.shape[:2]
+    background = tile.reshape((-1, tile.shape[2])).astype(np.float64)
+
+    # The center ray covers the whole pixel, it is sample 0 and the refinement rays the samples after it
+    values, ids, shadows = __trace_samples(
+        bvh,
+        lights,
+        camera,
+        settings,
+        camera.ray_directions("center")[rows, cols].reshape((-1, 3)),
+        sample_keys(rows, cols, camera.width, 1).ravel(),
+        camera.pixel_spread * 2,
+        background
+    )
+    values = values.reshape((height, width, -1))
+
+    refine = __find_pixels_to_refine(values, ids.reshape((height, width)), shadows.reshape((height, width)),
+                                     settings.adaptive_threshold)
+
+    if refine.any():
+        samples_y = np.linspace(camera.top.y, camera.bottom.y, camera.height)[rows]
+        samples_x, sample_size_x = np.linspace(camera.left.x, camera.right.x, camera.width, retstep=True)
+        xs, ys = np.meshgrid(samples_x[cols], samples_y)
+
+        # Same spacing as the fixed pattern, which uses the horizontal step for both axes
+        grid = max(2, math.isqrt(settings.max_subsamples))
+        offsets = ((np.arange(grid) + 0.5) / grid - 0.5) * sample_size_x
+        offsets_x, offsets_y = (offset.ravel() for offset in np.meshgrid(offsets, offsets))
+
+        i, j = np.nonzero(refine)
+        sub_values, _, _ = __trace_samples(
+            bvh,
+            lights,
+            camera,
+            settings,
+            camera.directions_through((xs[i, j][:, None] + offsets_x).ravel(), (ys[i, j][:, None] + offsets_y).ravel()),
+            sample_keys(rows, cols, camera.width, grid * grid, 1)[i, j].ravel(),
+            camera.pixel_spread * 2 / grid,
+            np.repeat(background.reshape((height, width, -1))[i, j], grid * grid, axis=0)
+        )
+
+        # The center sample is averaged with the sub-pixel samples
+        values[i, j] = (values[i, j] + sub_values.reshape((len(i), grid * grid, -1)).sum(axis=1)) / (grid * grid + 1)
+
+    tile[:] = values
+
+    return tile
+
+
+def __find_pixels_to_refine(values, ids, shadows, threshold):
+    """
+    Marks the pixels that differ from a neighbour by more than the threshold, see a different object than a
+    neighbour, or lie in a penumbra where the shadow samples disagree.
+
+    :param values: numpy.ndarray
+    :param ids: numpy.ndarray<int>
+    :param shadows: numpy.ndarray<float>
+    :param threshold: float
+    :return: numpy.ndarray<bool>
+    """
+    refine = (shadows > 0) & (shadows < 1)
+
+    # Contrast is measured on the displayed values, highlights brighter than white do not differ
+    values = np.clip(values, 0, 1)
+
+    edges_x = (np.abs(np.diff(values, axis=1)).max(axis=2) > threshold) | (ids[:, 1:] != ids[:, :-1])
+    refine[:, 1:] |= edges_x
+    refine[:, :-1] |= edges_x
+
+    edges_y = (np.abs(np.diff(values, axis=0)).max(axis=2) > threshold) | (ids[1:] != ids[:-1])
+    refine[1:] |= edges_y
+    refine[:-1] |= edges_y
+
+    return refine
+
+
+def __trace_samples(bvh, lights, camera, settings, directions, keys, pixel_spread, background):
+    """
+    Traces single rays from the center of the camera in the given directions.
+
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param camera: Camera
+    :param settings: RenderSettings
+    :param directions: numpy.ndarray (N, 3) unit directions
+    :param keys: numpy.ndarray<uint64> (N) sample keys of the rays
+    :param pixel_spread: float width of the footprint of a sample, in the units of Camera.pixel_spread
+    :param background: numpy.ndarray values of the rays that miss every object
+    :return: numpy.ndarray values, numpy.ndarray<int> ids of the objects hit or -1, numpy.ndarray<float> shadows
+    """
+    values = np.array(background, dtype=np.float64)
+    ids = np.full(len(directions), -1, dtype=np.int64)
+    shadows = np.ones(len(directions))
+
+    if settings.backend == "numpy":
+        origins = np.broadcast_to(Vector3.to_array(camera.center), directions.shape)
+
+        for start in range(0, len(directions), RAY_CHUNK_SIZE):
+            end = start + RAY_CHUNK_SIZE
+            hits, lighting, textures, intersections, normals, indices = __shade_surface_numpy(
+                origins[start:end], directions[start:end], camera.center, bvh, lights, pixel_spread
+            )
+
+            if not hits.any():
+                continue
+
+            probabilities = __get_light_probabilities(lighting)
+            visible, counts = __estimate_soft_shadow_numpy(
+                intersections, normals, probabilities, bvh, lights, settings, keys[start:end][hits]
+            )
+            colors, shadow = __combine_lighting_numpy(lighting, textures, probabilities, visible, counts)
+            rays = np.flatnonzero(hits) + start
+
+            values[rays, :3] = colors
+            ids[rays] = indices
+            shadows[rays] = shadow
+
+        return values, ids, shadows
+
+    last_occluder = None
+    shifts = __get_shadow_shifts_numpy(settings.seed, keys, lights).tolist()
+
+    for k, direction in enumerate(directions.tolist()):
+        primary_ray = Ray(camera.center, Vector3(*direction))
+
+        color, obj, shadow, last_occluder = __sample_surface(
+            primary_ray,
+            camera.center,
+            bvh,
+            lights,
+            settings.shadow_samples,
+            last_occluder,
+            pixel_spread,
+            settings.shadow_probes,
+            settings.shadow_tolerance,
+            shifts[k]
+        )
+
+        if color is not None:
+            values[k, :3] = (color.r, color.g, color.b)
+            ids[k] = id(obj)
+            shadows[k] = shadow
+
+    return values, ids, shadows
 
 
 def __sample_surface(
         primary_ray,
         origin,
         geometry_objects,
-        light,
-        shadow_samples=10
+        lights,
+        shadow_samples=10,
+        last_occluder=None,
+        pixel_spread=0.0,
+        shadow_probes=None,
+        shadow_tolerance=0.05,
+        shifts=None
 ):
     """
-    Return the sample from the surface that the Ray intersects.
+    Return the sample from the surface that the Ray intersects along with the object and the shadow value,
+    and the object that blocked the last shadow ray so the next sample of the pixel can test it first.
 
     :param primary_ray: Ray
     :param origin: Vector3
-    :param geometry_objects: array<Shape>
-    :param light: Light
+    :param geometry_objects: BVH or array<Shape>
+    :param lights: array<Light>
     :param shadow_samples: int
-    :return: Color
+    :param last_occluder: Shape
+    :param pixel_spread: float angle between neighbouring pixel rays, used to filter textures
+    :param shadow_probes: int number of shadow rays cast per round, None casts all shadow_samples at once
+    :param shadow_tolerance: float half width of the confidence interval at which adaptive shadow sampling stops
+    :param shifts: array<float> random shifts of the Halton points, 2 with a single light and 3 otherwise,
+                   None draws them
+    :return: Color, Shape object that was hit, float shadow value, Shape last occluder
     """
     # Check for ray object intersection and get the closest intersection point
     distance, obj = __find_closest_intersection(primary_ray, geometry_objects)
 
     if not obj:
-        return None
+        return None, None, 1.0, last_occluder
 
-    # Get the color of the object at the specific location
-    intersection = Vector3.add(primary_ray.origin, Vector3.scalar_mul(distance, primary_ray.direction))
-    color = obj.color(light, origin, intersection)
+    # Get the unshadowed lighting of the object at the specific location
+    intersection = Vector3.madd(primary_ray.origin, distance, primary_ray.direction)
+    # Each of the 4 anti-aliasing sub-pixels covers half a pixel
+    lighting, texture, normal = obj.shade(lights, origin, intersection, distance * pixel_spread / 2)
 
-    # Get the direction vector from intersection point to a light source
-    shifted_point = Vector3.add(intersection, Vector3.scalar_mul(1E-5, obj.normal(intersection)))
-    light_direction = Vector3.normalize(Vector3.subtract(light.position, shifted_point))
+    # Every shadow ray goes to one light, picked by its share of the unshadowed lighting
+    if len(lights) == 1:
+        probabilities, cdf = [1.0], [1.0]
+    else:
+        probabilities = __get_light_probabilities(np.array([[Color.to_array(color) for color in lighting]]))[0]
+        probabilities, cdf = probabilities.tolist(), np.cumsum(probabilities).tolist()
 
-    # Soft shadows
-    perp_l = Vector3.cross(light_direction, Vector3(0, 1, 0))
+    shifted_point = Vector3.madd(intersection, 1E-5, normal)
 
-    if perp_l.x == 0.0 and perp_l.y == 0.0 and perp_l.z == 0.0:
-        perp_l.x = 1
+    # The Halton points are shifted by the same random offset for the whole point,
+    # the third dimension that picks the light is only drawn when there is a choice
+    if shifts is None:
+        shifts = np.random.default_rng().random(2 if len(lights) == 1 else 3).tolist()
+    halton = __get_halton_points(shadow_samples).tolist()
 
-    # Get the vector that points in the direction of a light's edge
-    light_edge = Vector3.normalize(
-        Vector3.subtract(
-            Vector3.add(Vector3.scalar_mul(light.radius, perp_l), light.position),
-            intersection
-        )
-    )
+    # The cone towards a light is only set up once a shadow ray goes to it
+    frames = {}
+    visible = [0] * len(lights)
+    count = 0
+
+    # Without adaptive sampling all the shadow rays are cast in a single round
+    round_size = shadow_samples if shadow_probes is None else shadow_probes
+
+    while count < shadow_samples:
+        for u, v, w in halton[count:count + round_size]:
+            index = 0 if len(lights) == 1 else bisect.bisect_right(cdf, (w + shifts[2]) % 1.0 * cdf[-1])
 
-    # Get an angle of a cone from intersection point to a light source
-    cone_angle = math.acos(Vector3.dot(light_direction, light_edge)) * 2.0
+            if index not in frames:
+                frames[index] = __get_shadow_frame(lights[index], intersection, shifted_point)
 
-    # Get the averaged color of all the shadow rays
-    shadow_col = __calculate_soft_shadow(
-        [
-            __find_closest_distance(
-                Ray(shifted_point, __get_random_light_sample(light_direction, cone_angle)),
-                geometry_objects
+            light_direction, tangent, bitangent, cos_angle, light_distance = frames[index]
+            direction = __get_light_sample(
+                light_direction, tangent, bitangent, cos_angle, (u + shifts[0]) % 1.0, (v + shifts[1]) % 1.0
             )
-            for _ in range(shadow_samples)
-        ],
-        light.position,
-        shifted_point
-    )
 
-    # Blend the shadow value with the ray-traced value (e.g. color at objects surface in the intersection)
-    return Color.multiply(color, Color(shadow_col, shadow_col, shadow_col))
+            # Shadow rays only need to know if anything blocks them before they reach the light
+            occluder = is_occluded(Ray(shifted_point, direction), light_distance, geometry_objects, last_occluder)
+
+            if occluder is None:
+                visible[index] += 1
+            else:
+                last_occluder = occluder
+
+            count += 1
+
+        if shadow_probes is not None and __is_shadow_converged(count - sum(visible), count, shadow_tolerance):
+            break
 
+    # Blend the shadow values of the lights with their lighting
+    color, shadow = __combine_lighting(lighting, texture, probabilities, visible, count)
 
-def __calculate_soft_shadow(samples, light_position, origin):
+    return color, obj, shadow, last_occluder
+
+
+def __get_shadow_frame(light, intersection, shifted_point):
     """
-    Calculates the soft shadow value at a surface.
+    Sets up the cone of shadow rays from a surface point towards a light.
 
-    Sends rays from the origin to the light sample and check if they intersect any objects.
-    The shadow values is calculated as a ratio of intersecting rays and non-intersecting rays.
+    :param light: Light
+    :param intersection: Vector3
+    :param shifted_point: Vector3 origin of the shadow rays, moved off the surface along the normal
+    :return: Vector3 light direction, Vector3 tangent, Vector3 bitangent, float cosine of the cone angle,
+             float distance to the light
+    """
+    light_direction = light.direction(shifted_point)
+    cos_angle = light.cone(intersection, light_direction)
 
-    :param samples: array<Vector3>
-    :param light_position: Vector3
-    :param origin: Vector3
-    :return: float
+    # The cone is oriented once for all the shadow rays of the point
+    tangent, bitangent = __get_orthonormal_basis(light_direction)
+
+    return light_direction, tangent, bitangent, cos_angle, light.distance(shifted_point)
+
+
+def __get_light_probabilities(lighting):
+    """
+    Returns the probability of sending a shadow ray to every light, proportional to the sum of the color channels
+    of its unshadowed lighting. Points that no light reaches pick every light with the same probability.
+
+    :param lighting: numpy.ndarray (N, lights, 3)
+    :return: numpy.ndarray (N, lights)
+    """
+    weights = lighting.sum(axis=2)
+    totals = weights.sum(axis=1, keepdims=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(totals > 0, weights / totals, 1.0 / weights.shape[1])
+
+
+def __combine_lighting(lighting, texture, probabilities, visible, count):
+    """
+    Combines the unshadowed lighting of every light with the shadow rays that reached it.
+
+    Every light is weighted with the ratio of all shadow rays that reached it divided by the probability of
+    picking it, which averages to its unoccluded ratio. The texture color is weighted with the ratio of all shadow
+    rays that reached a light, which is the shadow value. Without shadow rays nothing is shadowed.
+
+    :param lighting: array<Color>
+    :param texture: Color
+    :param probabilities: array<float>
+    :param visible: array<int> number of shadow rays that reached every light
+    :param count: int number of shadow rays
+    :return: Color, float shadow value
+    """
+    color = Color.black()
+    shadow = 0.0
+
+    for illumination, probability, reached in zip(lighting, probabilities, visible):
+        share = reached / count if count else probability
+        shadow += share
+
+        if probability > 0:
+            color = Color.madd(color, share / probability, illumination)
+
+    return Color.madd(color, shadow, texture), shadow
+
+
+def __is_shadow_converged(occluded, count, tolerance):
+    """
+    Checks if shadow sampling can stop, either because every shadow ray agreed
+    or because the 95% confidence interval of the unoccluded ratio is within the tolerance.
+
+    :param occluded: int or numpy.ndarray<int>
+    :param count: int or numpy.ndarray<int>
+    :param tolerance: float
+    :return: bool or numpy.ndarray<bool>
     """
-    light_distance = Vector3.magnitude(Vector3.subtract(light_position, origin))
+    ratio = occluded / count
 
-    try:
-        return np.sum(np.where(np.array(samples) < light_distance, 1, 2)) / len(samples) - 1
-    except ZeroDivisionError:
-        return 0
+    return 1.96 * np.sqrt(ratio * (1 - ratio) / count) <= tolerance
 
 
-# Get a random sample within a cone
-def __get_random_light_sample(light_direction, cone_angle):
+def is_occluded(ray, max_distance, geometry_objects, last_occluder=None):
     """
-    Get a random point on the light source, it is assumed that the light source has some radius.
+    Checks if any object blocks the ray before max_distance, stopping at the first blocker that is found.
+
+    The last_occluder, e.g. the object that blocked the previous shadow ray of the same pixel, is tested first.
+
+    :param ray: Ray
+    :param max_distance: float
+    :param geometry_objects: BVH or array<Shape>
+    :param last_occluder: Shape
+    :return: Shape that blocks the ray, or None if the ray is not occluded
+    """
+    if last_occluder is not None and last_occluder.calculate_intersection(ray) < max_distance:
+        return last_occluder
+
+    if isinstance(geometry_objects, BVH):
+        return geometry_objects.find_occluder(ray, max_distance)
+
+    for obj in geometry_objects:
+        if obj.calculate_intersection(ray) < max_distance:
+            return obj
+
+    return None
+
+
+# Get a sample within a cone
+def __get_light_sample(light_direction, tangent, bitangent, cos_angle, u, v):
+    """
+    Get a point on the light source, it is assumed that the light source has some radius.
+
+    The u, v coordinates in [0, 1) are mapped uniformly onto the cone around the light direction.
 
     :param light_direction: Vector3
-    :param cone_angle: float
+    :param tangent: Vector3
+    :param bitangent: Vector3
+    :param cos_angle: float cosine of the cone angle
+    :param u: float
+    :param v: float
     :return: Vector3
     """
-    cos_angle = math.cos(cone_angle)
+    z = u * (1.0 - cos_angle) + cos_angle
+    phi = v * 2.0 * math.pi
+
+    radius = math.sqrt(max(1.0 - z * z, 0.0))
+    x = radius * math.cos(phi)
+    y = radius * math.sin(phi)
+
+    return Vector3(
+        x * tangent.x + y * bitangent.x + z * light_direction.x,
+        x * tangent.y + y * bitangent.y + z * light_direction.y,
+        x * tangent.z + y * bitangent.z + z * light_direction.z
+    )
+
+
+def __get_orthonormal_basis(direction):
+    """
+    Builds two unit vectors that form an orthonormal basis with the unit direction,
+    without branches or trigonometry (Duff et al., "Building an Orthonormal Basis, Revisited").
+
+    :param direction: Vector3
+    :return: Vector3, Vector3
+    """
+    sign = math.copysign(1.0, direction.z)
+    a = -1.0 / (sign + direction.z)
+    b = direction.x * direction.y * a
+
+    tangent = Vector3(1.0 + sign * direction.x * direction.x * a, sign * b, -sign * direction.x)
+    bitangent = Vector3(b, sign + direction.y * direction.y * a, -direction.y)
+
+    return tangent, bitangent
+
+
+@functools.lru_cache(maxsize=None)
+def __get_halton_points(count):
+    """
+    Returns the first points of the 3D Halton sequence with bases 2, 3 and 5.
 
-    z = random.random() * (1.0 - cos_angle) + cos_angle
-    phi = random.random() * 2.0 * math.pi
+    The first two dimensions place the shadow rays in the cone towards a light, the third one picks the light.
 
-    x = math.sqrt(1.0 - z * z) * math.cos(phi)
-    y = math.sqrt(1.0 - z * z) * math.sin(phi)
-    north = Vector3(0, 0, 1)
+    :param count: int
+    :return: numpy.ndarray of shape (count, 3)
+    """
+    points = np.zeros((max(count, 0), 3))
 
-    axis = Vector3.normalize(Vector3.cross(north, Vector3.normalize(light_direction)))
-    angle = math.acos(Vector3.dot(Vector3.normalize(light_direction), north))
+    for axis, base in enumerate((2, 3, 5)):
+        for index in range(count):
+            f = 1.0
+            i = index
 
-    mat = Matrix4X4.rotation_mat(angle, axis)
+            while i > 0:
+                f /= base
+                points[index, axis] += f * (i % base)
+                i //= base
 
-    return Matrix4X4.mul_vector3(mat, Vector3(x, y, z))
+    points.flags.writeable = False
+
+    return points
 
 
 # Find the closest intersection between a ray and an object
@@ -198,9 +1155,12 @@ def __find_closest_intersection(ray, geometry_objects):
     and returns the distance to it from the origin of the ray along with the object itself.
 
     :param ray: Ray
-    :param geometry_objects: array<Shape>
+    :param geometry_objects: BVH or array<Shape>
     :return: float, Shape
     """
+    if isinstance(geometry_objects, BVH):
+        return geometry_objects.closest_intersection(ray)
+
     distances = np.array([obj.calculate_intersection(ray) for obj in geometry_objects])
     min_idx = np.argmin(distances)
 
@@ -210,7 +1170,390 @@ def __find_closest_intersection(ray, geometry_objects):
     return distances[min_idx], geometry_objects[min_idx]
 
 
-def __find_closest_distance(ray, geometry_objects):
-    dist, _ = __find_closest_intersection(ray, geometry_objects)
+def __render_auxiliary(bvh, lights, camera, tile, rows, cols):
+    """
+    Traces the fixed anti-aliasing sub-pixel rays of a tile without shadows and returns the auxiliary channels of
+    its pixels, the pass is the same for every backend and anti-aliasing mode.
+
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param camera: Camera
+    :param tile: numpy.ndarray background radiance of the tile
+    :param rows: slice
+    :param cols: slice
+    :return: numpy.ndarray<float32> (height, width, AUXILIARY_CHANNELS)
+    """
+    height, width = tile.shape[:2]
+    directions = camera.ray_directions("fixed")[rows, cols].reshape((-1, 3))
+    origins = np.broadcast_to(Vector3.to_array(camera.center), directions.shape)
+
+    samples = np.zeros((len(directions), AUXILIARY_CHANNELS))
+    samples[:, AUXILIARY_SLICES["object"]] = -1
+    samples[:, AUXILIARY_SLICES["unshadowed"]] = np.repeat(tile[:, :, :3].reshape((-1, 3)), 4, axis=0)
+
+    for start in range(0, len(directions), RAY_CHUNK_SIZE):
+        end = start + RAY_CHUNK_SIZE
+        hits, lighting, textures, intersections, normals, indices = __shade_surface_numpy(
+            origins[start:end], directions[start:end], camera.center, bvh, lights, camera.pixel_spread
+        )
+        rays = np.flatnonzero(hits) + start
+
+        samples[rays, AUXILIARY_SLICES["normal"]] = normals
+        samples[rays, AUXILIARY_SLICES["depth"]] = np.linalg.norm(intersections - origins[rays], axis=1)[:, None]
+        samples[rays, AUXILIARY_SLICES["object"]] = indices[:, None]
+        samples[rays, AUXILIARY_SLICES["albedo"]] = bvh.geometry.diffuse[indices] + textures
+        samples[rays, AUXILIARY_SLICES["unshadowed"]] = lighting.sum(axis=1) + textures
+
+    return reduce_auxiliary_samples(samples.reshape((height, width, 4, AUXILIARY_CHANNELS)))
+
+
+"""-------------------------------------------NumPy backend----------------------------------------------------------"""
+
+
+def __render_tile_numpy(bvh, lights, camera, settings, tile, rows, cols):
+    """
+    Renders a tile by tracing all of its anti-aliasing sub-pixel rays as (N, 3) arrays.
+
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param camera: Camera
+    :param settings: RenderSettings
+    :param tile: numpy.ndarray
+    :param rows: slice
+    :param cols: slice
+    :return: numpy.ndarray
+    """
+    height, width = tile.shape[:2]
+    directions = camera.ray_directions("fixed")[rows, cols].reshape((-1, 3))
+    keys = sample_keys(rows, cols, camera.width, 4).ravel()
+    origins = np.broadcast_to(Vector3.to_array(camera.center), directions.shape)
+
+    colors = np.empty_like(directions)
+    hits = np.empty(len(directions), dtype=bool)
+
+    for start in range(0, len(directions), RAY_CHUNK_SIZE):
+        end = start + RAY_CHUNK_SIZE
+        colors[start:end], hits[start:end] = __sample_surface_numpy(
+            origins[start:end],
+            directions[start:end],
+            keys[start:end],
+            camera.center,
+            bvh,
+            lights,
+            settings,
+            camera.pixel_spread
+        )
+
+    # Rays that miss every object take the value of the background
+    samples = np.where(hits.reshape((height, width, 4, 1)), colors.reshape((height, width, 4, 3)), tile[:, :, None, :3])
+
+    tile[:, :, :3] = np.sum(samples, axis=2) / 4
+
+    return tile
+
+
+def __sample_surface_numpy(origins, directions, keys, origin, bvh, lights, settings, pixel_spread=0.0):
+    """
+    Vectorized version of __sample_surface, returns the colors of the rays and a mask of rays that hit an object.
+
+    :param origins: numpy.ndarray
+    :param directions: numpy.ndarray
+    :param keys: numpy.ndarray<uint64> sample keys of the rays
+    :param origin: Vector3
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param settings: RenderSettings
+    :param pixel_spread: float
+    :return: numpy.ndarray unclamped colors, numpy.ndarray<bool>
+    """
+    hits, lighting, textures, intersections, normals, _ = __shade_surface_numpy(
+        origins, directions, origin, bvh, lights, pixel_spread
+    )
+    colors = np.zeros(directions.shape)
+
+    if not hits.any():
+        return colors, hits
+
+    probabilities = __get_light_probabilities(lighting)
+    visible, counts = __estimate_soft_shadow_numpy(
+        intersections, normals, probabilities, bvh, lights, settings, keys[hits]
+    )
+    surface_colors, _ = __combine_lighting_numpy(lighting, textures, probabilities, visible, counts)
+    colors[hits] = surface_colors
+
+    return colors, hits
+
+
+def __shade_surface_numpy(origins, directions, origin, bvh, lights, pixel_spread=0.0):
+    """
+    Finds the closest intersections of the rays and shades them without shadows.
+
+    :param origins: numpy.ndarray
+    :param directions: numpy.ndarray
+    :param origin: Vector3
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param pixel_spread: float
+    :return: numpy.ndarray<bool> mask of the rays that hit an object, followed by the unclamped lighting of every
+             light, texture colors, intersections, normals and indices into bvh.objects of the objects hit by the
+             rays that hit
+    """
+    distances, indices = bvh.closest_intersection_batch(origins, directions)
+    hits = indices >= 0
+
+    intersections = origins[hits] + distances[hits, None] * directions[hits]
+    hit_indices = indices[hits]
+    footprints = distances[hits] * pixel_spread / 2
+
+    lighting = np.empty((len(intersections), len(lights), 3))
+    textures = np.empty_like(intersections)
+    normals = np.empty_like(intersections)
+
+    # Shade the intersections of every object in one batch
+    for k, obj in enumerate(bvh.objects):
+        mask = hit_indices == k
+
+        if mask.any():
+            lighting[mask], textures[mask], normals[mask] = obj.shade_batch(
+                lights, origin, intersections[mask], footprints[mask]
+            )
+
+    return hits, lighting, textures, intersections, normals, hit_indices
+
+
+def __combine_lighting_numpy(lighting, textures, probabilities, visible, counts):
+    """
+    Vectorized version of __combine_lighting, the arrays can have any number of leading dimensions.
+
+    :param lighting: numpy.ndarray (..., lights, 3)
+    :param textures: numpy.ndarray (..., 3)
+    :param probabilities: numpy.ndarray (..., lights)
+    :param visible: numpy.ndarray (..., lights) number of shadow rays that reached every light
+    :param counts: numpy.ndarray (...) number of shadow rays
+    :return: numpy.ndarray (..., 3) colors, numpy.ndarray (...) shadow values
+    """
+    counts = np.asarray(counts)[..., None]
+    shares = np.where(counts > 0, visible / np.maximum(counts, 1), probabilities)
+    weights = np.divide(shares, probabilities, out=np.zeros_like(shares), where=probabilities > 0)
+    shadow = shares.sum(axis=-1)
+
+    return np.einsum('...l,...lc->...c', weights, lighting) + textures * shadow[..., None], shadow
+
+
+def __estimate_soft_shadow_numpy(intersections, normals, probabilities, bvh, lights, settings, keys):
+    """
+    Casts the shadow rays of the points with the sampling mode of the settings.
+
+    :param intersections: numpy.ndarray
+    :param normals: numpy.ndarray
+    :param probabilities: numpy.ndarray (N, lights) probabilities of sending a shadow ray to every light
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param settings: RenderSettings
+    :param keys: numpy.ndarray<uint64> sample keys of the points
+    :return: numpy.ndarray (N, lights) number of shadow rays that reached every light,
+             numpy.ndarray<int> number of shadow rays cast from every point
+    """
+    shifts = __get_shadow_shifts_numpy(settings.seed, keys, lights)
+
+    if settings.shadow_probes is None:
+        visible = __calculate_soft_shadow_numpy(
+            intersections, normals, probabilities, bvh, lights, settings.shadow_samples, shifts
+        )
+        return visible, np.full(len(intersections), max(settings.shadow_samples, 0))
+
+    return __calculate_adaptive_soft_shadow_numpy(
+        intersections,
+        normals,
+        probabilities,
+        bvh,
+        lights,
+        settings.shadow_samples,
+        settings.shadow_probes,
+        settings.shadow_tolerance,
+        shifts
+    )
+
+
+def __calculate_soft_shadow_numpy(intersections, normals, probabilities, bvh, lights, shadow_samples, shifts):
+    """
+    Vectorized version of the soft shadow estimation, returns how many shadow rays reach every light.
+
+    :param intersections: numpy.ndarray
+    :param normals: numpy.ndarray
+    :param probabilities: numpy.ndarray (N, lights)
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param shadow_samples: int
+    :param shifts: numpy.ndarray random shifts of the Halton points of every point, see __get_shadow_shifts_numpy
+    :return: numpy.ndarray (N, lights)
+    """
+    if shadow_samples <= 0:
+        return np.zeros((len(intersections), len(lights)))
+
+    return __cast_shadow_rays_numpy(
+        intersections, normals, np.cumsum(probabilities, axis=1), shifts, lights, bvh, 0, shadow_samples
+    )
+
+
+def __calculate_adaptive_soft_shadow_numpy(
+        intersections,
+        normals,
+        probabilities,
+        bvh,
+        lights,
+        max_samples,
+        probes,
+        tolerance,
+        shifts
+):
+    """
+    Vectorized version of the adaptive soft shadow estimation in __sample_surface.
+
+    Every point casts a round of probe rays, only the points that have not converged cast the next round.
+
+    :param intersections: numpy.ndarray
+    :param normals: numpy.ndarray
+    :param probabilities: numpy.ndarray (N, lights)
+    :param bvh: BVH
+    :param lights: array<Light>
+    :param max_samples: int
+    :param probes: int
+    :param tolerance: float
+    :param shifts: numpy.ndarray random shifts of the Halton points of every point
+    :return: numpy.ndarray (N, lights), numpy.ndarray<int> number of shadow rays cast from every point
+    """
+    visible = np.zeros((len(intersections), len(lights)))
+    counts = np.zeros(len(intersections), dtype=np.int64)
+
+    if max_samples <= 0:
+        return visible, counts
+
+    cdfs = np.cumsum(probabilities, axis=1)
+    active = np.arange(len(intersections))
+
+    # The active points were sampled in the same rounds so they all have the same count
+    while len(active):
+        first = counts[active[0]]
+        samples = min(probes, max_samples - first)
+
+        visible[active] += __cast_shadow_rays_numpy(
+            intersections[active], normals[active], cdfs[active], shifts[active], lights, bvh, first, samples
+        )
+        counts[active] += samples
+
+        occluded = counts[active] - visible[active].sum(axis=1)
+        converged = __is_shadow_converged(occluded, counts[active], tolerance)
+        active = active[~converged & (counts[active] < max_samples)]
+
+    return visible, counts
+
+
+def __get_shadow_shifts_numpy(seed, keys, lights):
+    """
+    Returns the random shifts of the Halton points of the samples with the given keys, the same for both backends.
+
+    :param seed: int
+    :param keys: numpy.ndarray<uint64>
+    :param lights: array<Light>
+    :return: numpy.ndarray (*keys.shape, 2) with a single light, (*keys.shape, 3) otherwise
+    """
+    return sample_uniform(seed, keys, 2 if len(lights) == 1 else 3)
+
+
+def __get_shadow_frames_numpy(intersections, normals, light):
+    """
+    Vectorized version of __get_shadow_frame.
+
+    Returns the shifted ray origins, the light directions with the tangents and bitangents that complete their
+    orthonormal bases, the cosines of the cone angles and the distances to the light.
+
+    :param intersections: numpy.ndarray
+    :param normals: numpy.ndarray
+    :param light: Light
+    :return: tuple<numpy.ndarray>
+    """
+    shifted_points = intersections + 1E-5 * normals
+    light_direction = np.array(light.direction_batch(shifted_points))
+    cos_angle = light.cone_batch(intersections, light_direction)
+
+    # Same basis as __get_orthonormal_basis
+    x, y, z = light_direction[:, 0], light_direction[:, 1], light_direction[:, 2]
+    sign = np.copysign(1.0, z)
+    a = -1.0 / (sign + z)
+    b = x * y * a
+
+    tangents = np.stack([1.0 + sign * x * x * a, sign * b, -sign * x], axis=-1)
+    bitangents = np.stack([b, sign + y * y * a, -y], axis=-1)
+
+    return shifted_points, light_direction, tangents, bitangents, cos_angle, light.distance_batch(shifted_points)
+
+
+def __cast_shadow_rays_numpy(intersections, normals, cdfs, shifts, lights, bvh, first, shadow_samples):
+    """
+    Casts the shadow rays of the Halton points first to first + shadow_samples from every point
+    and returns how many of them reach every light.
+
+    Every ray goes to the light that the third Halton dimension picks from the cumulative probabilities,
+    the rays are then cast in one batch per light.
+
+    :param intersections: numpy.ndarray
+    :param normals: numpy.ndarray
+    :param cdfs: numpy.ndarray (N, lights) cumulative probabilities of the lights
+    :param shifts: numpy.ndarray
+    :param lights: array<Light>
+    :param bvh: BVH
+    :param first: int
+    :param shadow_samples: int
+    :return: numpy.ndarray (N, lights)
+    """
+    halton = __get_halton_points(first + shadow_samples)[first:]
+    u = ((halton[:, 0] + shifts[:, :1]) % 1.0).ravel()
+    v = ((halton[:, 1] + shifts[:, 1:2]) % 1.0).ravel()
+    points = np.repeat(np.arange(len(intersections)), shadow_samples)
+
+    if len(lights) == 1:
+        chosen = np.zeros(len(points), dtype=np.int64)
+    else:
+        # Same search as the bisection in __sample_surface
+        w = (halton[:, 2] + shifts[:, 2:]) % 1.0 * cdfs[:, -1:]
+        chosen = np.sum(w[:, :, None] >= cdfs[:, None, :], axis=2).ravel()
+
+    # The rays are grouped by light, within a light they stay ordered by point
+    order = np.argsort(chosen, kind='stable')
+    bounds = np.searchsorted(chosen[order], np.arange(len(lights) + 1))
+    reached = np.zeros(len(points), dtype=bool)
+
+    for k, light in enumerate(lights):
+        rays = order[bounds[k]:bounds[k + 1]]
+
+        if not len(rays):
+            continue
+
+        # The cone towards the light is set up once for every point that casts a ray to it
+        starts = np.empty(len(rays), dtype=bool)
+        starts[0] = True
+        np.not_equal(points[rays[1:]], points[rays[:-1]], out=starts[1:])
+        frame = np.cumsum(starts) - 1
+
+        owners = points[rays[starts]]
+        shifted_points, light_direction, tangents, bitangents, cos_angle, light_distance = (
+            values[frame] for values in __get_shadow_frames_numpy(intersections[owners], normals[owners], light)
+        )
+
+        # Vectorized version of __get_light_sample for every ray
+        z = u[rays] * (1.0 - cos_angle) + cos_angle
+        phi = v[rays] * 2.0 * math.pi
+        radius = np.sqrt(np.maximum(1.0 - z * z, 0))
+
+        sample_directions = (
+            (radius * np.cos(phi))[:, None] * tangents +
+            (radius * np.sin(phi))[:, None] * bitangents +
+            z[:, None] * light_direction
+        )
+
+        reached[rays] = ~bvh.occluded_batch(shifted_points, sample_directions, light_distance)
 
-    return dist
+    return np.bincount(
+        points * len(lights) + chosen, weights=reached, minlength=len(intersections) * len(lights)
+    ).reshape((-1, len(lights)))
@@ -0,0 +1,72 @@
+import secrets
+
+import numpy as np
+
+# Bits of a sample key that number the samples of a pixel, the bits above them hold the index of the pixel
+SAMPLE_INDEX_BITS = 20
+
+# Odd constants of the splitmix64 generator, the random numbers of a sample are a hash of its key
+__GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+__MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+__MIX_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+
+"""-------------------------------------------Sample streams---------------------------------------------------------"""
+
+
+def resolve_seed(seed):
+    """
+    :param seed: int, None draws a new seed
+    :return: int in the range of a 64 bit unsigned integer
+    """
+    return secrets.randbits(64) if seed is None else seed % (1 << 64)
+
+
+def sample_keys(rows, cols, width, samples, first=0):
+    """
+    Numbers the samples of the pixels of a tile, the key of a sample only depends on its pixel and its index
+    within the pixel, so it is the same whichever tile or worker traces it.
+
+    :param rows: slice
+    :param cols: slice
+    :param width: int width of the image
+    :param samples: int number of samples of every pixel
+    :param first: int index of the first sample
+    :return: numpy.ndarray<uint64> (rows, cols, samples)
+    """
+    pixels = np.arange(rows.start, rows.stop, dtype=np.uint64)[:, None] * np.uint64(width)
+    pixels = pixels + np.arange(cols.start, cols.stop, dtype=np.uint64)
+    indices = np.arange(first, first + samples, dtype=np.uint64)
+
+    return (pixels[:, :, None] << np.uint64(SAMPLE_INDEX_BITS)) | indices
+
+
+def sample_uniform(seed, keys, dimensions):
+    """
+    Returns uniform random numbers in [0, 1) for the samples with the given keys, computed as a hash of the seed,
+    the key and the dimension instead of being drawn from a stream, so they do not depend on the order the samples
+    are traced in.
+
+    :param seed: int
+    :param keys: numpy.ndarray<uint64>
+    :param dimensions: int number of random numbers of every sample
+    :return: numpy.ndarray<float64> (*keys.shape, dimensions)
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    state = __mix(keys ^ __mix(np.full(keys.shape, seed, dtype=np.uint64)))
+    dimension_offsets = np.arange(1, dimensions + 1, dtype=np.uint64) * __GOLDEN_GAMMA
+
+    # The 53 high bits of the hash make a double in [0, 1)
+    return (__mix(state[..., None] + dimension_offsets) >> np.uint64(11)) * 2.0 ** -53
+
+
+def __mix(values):
+    """
+    Finalizer of splitmix64, the arithmetic wraps around like the unsigned 64 bit integers of the reference.
+
+    :param values: numpy.ndarray<uint64>
+    :return: numpy.ndarray<uint64>
+    """
+    values = (values ^ (values >> __MIX_SHIFTS[0])) * __MIX_MULTIPLIERS[0]
+    values = (values ^ (values >> __MIX_SHIFTS[1])) * __MIX_MULTIPLIERS[1]
+
+    return values ^ (values >> __MIX_SHIFTS[2])
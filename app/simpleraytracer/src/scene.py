@@ -0,0 +1,393 @@
+import inspect
+import json
+import os
+import pickle
+
+from .mesh import *
+from .objects import *
+
+# Written at the start of binary scene files, followed by the pickled Scene
+SCENE_MAGIC = b'SRTSCENE'
+SCENE_VERSION = 1
+
+"""-------------------------------------------Scene------------------------------------------------------------------"""
+
+
+class SceneError(ValueError):
+    """
+    Raised when a scene description is invalid, the message starts with the location of the invalid value.
+    """
+
+
+class Scene:
+    """
+    Everything render needs to draw a frame, along with the render options stored in the scene description.
+    """
+
+    def __init__(self, objects, light, camera, options=None):
+        """
+        :param objects: array<Shape>
+        :param light: Light or array<Light>
+        :param camera: Camera
+        :param options: dict keyword arguments of render
+        """
+        self.objects = objects
+        self.light = light
+        self.camera = camera
+        self.options = options or {}
+
+    def render(self, **options):
+        """
+        Renders the scene with its options, overridden by the given keyword arguments of render.
+
+        :return: numpy.ndarray
+        """
+        from .raytracer import render  # The raytracer imports this module
+
+        return render(self.objects, self.light, self.camera, **{**self.options, **options})
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a scene from a JSON or TOML description, or from a binary file written by Scene.save.
+
+        Texture paths are relative to the scene file, textures are only loaded when the scene is rendered.
+
+        :param path: str
+        :return: Scene
+        """
+        extension = os.path.splitext(path)[1].lower()
+
+        if extension == '.json':
+            with open(path) as file:
+                data = json.load(file)
+        elif extension == '.toml':
+            try:
+                import tomllib  # Only in the standard library since Python 3.11
+            except ImportError:
+                raise SceneError(f'{path}: TOML scenes need Python 3.11 or newer') from None
+
+            with open(path, 'rb') as file:
+                data = tomllib.load(file)
+        else:
+            return Scene.load_binary(path)
+
+        return Scene.parse(data, os.path.dirname(os.path.abspath(path)))
+
+    @staticmethod
+    def parse(data, base_path='.', confine_paths=False):
+        """
+        Builds a scene from a parsed description.
+
+        :param data: dict
+        :param base_path: str directory that relative texture and background paths start from
+        :param confine_paths: bool, True rejects paths that lead outside of base_path, e.g. for untrusted descriptions
+        :return: Scene
+        """
+        reader = _SceneReader(base_path, confine_paths)
+        data = reader.table(
+            data, 'scene', required=('camera', 'objects'), optional=('light', 'lights', 'materials', 'render')
+        )
+
+        materials = {
+            name: reader.material(material, f'materials.{name}')
+            for name, material in reader.table(data.get('materials', {}), 'materials').items()
+        }
+
+        objects = data['objects']
+
+        if not isinstance(objects, list):
+            raise SceneError(f'objects: expected a list, got {type(objects).__name__}')
+
+        return Scene(
+            [reader.shape(obj, f'objects[{i}]', materials) for i, obj in enumerate(objects)],
+            reader.lights(data),
+            reader.camera(data['camera'], 'camera'),
+            reader.render_options(data.get('render', {}), 'render')
+        )
+
+    def save(self, path):
+        """
+        Writes the scene to a compact binary file that Scene.load_binary reads back without parsing or validating.
+
+        Textures that were not loaded yet are stored by their path, loaded ones are stored with their pixels.
+
+        :param path: str
+        """
+        with open(path, 'wb') as file:
+            file.write(SCENE_MAGIC + SCENE_VERSION.to_bytes(2, 'little'))
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load_binary(path):
+        """
+        :param path: str
+        :return: Scene
+        """
+        with open(path, 'rb') as file:
+            header = file.read(len(SCENE_MAGIC) + 2)
+
+            if header[:len(SCENE_MAGIC)] != SCENE_MAGIC:
+                raise SceneError(f'{path}: not a scene file')
+
+            version = int.from_bytes(header[len(SCENE_MAGIC):], 'little')
+
+            if version != SCENE_VERSION:
+                raise SceneError(f'{path}: unsupported scene file version {version}, expected {SCENE_VERSION}')
+
+            return pickle.load(file)
+
+
+class _SceneReader:
+    """
+    Validates the parts of a scene description and turns them into objects.
+    """
+
+    def __init__(self, base_path, confine_paths=False):
+        self.base_path = base_path
+        self.confine_paths = confine_paths
+
+    @staticmethod
+    def table(value, where, required=(), optional=None):
+        """
+        Checks that a value is a table with the required keys, and no other keys than the optional ones if given.
+
+        :param value: object
+        :param where: str
+        :param required: array<str>
+        :param optional: array<str>, None allows any key
+        :return: dict
+        """
+        if not isinstance(value, dict):
+            raise SceneError(f'{where}: expected a table, got {type(value).__name__}')
+
+        for key in required:
+            if key not in value:
+                raise SceneError(f'{where}: missing "{key}"')
+
+        if optional is not None:
+            for key in value:
+                if key not in required and key not in optional:
+                    raise SceneError(f'{where}: unknown key "{key}"')
+
+        return value
+
+    @staticmethod
+    def number(value, where, minimum=None):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise SceneError(f'{where}: expected a number, got {value!r}')
+
+        if minimum is not None and value < minimum:
+            raise SceneError(f'{where}: expected at least {minimum}, got {value}')
+
+        return value
+
+    @staticmethod
+    def integer(value, where, minimum=None):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise SceneError(f'{where}: expected an integer, got {value!r}')
+
+        return _SceneReader.number(value, where, minimum)
+
+    @staticmethod
+    def boolean(value, where):
+        if not isinstance(value, bool):
+            raise SceneError(f'{where}: expected true or false, got {value!r}')
+
+        return value
+
+    @staticmethod
+    def choice(value, where, choices):
+        if value not in choices:
+            raise SceneError(f'{where}: expected one of {", ".join(choices)}, got {value!r}')
+
+        return value
+
+    @staticmethod
+    def triple(value, where):
+        if not isinstance(value, list) or len(value) != 3:
+            raise SceneError(f'{where}: expected a list of 3 numbers, got {value!r}')
+
+        return [_SceneReader.number(v, f'{where}[{i}]') for i, v in enumerate(value)]
+
+    def vector(self, value, where):
+        return Vector3(*self.triple(value, where))
+
+    def color(self, value, where):
+        return Color(*self.triple(value, where))
+
+    def path(self, value, where):
+        if not isinstance(value, str):
+            raise SceneError(f'{where}: expected a path, got {value!r}')
+
+        path = os.path.join(self.base_path, value)
+
+        if self.confine_paths:
+            base = os.path.realpath(self.base_path)
+
+            if os.path.commonpath([base, os.path.realpath(path)]) != base:
+                raise SceneError(f'{where}: {value!r} is outside of {self.base_path}')
+
+        return path
+
+    def render_options(self, value, where):
+        """
+        Checks the render options of a scene against the parameters of render. Options that take Python objects,
+        e.g. progress or stats, cannot be set by a scene description.
+
+        :param value: object
+        :param where: str
+        :return: dict keyword arguments of render
+        """
+        from .raytracer import TONE_MAPPINGS, render  # The raytracer imports this module
+
+        readers = {
+            'background_image': self.path,
+            'shadow_samples': lambda v, w: self.integer(v, w, 0),
+            'backend': lambda v, w: self.choice(v, w, ('python', 'numpy')),
+            'workers': lambda v, w: self.integer(v, w, 1),
+            'tile_size': lambda v, w: self.integer(v, w, 0),
+            'antialiasing': lambda v, w: self.choice(v, w, ('fixed', 'adaptive')),
+            'adaptive_threshold': lambda v, w: self.number(v, w, 0),
+            'max_subsamples': lambda v, w: self.integer(v, w, 1),
+            'shadow_sampling': lambda v, w: self.choice(v, w, ('fixed', 'adaptive')),
+            'shadow_probes': lambda v, w: self.integer(v, w, 1),
+            'shadow_tolerance': lambda v, w: self.number(v, w, 0),
+            'seed': self.integer,
+            'dtype': lambda v, w: self.choice(v, w, ('uint8', 'uint16', 'float32', 'float64')),
+            'tone_mapping': lambda v, w: self.choice(v, w, TONE_MAPPINGS),
+            'exposure': lambda v, w: self.number(v, w, 0),
+            'gamma': lambda v, w: self.number(v, w, 0),
+            'denoise': self.boolean
+        }
+        parameters = list(inspect.signature(render).parameters)[3:]
+        options = {}
+
+        for key, option in self.table(value, where).items():
+            if key not in parameters:
+                raise SceneError(f'{where}: unknown key "{key}"')
+
+            if key not in readers:
+                raise SceneError(f'{where}.{key}: cannot be set in a scene description')
+
+            options[key] = readers[key](option, f'{where}.{key}')
+
+        return options
+
+    def camera(self, value, where):
+        value = self.table(value, where, required=('position', 'width', 'height'), optional=('rotation', 'fov'))
+
+        return Camera(
+            self.vector(value['position'], f'{where}.position'),
+            self.vector(value.get('rotation', [0, 0, 0]), f'{where}.rotation'),
+            self.integer(value['width'], f'{where}.width', 1),
+            self.integer(value['height'], f'{where}.height', 1),
+            self.number(value.get('fov', 1), f'{where}.fov', 0)
+        )
+
+    def light(self, value, where):
+        # The keys that a light accepts depend on its type
+        options = {'point': ('radius', 'range'), 'directional': ('angle',)}
+        kind = self.table(value, where, required=('type',))['type']
+
+        if kind not in options:
+            raise SceneError(f'{where}.type: unknown light type "{kind}", expected "point" or "directional"')
+
+        value = self.table(
+            value,
+            where,
+            required=('type', 'position'),
+            optional=('rotation', 'ambient', 'diffuse', 'specular') + options[kind]
+        )
+        arguments = (
+            self.vector(value['position'], f'{where}.position'),
+            self.vector(value.get('rotation', [0, 0, 0]), f'{where}.rotation')
+        )
+        colors = (
+            self.color(value.get('ambient', [1, 1, 1]), f'{where}.ambient'),
+            self.color(value.get('diffuse', [1, 1, 1]), f'{where}.diffuse'),
+            self.color(value.get('specular', [1, 1, 1]), f'{where}.specular')
+        )
+
+        if value['type'] == 'directional':
+            return DirectionalLight(*arguments, *colors, self.number(value.get('angle', 0), f'{where}.angle', 0))
+
+        light_range = value.get('range')
+
+        return PointLight(
+            *arguments,
+            self.number(value.get('radius', 1), f'{where}.radius', 0),
+            *colors,
+            None if light_range is None else self.number(light_range, f'{where}.range', 0)
+        )
+
+    def lights(self, data):
+        if ('light' in data) == ('lights' in data):
+            raise SceneError('scene: expected either "light" or "lights"')
+
+        if 'light' in data:
+            return self.light(data['light'], 'light')
+
+        lights = data['lights']
+
+        if not isinstance(lights, list) or not lights:
+            raise SceneError(f'lights: expected a non-empty list, got {lights!r}')
+
+        return [self.light(light, f'lights[{i}]') for i, light in enumerate(lights)]
+
+    def material(self, value, where):
+        value = self.table(value, where, optional=('ambient', 'diffuse', 'specular', 'shininess', 'texture'))
+        texture = value.get('texture')
+
+        if texture is not None:
+            # Only the path is resolved here, the texture is loaded when it is first sampled
+            texture = self.path(texture, f'{where}.texture')
+
+        return Material(
+            self.color(value.get('ambient', [1, 1, 1]), f'{where}.ambient'),
+            self.color(value.get('diffuse', [1, 1, 1]), f'{where}.diffuse'),
+            self.color(value.get('specular', [1, 1, 1]), f'{where}.specular'),
+            self.number(value.get('shininess', 100), f'{where}.shininess', 0),
+            texture
+        )
+
+    def shape(self, value, where, materials):
+        value = self.table(value, where, required=('type', 'position'))
+        shape_type = value['type']
+
+        if shape_type == 'sphere':
+            value = self.table(value, where, optional=('type', 'position', 'rotation', 'radius', 'material'))
+        elif shape_type == 'plane':
+            value = self.table(value, where, optional=('type', 'position', 'rotation', 'material'))
+        elif shape_type == 'mesh':
+            value = self.table(value, where, required=('path',), optional=('type', 'position', 'rotation', 'material'))
+        else:
+            raise SceneError(
+                f'{where}.type: unknown shape type "{shape_type}", expected "sphere", "plane" or "mesh"'
+            )
+
+        material = value.get('material', {})
+
+        if isinstance(material, str):
+            if material not in materials:
+                raise SceneError(f'{where}.material: unknown material "{material}"')
+
+            material = materials[material]
+        else:
+            material = self.material(material, f'{where}.material')
+
+        position = self.vector(value['position'], f'{where}.position')
+        rotation = self.vector(value.get('rotation', [0, 0, 0]), f'{where}.rotation')
+
+        if shape_type == 'sphere':
+            return Sphere(position, rotation, self.number(value.get('radius', 1), f'{where}.radius', 0), material)
+
+        if shape_type == 'mesh':
+            path = self.path(value['path'], f'{where}.path')
+
+            try:
+                return TriangleMesh.load_obj(path, position, rotation, material)
+            except (OSError, ValueError) as error:
+                raise SceneError(f'{where}.path: {error}') from None
+
+        return Plane(position, rotation, material)
@@ -0,0 +1,684 @@
+import asyncio
+import functools
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import numpy as np
+
+from .scene import *
+
+# Render options that change how an image is computed but not its pixels, they are left out of the cache keys
+UNCACHED_OPTIONS = ("workers", "output", "stats", "progress")
+
+# Largest request body the server reads, scene descriptions reference their textures and meshes by path
+MAX_REQUEST_BYTES = 1 << 24
+
+# Render options that clients may set, with the largest value of the ones that make a render slower, or None.
+# The types of the values are checked by Scene.parse, any other render option is refused.
+CLIENT_RENDER_OPTIONS = {
+    "shadow_samples": 256,
+    "backend": None,
+    "tile_size": None,
+    "antialiasing": None,
+    "adaptive_threshold": None,
+    "max_subsamples": 16,
+    "shadow_sampling": None,
+    "shadow_probes": 64,
+    "shadow_tolerance": None,
+    "seed": None,
+    "dtype": None,
+    "tone_mapping": None,
+    "exposure": None,
+    "gamma": None,
+    "denoise": None
+}
+
+# Largest frame that clients may render, in pixels
+MAX_CLIENT_PIXELS = 3840 * 2160
+
+"""-------------------------------------------Cache------------------------------------------------------------------"""
+
+
+def scene_key(data, base_path='.'):
+    """
+    Returns the content address of the image that a scene description renders to: the SHA-256 of the description
+    in canonical JSON form, which holds the objects, lights, camera, resolution and sampling settings. The files that
+    the description names, e.g. textures and meshes, are fingerprinted by their size and modification time, so the
+    key changes when one of them is edited.
+
+    :param data: dict scene description, as read by Scene.parse
+    :param base_path: str directory that relative paths start from
+    :return: str hexadecimal digest
+    """
+    data = dict(data)
+    data['render'] = {
+        name: value for name, value in data.get('render', {}).items() if name not in UNCACHED_OPTIONS
+    }
+
+    files = {}
+    __collect_files(data, base_path, files)
+
+    content = json.dumps([data, files], sort_keys=True, separators=(',', ':'), default=str)
+
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def __collect_files(value, base_path, files):
+    if isinstance(value, dict):
+        for item in value.values():
+            __collect_files(item, base_path, files)
+    elif isinstance(value, list):
+        for item in value:
+            __collect_files(item, base_path, files)
+    elif isinstance(value, str) and value not in files:
+        path = os.path.join(base_path, value)
+
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files[value] = (stat.st_size, stat.st_mtime_ns)
+
+
+class ResultCache:
+    """
+    Rendered images on disk, stored as .npy files named by their key.
+
+    Reading an image marks it as used, when the images take more than max_bytes the least recently used ones are
+    removed. The cache is safe to use from several threads, and its files are replaced atomically, so a cache
+    directory survives restarts of the server.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        """
+        :param directory: str, created when missing
+        :param max_bytes: int
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        """
+        :param key: str
+        :return: str
+        """
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def get(self, key):
+        """
+        :param key: str
+        :return: numpy.ndarray, None when the image is not cached
+        """
+        with self.__lock:
+            try:
+                # The modification time is the time of the last use
+                os.utime(self.path(key))
+            except FileNotFoundError:
+                return None
+
+            return np.load(self.path(key))
+
+    def put(self, key, image):
+        """
+        Stores an image and evicts the least recently used images that no longer fit.
+
+        :param key: str
+        :param image: numpy.ndarray
+        """
+        with self.__lock:
+            descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+
+            try:
+                with os.fdopen(descriptor, 'wb') as file:
+                    np.save(file, np.asarray(image))
+
+                os.replace(temporary, self.path(key))
+            except BaseException:
+                os.unlink(temporary)
+                raise
+
+            self.__evict(keep=self.path(key))
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def __evict(self, keep):
+        entries = []
+
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.npy') and entry.path != keep:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        used = os.path.getsize(keep) + sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if used <= self.max_bytes:
+                break
+
+            os.unlink(path)
+            used -= size
+
+
+"""-------------------------------------------Jobs-------------------------------------------------------------------"""
+
+
+class RenderCancelled(Exception):
+    """
+    Raised inside a render to stop it when its job is cancelled.
+    """
+
+
+class RenderJob:
+    """
+    A scene waiting for, going through or done with its render. The state is "queued", "running", "done",
+    "cancelled" or "failed", the last three do not change anymore.
+
+    Every change of the job is recorded as an event, a dict with an "event" name of "queued", "started", "tile",
+    "done", "cancelled" or "failed". The events are kept, so watchers that come late still see all of them.
+    """
+
+    def __init__(self, job_id, key, scene, priority):
+        """
+        :param job_id: str
+        :param key: str cache key of the image
+        :param scene: Scene
+        :param priority: int, higher priorities are rendered first
+        """
+        self.id = job_id
+        self.key = key
+        self.scene = scene
+        self.priority = priority
+        self.state = "queued"
+        self.error = None
+        self.cached = False
+        self.tiles = (0, None)
+        self.events = []
+        self.cancel_requested = False
+        self.__updated = asyncio.Event()
+
+    def status(self):
+        """
+        :return: dict that can be written as JSON
+        """
+        return {
+            "id": self.id,
+            "key": self.key,
+            "state": self.state,
+            "priority": self.priority,
+            "cached": self.cached,
+            "tiles": list(self.tiles),
+            "error": self.error
+        }
+
+    def publish(self, event, **values):
+        """
+        Records an event and wakes up the watchers, it has to be called from the thread of the event loop.
+
+        :param event: str
+        """
+        self.events.append({"event": event, "id": self.id, **values})
+        self.__updated.set()
+        self.__updated = asyncio.Event()
+
+    async def watch(self):
+        """
+        Yields the events of the job as they happen, starting with the first one, until the job is finished.
+
+        :return: async iterator<dict>
+        """
+        index = 0
+
+        while True:
+            while index < len(self.events):
+                event = self.events[index]
+                index += 1
+                yield event
+
+                if event["event"] in ("done", "cancelled", "failed"):
+                    return
+
+            await self.__updated.wait()
+
+    async def wait(self):
+        """
+        Waits until the job is finished.
+
+        :return: str final state
+        """
+        async for _ in self.watch():
+            pass
+
+        return self.state
+
+
+"""-------------------------------------------Server-----------------------------------------------------------------"""
+
+
+class RenderServer:
+    """
+    Renders scene descriptions in the background, in the order of their priority.
+
+    Jobs wait in a priority queue, equal priorities are served first come first served. Up to concurrency jobs render
+    at the same time, each one on its own pool of workers processes. Finished images are stored in a ResultCache by
+    the content address of their scene, so a scene that was rendered before is answered from the cache without
+    queueing, and identical scenes submitted while one is pending share its job.
+
+    The server is driven by asyncio: start it inside a running event loop, then submit jobs directly or serve them
+    over HTTP with serve.
+    """
+
+    def __init__(self, cache, workers=None, concurrency=1, base_path='.'):
+        """
+        :param cache: ResultCache or str directory of one
+        :param workers: int worker processes per render, None uses all CPU cores
+        :param concurrency: int jobs rendered at the same time
+        :param base_path: str directory that relative paths in scene descriptions start from
+        """
+        self.cache = cache if isinstance(cache, ResultCache) else ResultCache(cache)
+        self.workers = workers
+        self.concurrency = concurrency
+        self.base_path = base_path
+        self.jobs = {}
+        self.__pending = {}
+        # Keys of the scenes that passed the checks of untrusted descriptions
+        self.__client_keys = set()
+        self.__ids = itertools.count(1)
+        self.__order = itertools.count()
+        self.__queue = None
+        self.__tasks = []
+        self.__executor = None
+
+    async def start(self):
+        """
+        Starts rendering the queued jobs.
+        """
+        self.__queue = asyncio.PriorityQueue()
+        self.__executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='render')
+        self.__tasks = [asyncio.create_task(self.__run()) for _ in range(self.concurrency)]
+
+        for job in self.jobs.values():
+            if job.state == "queued":
+                self.__enqueue(job)
+
+    async def stop(self):
+        """
+        Cancels every unfinished job and waits for the renders in progress to stop.
+        """
+        for job in list(self.jobs.values()):
+            self.cancel(job.id)
+
+        for task in self.__tasks:
+            task.cancel()
+
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+
+        if self.__executor is not None:
+            await asyncio.to_thread(self.__executor.shutdown)
+            self.__executor = None
+            self.__queue = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def submit(self, data, priority=0, untrusted=False):
+        """
+        Queues the render of a scene description, unless its image is cached or the same scene is already pending.
+
+        Untrusted descriptions, e.g. the ones of HTTP clients, may only set the CLIENT_RENDER_OPTIONS within their
+        limits, may not render more than MAX_CLIENT_PIXELS and may only name files inside base_path. Their cached
+        images and pending jobs are only shared once the same scene was checked as an untrusted description.
+
+        :param data: dict scene description, as read by Scene.parse
+        :param priority: int, higher priorities are rendered first
+        :param untrusted: bool
+        :return: RenderJob
+        :raise SceneError: if the description is invalid or untrusted and not allowed
+        """
+        key = self.__find_key(data, untrusted)
+        job = self.__find_job(key, priority, untrusted)
+
+        if job is None:
+            job = self.__add_job(key, self.__parse(data, untrusted), priority, untrusted)
+
+        return job
+
+    async def submit_async(self, data, priority=0, untrusted=False):
+        """
+        Like submit, but loads the scene on a thread, so meshes that take long to load and index do not stall the
+        event loop. Cached images and pending jobs are found before the scene is loaded.
+
+        :param data: dict scene description, as read by Scene.parse
+        :param priority: int, higher priorities are rendered first
+        :param untrusted: bool
+        :return: RenderJob
+        :raise SceneError: if the description is invalid or untrusted and not allowed
+        """
+        key = self.__find_key(data, untrusted)
+        job = self.__find_job(key, priority, untrusted)
+
+        if job is None:
+            scene = await asyncio.to_thread(self.__parse, data, untrusted)
+
+            # The same scene may have been submitted while this one was loading
+            job = self.__find_job(key, priority, untrusted) or self.__add_job(key, scene, priority, untrusted)
+
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancels a job, a queued job never starts and a running one stops after its current tiles.
+
+        :param job_id: str
+        :return: RenderJob
+        :raise KeyError: if there is no job with this id
+        """
+        job = self.jobs[job_id]
+
+        if job.state == "queued":
+            self.__finish(job, "cancelled")
+        elif job.state == "running":
+            job.cancel_requested = True
+
+        return job
+
+    def image(self, job_id):
+        """
+        :param job_id: str
+        :return: numpy.ndarray, None when the job is not done or its image was evicted from the cache
+        :raise KeyError: if there is no job with this id
+        """
+        job = self.jobs[job_id]
+
+        return self.cache.get(job.key) if job.state == "done" else None
+
+    def __find_key(self, data, untrusted):
+        if untrusted:
+            RenderServer.__check_client_options(data.get('render', {}))
+
+        return scene_key(data, self.base_path)
+
+    def __find_job(self, key, priority, untrusted):
+        """
+        :return: RenderJob pending or done from the cache, None when the scene has to be loaded and rendered
+        """
+        if untrusted and key not in self.__client_keys:
+            return None
+
+        if key in self.__pending:
+            return self.__pending[key]
+
+        return self.__add_job(key, None, priority, untrusted) if key in self.cache else None
+
+    def __add_job(self, key, scene, priority, untrusted):
+        if untrusted:
+            self.__client_keys.add(key)
+
+        job = RenderJob(str(next(self.__ids)), key, scene, priority)
+        self.jobs[job.id] = job
+
+        if key in self.cache:
+            job.cached = True
+            self.__finish(job, "done", cached=True)
+            return job
+
+        self.__pending[key] = job
+        job.publish("queued", priority=priority)
+
+        if self.__queue is not None:
+            self.__enqueue(job)
+
+        return job
+
+    def __parse(self, data, untrusted):
+        scene = Scene.parse(data, self.base_path, confine_paths=untrusted)
+
+        if untrusted:
+            pixels = scene.camera.width * scene.camera.height
+
+            if pixels > MAX_CLIENT_PIXELS:
+                raise SceneError(f'camera: expected at most {MAX_CLIENT_PIXELS} pixels, got {pixels}')
+
+        return scene
+
+    @staticmethod
+    def __check_client_options(options):
+        # The options are checked before the scene is loaded, since cached images are found without loading it
+        if not isinstance(options, dict):
+            return
+
+        for name, value in options.items():
+            if name not in CLIENT_RENDER_OPTIONS:
+                raise SceneError(f'render.{name}: cannot be set by clients')
+
+            maximum = CLIENT_RENDER_OPTIONS[name]
+
+            # Values of the wrong type are refused by Scene.parse
+            if maximum is not None and isinstance(value, (int, float)) and value > maximum:
+                raise SceneError(f'render.{name}: expected at most {maximum}, got {value}')
+
+    def __enqueue(self, job):
+        self.__queue.put_nowait((-job.priority, next(self.__order), job))
+
+    def __finish(self, job, state, **values):
+        job.state = state
+        job.scene = None
+        job.publish(state, **values)
+
+        if self.__pending.get(job.key) is job:
+            del self.__pending[job.key]
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            _, _, job = await self.__queue.get()
+
+            # Jobs that were cancelled while waiting are dropped here
+            if job.state != "queued":
+                continue
+
+            job.state = "running"
+            job.publish("started")
+
+            try:
+                await loop.run_in_executor(self.__executor, self.__render, job, loop)
+            except (RenderCancelled, asyncio.CancelledError) as exception:
+                self.__finish(job, "cancelled")
+
+                if isinstance(exception, asyncio.CancelledError):
+                    raise
+            except Exception as exception:
+                job.error = f'{type(exception).__name__}: {exception}'
+                self.__finish(job, "failed", error=job.error)
+            else:
+                self.__finish(job, "done", cached=False)
+
+    def __render(self, job, loop):
+        def progress(rows, cols, finished, total):
+            if job.cancel_requested:
+                raise RenderCancelled()
+
+            job.tiles = (finished, total)
+            loop.call_soon_threadsafe(functools.partial(
+                job.publish, "tile", rows=[rows.start, rows.stop], cols=[cols.start, cols.stop],
+                finished=finished, total=total
+            ))
+
+        # Clients cannot make the server write files or collect statistics
+        image = job.scene.render(workers=self.workers, progress=progress, output=None, stats=None)
+        self.cache.put(job.key, image)
+
+    async def serve(self, host='127.0.0.1', port=0, path=None):
+        """
+        Serves the jobs over HTTP/1.1, on a TCP port or on the Unix socket at path.
+
+        POST /jobs with {"scene": description, "priority": int} submits an untrusted job and answers with its status,
+        GET /jobs/<id> answers with the status of a job, GET /jobs/<id>/events streams its events as lines of JSON,
+        ended by an "error" event when the stream fails, GET /jobs/<id>/image answers with the image as a .npy file
+        and DELETE /jobs/<id> cancels the job.
+
+        :param host: str
+        :param port: int, 0 picks a free port
+        :param path: str path of a Unix socket, used instead of host and port
+        :return: asyncio.Server
+        """
+        if self.__queue is None:
+            await self.start()
+
+        if path is not None:
+            return await asyncio.start_unix_server(self.__handle, path)
+
+        return await asyncio.start_server(self.__handle, host, port)
+
+    async def __handle(self, reader, writer):
+        try:
+            method, target, body = await RenderServer.__read_request(reader)
+            await self.__respond(writer, method, target.rstrip('/').split('/')[1:], body)
+        except (ValueError, json.JSONDecodeError) as exception:
+            await RenderServer.__send_json(writer, HTTPStatus.BAD_REQUEST, {"error": str(exception)})
+        except KeyError:
+            await RenderServer.__send_json(writer, HTTPStatus.NOT_FOUND, {"error": "unknown job"})
+        except ConnectionError:
+            pass
+        except Exception as exception:
+            # Every request gets an answer, also when it hits a bug
+            await RenderServer.__send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR,
+                                           {"error": f'{type(exception).__name__}: {exception}'})
+        finally:
+            writer.close()
+
+    async def __respond(self, writer, method, parts, body):
+        if parts == ['jobs'] and method == 'POST':
+            request = json.loads(body or b'{}')
+            usage = 'expected {"scene": description, "priority": int}'
+
+            if not isinstance(request, dict) or not isinstance(request.get('scene'), dict):
+                raise ValueError(usage)
+
+            priority = request.get('priority', 0)
+
+            if isinstance(priority, bool) or not isinstance(priority, int) or set(request) - {'scene', 'priority'}:
+                raise ValueError(usage)
+
+            try:
+                job = await self.submit_async(request['scene'], priority, untrusted=True)
+            except (TypeError, KeyError, IndexError, AttributeError) as exception:
+                # Malformed values that slip past the validation are still the client's error
+                raise ValueError(f'invalid scene: {type(exception).__name__}: {exception}') from None
+            await RenderServer.__send_json(writer, HTTPStatus.ACCEPTED, job.status())
+
+        elif len(parts) == 2 and parts[0] == 'jobs' and method == 'GET':
+            await RenderServer.__send_json(writer, HTTPStatus.OK, self.jobs[parts[1]].status())
+
+        elif len(parts) == 2 and parts[0] == 'jobs' and method == 'DELETE':
+            await RenderServer.__send_json(writer, HTTPStatus.OK, self.cancel(parts[1]).status())
+
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events' and method == 'GET':
+            job = self.jobs[parts[1]]
+            await RenderServer.__send_head(writer, HTTPStatus.OK, 'application/x-ndjson', chunked=True)
+
+            # Once the head is sent an error cannot get a response of its own, it ends the stream instead
+            try:
+                async for event in job.watch():
+                    RenderServer.__write_chunk(writer, json.dumps(event).encode() + b'\n')
+                    await writer.drain()
+            except ConnectionError:
+                return
+            except Exception as exception:
+                error = {"event": "error", "id": job.id, "error": f'{type(exception).__name__}: {exception}'}
+                RenderServer.__write_chunk(writer, json.dumps(error).encode() + b'\n')
+
+            RenderServer.__write_chunk(writer, b'')
+            await writer.drain()
+
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'image' and method == 'GET':
+            job = self.jobs[parts[1]]
+
+            if job.state != "done":
+                await RenderServer.__send_json(writer, HTTPStatus.CONFLICT, job.status())
+                return
+
+            try:
+                content = await asyncio.to_thread(RenderServer.__read_file, self.cache.path(job.key))
+            except FileNotFoundError:
+                await RenderServer.__send_json(writer, HTTPStatus.GONE, {"error": "the image was evicted"})
+                return
+
+            await RenderServer.__send_head(writer, HTTPStatus.OK, 'application/octet-stream', len(content))
+            writer.write(content)
+            await writer.drain()
+
+        else:
+            await RenderServer.__send_json(writer, HTTPStatus.NOT_FOUND, {"error": f"no route for {method}"})
+
+    @staticmethod
+    def __read_file(path):
+        with open(path, 'rb') as file:
+            content = file.read()
+
+        # The modification time of a cached image is the time of its last use
+        os.utime(path)
+
+        return content
+
+    @staticmethod
+    async def __read_request(reader):
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        length = 0
+
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+
+            if not line:
+                break
+
+            name, _, value = line.partition(':')
+
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+
+        if length > MAX_REQUEST_BYTES:
+            raise ValueError(f'request body larger than {MAX_REQUEST_BYTES} bytes')
+
+        return method.upper(), target, await reader.readexactly(length) if length else b''
+
+    @staticmethod
+    async def __send_head(writer, status, content_type, length=None, chunked=False):
+        headers = [
+            f'HTTP/1.1 {status.value} {status.phrase}',
+            f'Content-Type: {content_type}',
+            'Connection: close'
+        ]
+
+        if chunked:
+            headers.append('Transfer-Encoding: chunked')
+        else:
+            headers.append(f'Content-Length: {length}')
+
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+    @staticmethod
+    async def __send_json(writer, status, value):
+        content = json.dumps(value).encode()
+        await RenderServer.__send_head(writer, status, 'application/json', len(content))
+        writer.write(content)
+        await writer.drain()
+
+    @staticmethod
+    def __write_chunk(writer, content):
+        writer.write(f'{len(content):x}\r\n'.encode('latin-1') + content + b'\r\n')
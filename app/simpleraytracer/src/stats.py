@@ -0,0 +1,185 @@
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+import numpy as np
+
+# Sections of a frame whose time is measured
+TIMED_SECTIONS = ("intersection", "shadows", "phong", "texture")
+
+"""-------------------------------------------Render statistics------------------------------------------------------"""
+
+
+class RenderStats:
+    """
+    Counters and timings of a render, filled in when it is passed to render(stats=...).
+
+    Collection works by wrapping the hot functions only while a render with stats is running, so a render without
+    stats runs the unmodified code. Wrapping adds a function call to every counted operation, so the timings of an
+    instrumented render are slower than a normal one, they are meant to be compared with each other.
+
+    The wrappers count into the stats of the thread that calls them, so renders in other threads, with or without
+    stats of their own, are never counted into these stats. Such renders only pay for the wrapper calls while the
+    instrumented render runs.
+    """
+
+    # Stats that the wrappers of the current thread count into, None outside of collect
+    __active = contextvars.ContextVar('active_stats', default=None)
+
+    # (owner, name) -> [original attribute, number of collects using its wrapper]
+    __installed = {}
+    __lock = threading.Lock()
+
+    def __init__(self):
+        self.primary_rays = 0
+        self.shadow_rays = 0
+        self.intersection_tests = {}
+        self.bvh_node_visits = 0
+        self.texture_lookups = 0
+        self.times = dict.fromkeys(TIMED_SECTIONS, 0.0)
+        self.total_time = 0.0
+        # (row start, row stop, column start, column stop, seconds) of every rendered tile
+        self.tile_times = []
+        # Seconds spent on every pixel, allocated by the render
+        self.pixel_cost = None
+
+    def count_intersection_tests(self, shape_type, count=1):
+        self.intersection_tests[shape_type] = self.intersection_tests.get(shape_type, 0) + count
+
+    def merge(self, other):
+        """
+        Adds the counters and timings of another RenderStats, e.g. the stats of a tile rendered by a worker.
+
+        :param other: RenderStats
+        """
+        self.primary_rays += other.primary_rays
+        self.shadow_rays += other.shadow_rays
+        self.bvh_node_visits += other.bvh_node_visits
+        self.texture_lookups += other.texture_lookups
+        self.total_time += other.total_time
+        self.tile_times.extend(other.tile_times)
+
+        for shape_type, count in other.intersection_tests.items():
+            self.count_intersection_tests(shape_type, count)
+
+        for section, seconds in other.times.items():
+            self.times[section] += seconds
+
+    def add_tile(self, tile_stats, rows, cols, pixel_cost):
+        """
+        Merges the stats of a tile and places its pixel costs in the cost map of the frame.
+
+        :param tile_stats: RenderStats
+        :param rows: slice
+        :param cols: slice
+        :param pixel_cost: numpy.ndarray<float> seconds spent on every pixel of the tile
+        """
+        self.merge(tile_stats)
+        self.pixel_cost[rows, cols] = pixel_cost
+
+    def as_dict(self):
+        """
+        Returns the stats as plain values that can be serialized to JSON, without the pixel costs.
+
+        :return: dict
+        """
+        return {
+            "primary_rays": self.primary_rays,
+            "shadow_rays": self.shadow_rays,
+            "intersection_tests": dict(self.intersection_tests),
+            "bvh_node_visits": self.bvh_node_visits,
+            "texture_lookups": self.texture_lookups,
+            "times": dict(self.times),
+            "total_time": self.total_time,
+            "tile_times": [list(tile) for tile in self.tile_times]
+        }
+
+    def heatmap(self):
+        """
+        Returns the pixel costs normalized to [0, 1], the most expensive pixel is 1.
+
+        :return: numpy.ndarray<float>
+        """
+        peak = self.pixel_cost.max() if self.pixel_cost is not None and self.pixel_cost.size else 0
+
+        return self.pixel_cost / peak if peak > 0 else np.zeros_like(self.pixel_cost)
+
+    @contextlib.contextmanager
+    def collect(self, probes):
+        """
+        Counts the work of the current thread into these stats while the context is active.
+
+        The probed attributes are replaced with wrappers when the first collect of any thread starts using them,
+        and restored when the last one exits. Every probe is (owner, name, section, count), where owner is a class
+        or module, section is one of TIMED_SECTIONS or None, and count is a function(stats, *args) called before
+        every call, or None. Concurrent collects have to use the same section and count for the same attribute.
+
+        :param probes: array<(object, str, str, function)>
+        """
+        token = RenderStats.__active.set(self)
+        installed = []
+
+        try:
+            with RenderStats.__lock:
+                for owner, name, section, count in probes:
+                    RenderStats.__install(owner, name, section, count)
+                    installed.append((owner, name))
+
+            yield self
+        finally:
+            RenderStats.__active.reset(token)
+
+            with RenderStats.__lock:
+                for owner, name in reversed(installed):
+                    RenderStats.__uninstall(owner, name)
+
+    @staticmethod
+    def __install(owner, name, section, count):
+        installed = RenderStats.__installed.get((owner, name))
+
+        if installed is not None:
+            installed[1] += 1
+            return
+
+        original = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+        wrapper = RenderStats.__wrap(original.__func__ if isinstance(original, staticmethod) else original,
+                                     section, count)
+        setattr(owner, name, staticmethod(wrapper) if isinstance(original, staticmethod) else wrapper)
+        RenderStats.__installed[owner, name] = [original, 1]
+
+    @staticmethod
+    def __uninstall(owner, name):
+        installed = RenderStats.__installed[owner, name]
+        installed[1] -= 1
+
+        if not installed[1]:
+            setattr(owner, name, installed[0])
+            del RenderStats.__installed[owner, name]
+
+    @staticmethod
+    def __wrap(function, section, count):
+        active = RenderStats.__active
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stats = active.get()
+
+            # Calls from threads that do not collect stats go straight through
+            if stats is None:
+                return function(*args, **kwargs)
+
+            if count is not None:
+                count(stats, *args)
+
+            if section is None:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.times[section] += time.perf_counter() - start
+
+        return wrapper
@@ -0,0 +1,197 @@
+import functools
+import os
+
+import numpy as np
+
+# Number of decoded textures kept by Texture.load
+TEXTURE_CACHE_SIZE = 32
+
+"""-------------------------------------------Texture----------------------------------------------------------------"""
+
+
+class Texture:
+    """
+    RGB image converted once to float32 values in [0, 1], with a mip pyramid for minified lookups.
+
+    All lookups take u, v coordinates in [0, 1] as scalars or arrays and sample many of them at once.
+    """
+
+    def __init__(self, image, path=None):
+        image = np.asarray(image)
+
+        if image.ndim == 2:
+            image = image[:, :, None]
+
+        # Grayscale images are expanded to RGB and alpha channels are dropped
+        if image.shape[2] < 3:
+            image = np.repeat(image[:, :, :1], 3, axis=2)
+
+        if np.issubdtype(image.dtype, np.integer):
+            levels = np.ascontiguousarray(image[:, :, :3], dtype=np.float32) / np.iinfo(image.dtype).max
+        else:
+            levels = np.clip(np.ascontiguousarray(image[:, :, :3], dtype=np.float32), 0, 1)
+
+        self.path = path
+        self.levels = [levels]
+
+        while max(self.levels[-1].shape[:2]) > 1:
+            self.levels.append(Texture.__downsample(self.levels[-1]))
+
+        for level in self.levels:
+            level.flags.writeable = False
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    @staticmethod
+    def create(source):
+        """
+        Returns the Texture for a material's texture argument.
+
+        :param source: Texture, numpy.ndarray, str path to an image or None
+        :return: Texture
+        """
+        if source is None or isinstance(source, Texture):
+            return source
+
+        if isinstance(source, (str, os.PathLike)):
+            return Texture.load(source)
+
+        return Texture(source)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a texture from an image or a pre-decoded .npy file.
+
+        Decoded textures are kept in a process-wide LRU cache keyed by the file path (and its modification time),
+        so loading the same file again returns the same Texture. An image with an up to date pre-decoded copy
+        written by Texture.predecode is loaded from the copy.
+
+        :param path: str
+        :return: Texture
+        """
+        path = os.path.abspath(path)
+        decoded = path + '.npy'
+
+        if not path.endswith('.npy') and os.path.exists(decoded) and os.path.getmtime(decoded) >= os.path.getmtime(path):
+            path = decoded
+
+        return Texture.__load(path, os.path.getmtime(path))
+
+    @staticmethod
+    def predecode(path):
+        """
+        Decodes an image once and saves its pixels next to it as <path>.npy, which Texture.load memory-maps
+        instead of decoding the image again.
+
+        :param path: str
+        :return: str path of the pre-decoded copy
+        """
+        from PIL import Image  # Only needed to decode images
+
+        with Image.open(path) as image:
+            np.save(path + '.npy', np.asarray(image.convert('RGB')))
+
+        return path + '.npy'
+
+    @staticmethod
+    @functools.lru_cache(maxsize=TEXTURE_CACHE_SIZE)
+    def __load(path, mtime):
+        if path.endswith('.npy'):
+            return Texture(np.load(path, mmap_mode='r'), path)
+
+        from PIL import Image  # Only needed to decode images
+
+        with Image.open(path) as image:
+            return Texture(np.asarray(image.convert('RGB')), path)
+
+    @staticmethod
+    def clear_cache():
+        Texture.__load.cache_clear()
+
+    @staticmethod
+    def __downsample(level):
+        # Edge rows and columns are repeated so that odd sizes can be halved
+        height, width = level.shape[:2]
+        padded = np.pad(level, ((0, height % 2), (0, width % 2), (0, 0)), mode='edge')
+
+        return (padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2]) / 4
+
+    def level_of_detail(self, footprint_u, footprint_v):
+        """
+        Returns the mip level at which one texel covers the given footprint, measured in uv units.
+
+        :param footprint_u: float or numpy.ndarray
+        :param footprint_v: float or numpy.ndarray
+        :return: float or numpy.ndarray
+        """
+        height, width = self.shape[:2]
+        texels = np.maximum(np.asarray(footprint_u) * width, np.asarray(footprint_v) * height)
+
+        with np.errstate(divide='ignore'):
+            return np.clip(np.log2(texels), 0, len(self.levels) - 1)
+
+    def sample_nearest(self, u, v):
+        level = self.levels[0]
+        height, width = level.shape[:2]
+
+        y = (np.asarray(v) * (height - 1)).astype(np.intp)
+        x = (np.asarray(u) * (width - 1)).astype(np.intp)
+
+        return level[np.clip(y, 0, height - 1), np.clip(x, 0, width - 1)]
+
+    def sample_bilinear(self, u, v, level=0):
+        level = self.levels[level]
+        height, width = level.shape[:2]
+
+        y = np.clip(np.asarray(v) * (height - 1), 0, height - 1)
+        x = np.clip(np.asarray(u) * (width - 1), 0, width - 1)
+
+        y0 = y.astype(np.intp)
+        x0 = x.astype(np.intp)
+        y1 = np.minimum(y0 + 1, height - 1)
+        x1 = np.minimum(x0 + 1, width - 1)
+
+        fy = (y - y0)[..., None]
+        fx = (x - x0)[..., None]
+
+        top = level[y0, x0] * (1 - fx) + level[y0, x1] * fx
+        bottom = level[y1, x0] * (1 - fx) + level[y1, x1] * fx
+
+        return top * (1 - fy) + bottom * fy
+
+    def sample(self, u, v, lod=0):
+        """
+        Samples the texture with bilinear filtering, blending two mip levels (trilinear) when lod is above 0.
+
+        :param u: float or numpy.ndarray
+        :param v: float or numpy.ndarray
+        :param lod: float or numpy.ndarray
+        :return: numpy.ndarray of RGB values in [0, 1], with the shape of u and a trailing axis of 3
+        """
+        u = np.nan_to_num(np.asarray(u, dtype=np.float64))
+        v = np.nan_to_num(np.asarray(v, dtype=np.float64))
+        lod = np.broadcast_to(np.clip(np.asarray(lod, dtype=np.float64), 0, len(self.levels) - 1), u.shape)
+
+        if not lod.any():
+            return self.sample_bilinear(u, v)
+
+        base = np.floor(lod).astype(np.intp)
+        blend = (lod - base)[..., None]
+        result = np.zeros(u.shape + (3,))
+
+        # Every distinct pair of adjacent levels is sampled once for all the coordinates that need it
+        for level in np.unique(base):
+            mask = base == level
+            lower = self.sample_bilinear(u[mask], v[mask], level)
+            upper = self.sample_bilinear(u[mask], v[mask], min(level + 1, len(self.levels) - 1))
+
+            result[mask] = lower * (1 - blend[mask]) + upper * blend[mask]
+
+        return result
+
+    def __repr__(self):
+        height, width = self.shape[:2]
+        return f'Texture({self.path or "<array>"}, {width}x{height}, {len(self.levels)} levels)'
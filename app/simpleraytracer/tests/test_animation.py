@@ -0,0 +1,60 @@
+import unittest
+
+from ..src.animation import *
+from ..src.scene import *
+
+
+class AnimationTest(unittest.TestCase):
+    @staticmethod
+    def scene(sphere_position, camera_rotation):
+        mat = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+        objects = [
+            Sphere(Vector3(0, 0, 0), Vector3.zeros(), 1, mat),
+            Sphere(sphere_position, Vector3.zeros(), 0.3, mat),
+            Plane(Vector3(0, -1, 0), Vector3(0.1, 0, 0), mat)
+        ]
+        light = PointLight(Vector3(5, 5, 5), Vector3.zeros(), 1E-9, Color.white(), Color.white(), Color.white())
+        camera = Camera(Vector3(0, 0, 3), camera_rotation, 16, 12, 1)
+
+        return Scene(objects, light, camera, {"shadow_samples": 1, "backend": "numpy"})
+
+    def test_frames_match_separate_renders(self):
+        positions = [Vector3(1.5, 0, 0), Vector3(0, 1.5, 0), Vector3(-1.5, 0, 0.5)]
+        rotations = [Vector3(0, 0, 0), Vector3(0, 0.2, 0), Vector3(0, 0.4, 0)]
+        keyframes = [
+            {"objects": {1: {"position": position}}, "camera": {"rotation": rotation}}
+            for position, rotation in zip(positions, rotations)
+        ]
+
+        scene = self.scene(Vector3(0, 0, 0), Vector3.zeros())
+        frames = render_sequence(scene, keyframes)
+
+        for position, rotation, frame in zip(positions, rotations, frames):
+            expected = self.scene(position, rotation)
+            np.testing.assert_array_equal(expected.render(), frame)
+
+    def test_move_lights(self):
+        scene = self.scene(Vector3(1.5, 0, 0), Vector3.zeros())
+        scene.light = [scene.light, DirectionalLight(Vector3.zeros(), Vector3.zeros(), *[Color(0.2, 0.2, 0.2)] * 3)]
+
+        # The light that every shadow ray goes to is random, the seed picks the same ones
+        frame = next(render_sequence(scene, [{"lights": {"1": {"rotation": [0, 0, 0.5]}}}], seed=0))
+
+        expected = self.scene(Vector3(1.5, 0, 0), Vector3.zeros())
+        expected.light = [expected.light, DirectionalLight(Vector3.zeros(), Vector3(0, 0, 0.5),
+                                                           *[Color(0.2, 0.2, 0.2)] * 3)]
+        np.testing.assert_array_equal(expected.render(seed=0), frame)
+
+        with self.assertRaises(ValueError):
+            next(render_sequence(scene, [{"light": {"position": [0, 0, 0]}}]))
+
+    def test_move_matches_construction(self):
+        plane = Plane(Vector3(0, 0, 0), Vector3.zeros(), Material())
+        plane.move(Vector3(1, 2, 3), Vector3(0.3, 0, 0.2))
+        expected = Plane(Vector3(1, 2, 3), Vector3(0.3, 0, 0.2), Material())
+
+        np.testing.assert_allclose(Vector3.to_array(expected.surface_normal), Vector3.to_array(plane.surface_normal))
+        np.testing.assert_allclose(Matrix4X4.to_array(expected.modelMat), Matrix4X4.to_array(plane.modelMat))
+
+        with self.assertRaises(ValueError):
+            next(render_sequence(self.scene(Vector3(0, 0, 0), Vector3.zeros()), [{"lights": {}}]))
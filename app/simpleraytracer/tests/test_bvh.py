@@ -0,0 +1,109 @@
+import unittest
+import unittest.mock
+
+from ..src.bvh import *
+
+
+class BVHTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        mat = Material(Color.white(), Color.white(), Color.white(), 100)
+
+        self.objects = [
+            Sphere(Vector3(*rng.uniform(-10, 10, 3)), Vector3.zeros(), rng.uniform(0.1, 1), mat) for _ in range(300)
+        ]
+        self.objects.append(Plane(Vector3(0, -12, 0), Vector3.zeros(), mat))
+
+        self.origins = rng.uniform(-15, 15, (200, 3))
+        self.directions = Vector3.normalize_batch(rng.normal(size=(200, 3)))
+
+    def brute_force(self, ray):
+        distances = [obj.calculate_intersection(ray) for obj in self.objects]
+        k = int(np.argmin(distances))
+
+        return distances[k], (self.objects[k] if not math.isinf(distances[k]) else None)
+
+    def test_closest_intersection(self):
+        bvh = BVH(self.objects)
+
+        for origin, direction in zip(self.origins, self.directions):
+            ray = Ray(Vector3(*origin), Vector3(*direction))
+            expected_distance, expected_obj = self.brute_force(ray)
+            distance, obj = bvh.closest_intersection(ray)
+
+            self.assertAlmostEqual(expected_distance, distance)
+            self.assertIs(expected_obj, obj)
+
+    def test_closest_intersection_batch(self):
+        bvh = BVH(self.objects)
+        distances, indices = bvh.closest_intersection_batch(self.origins, self.directions)
+
+        for origin, direction, distance, k in zip(self.origins, self.directions, distances, indices):
+            expected_distance, expected_obj = self.brute_force(Ray(Vector3(*origin), Vector3(*direction)))
+
+            self.assertAlmostEqual(expected_distance, distance)
+            self.assertIs(expected_obj, self.objects[k] if k >= 0 else None)
+
+    def test_packets_and_single_rays_agree(self):
+        # Instances are intersected through their own methods, also when their leaf is traversed ray by ray
+        base = Sphere(Vector3.zeros(), Vector3.zeros(), 0.5, self.objects[0].material)
+        rng = np.random.default_rng(3)
+        objects = self.objects + [Instance(base, Vector3(*rng.uniform(-10, 10, 3)), Vector3.zeros()) for _ in range(50)]
+        bvh = BVH(objects)
+        origins = rng.uniform(-15, 15, (1000, 3))
+        directions = Vector3.normalize_batch(rng.normal(size=(1000, 3)))
+        max_distances = rng.uniform(1, 20, 1000)
+        results = []
+
+        for packet_min_rays in (1, BVH.PACKET_MIN_RAYS, 10000):
+            with unittest.mock.patch.object(BVH, 'PACKET_MIN_RAYS', packet_min_rays):
+                results.append((*bvh.closest_intersection_batch(origins, directions),
+                                bvh.occluded_batch(origins, directions, max_distances)))
+
+        for distances, indices, occluded in results[1:]:
+            np.testing.assert_allclose(results[0][0], distances)
+            np.testing.assert_array_equal(results[0][1], indices)
+            np.testing.assert_array_equal(results[0][2], occluded)
+
+        self.assertTrue(np.isin(np.arange(300, 351), results[0][1]).any())
+
+    def test_planes_are_unbounded(self):
+        bvh = BVH(self.objects)
+
+        self.assertEqual([len(self.objects) - 1], bvh.unbounded)
+        self.assertEqual(sorted(bvh.primitives), list(range(len(self.objects) - 1)))
+
+    def test_occlusion(self):
+        bvh = BVH(self.objects)
+        max_distances = np.full(len(self.directions), 5.0)
+        occluded = bvh.occluded_batch(self.origins, self.directions, max_distances)
+
+        for origin, direction, blocked in zip(self.origins, self.directions, occluded):
+            ray = Ray(Vector3(*origin), Vector3(*direction))
+            expected_distance, _ = self.brute_force(ray)
+            occluder = bvh.find_occluder(ray, 5.0)
+
+            self.assertEqual(expected_distance < 5.0, blocked)
+            self.assertEqual(expected_distance < 5.0, occluder is not None)
+
+            if occluder is not None:
+                self.assertLess(occluder.calculate_intersection(ray), 5.0)
+
+    def test_refit(self):
+        bvh = BVH(self.objects)
+        rng = np.random.default_rng(2)
+        moved = list(range(0, 300, 7))
+
+        for k in moved:
+            self.objects[k].move(Vector3(*rng.uniform(-10, 10, 3)))
+
+        bvh.refit(moved)
+        distances, indices = bvh.closest_intersection_batch(self.origins, self.directions)
+
+        for origin, direction, distance, k in zip(self.origins, self.directions, distances, indices):
+            ray = Ray(Vector3(*origin), Vector3(*direction))
+            expected_distance, expected_obj = self.brute_force(ray)
+
+            self.assertAlmostEqual(expected_distance, distance)
+            self.assertIs(expected_obj, self.objects[k] if k >= 0 else None)
+            self.assertIs(expected_obj, bvh.closest_intersection(ray)[1])
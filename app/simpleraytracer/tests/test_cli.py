@@ -0,0 +1,106 @@
+import io
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+import unittest.mock
+import zlib
+
+from ..src.cli import *
+
+SCENE = {
+    "camera": {"position": [0, 0, 3], "width": 16, "height": 12},
+    "light": {"type": "point", "position": [5, 5, 5], "radius": 1},
+    "objects": [
+        {"type": "sphere", "position": [0, 0, 0], "radius": 1},
+        {"type": "plane", "position": [0, -1, 0]}
+    ],
+    "render": {"shadow_samples": 2}
+}
+
+
+class CommandLineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scene = os.path.join(self.directory.name, "scene.json")
+
+        with open(self.scene, "w") as file:
+            json.dump(SCENE, file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_render_scene_file(self):
+        output = os.path.join(self.directory.name, "image.npy")
+
+        self.assertEqual(0, main([self.scene, "-o", output, "--seed", "1", "--backend", "numpy"]))
+
+        expected = Scene.load(self.scene).render(seed=1, backend="numpy")
+        np.testing.assert_array_equal(expected, np.load(output))
+
+        self.assertEqual(1, main([os.path.join(self.directory.name, "missing.json"), "-o", output]))
+
+    def test_errors_are_reported_without_traceback(self):
+        invalid = os.path.join(self.directory.name, "invalid.json")
+
+        with open(invalid, "w") as file:
+            json.dump({**SCENE, "render": {"shadow_samples": "2"}}, file)
+
+        runs = [
+            ([invalid, "-o", os.path.join(self.directory.name, "image.npy")], "render.shadow_samples"),
+            ([self.scene, "-o", os.path.join(self.directory.name, "missing", "image.png")], "No such file"),
+            ([self.scene, "-o", os.path.join(self.directory.name, "image.npy"), "--listen", "127.0.0.1:0"],
+             AUTHKEY_VARIABLE),
+            ([self.scene, "-o", os.path.join(self.directory.name, "image.jpg")], "PIL")
+        ]
+
+        for argv, message in runs:
+            # Without Pillow, whether it is installed or not
+            with (
+                unittest.mock.patch.dict(sys.modules, {"PIL": None}),
+                unittest.mock.patch.dict(os.environ),
+                unittest.mock.patch("sys.stderr", new=io.StringIO()) as stderr
+            ):
+                os.environ.pop(AUTHKEY_VARIABLE, None)
+
+                self.assertEqual(1, main(argv))
+
+            self.assertTrue(stderr.getvalue().startswith("simpleraytracer: "), stderr.getvalue())
+            self.assertIn(message, stderr.getvalue())
+
+    def test_save_png(self):
+        image = np.random.default_rng(0).uniform(-10, 300, (5, 7, 3))
+        path = os.path.join(self.directory.name, "image.png")
+        save_image(path, image)
+
+        with open(path, "rb") as file:
+            content = file.read()
+
+        self.assertEqual(b'\x89PNG\r\n\x1a\n', content[:8])
+        self.assertEqual((7, 5, 8, 2), struct.unpack('>IIBB', content[16:26]))
+
+        # The pixels are stored in a single IDAT chunk, every row after its filter type
+        length = struct.unpack('>I', content[33:37])[0]
+        rows = np.frombuffer(zlib.decompress(content[41:41 + length]), np.uint8).reshape((5, -1))
+
+        np.testing.assert_array_equal(0, rows[:, 0])
+        np.testing.assert_array_equal(np.clip(np.rint(image), 0, 255).reshape((5, -1)), rows[:, 1:])
+
+    def test_optional_modules_are_not_imported(self):
+        # Probing private and special names must not import them either
+        code = ("import sys, simpleraytracer; hasattr(simpleraytracer, '__wrapped__'); "
+                "hasattr(simpleraytracer, '_private'); print(sorted(set(sys.argv[1:]) & set(sys.modules)))")
+        modules = ["asyncio", "multiprocessing", "PIL", "matplotlib"]
+        app = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        result = subprocess.run([sys.executable, "-c", code, *modules], cwd=app, capture_output=True, text=True,
+                                check=True)
+
+        self.assertEqual("[]", result.stdout.strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
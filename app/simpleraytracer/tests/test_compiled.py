@@ -0,0 +1,85 @@
+import pickle
+import unittest
+
+from ..src.raytracer import *
+
+
+class CompiledSceneTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.material = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+
+        self.objects = [
+            Sphere(Vector3(*rng.uniform(-3, 3, 2), -4), Vector3.zeros(), rng.uniform(0.1, 0.5), self.material)
+            for _ in range(20)
+        ]
+        self.objects += [
+            Plane(Vector3(0, -3, 0), Vector3(0.1, 0, 0), self.material),
+            Instance(Sphere(Vector3.zeros(), Vector3.zeros(), 1, self.material), Vector3(2, 0, -6), Vector3.zeros(),
+                     Vector3(1, 0.5, 1))
+        ]
+        self.light = PointLight(Vector3(5, 5, 5), Vector3.zeros(), 1, Color.white(), Color.white(), Color.white())
+        self.camera = Camera(Vector3(0, 0, 3), Vector3.zeros(), 16, 12, 1)
+
+    def test_packed_arrays(self):
+        geometry = compile_scene(self.objects, self.light, self.camera).geometry
+
+        self.assertEqual([SPHERE] * 20 + [PLANE, SHAPE], geometry.kinds.tolist())
+        np.testing.assert_array_equal(np.arange(20), geometry.sphere_objects)
+        np.testing.assert_allclose([obj.radius ** 2 for obj in self.objects[:20]], geometry.sphere_radii_squared)
+        np.testing.assert_allclose(Vector3.to_array(self.objects[20].surface_normal), geometry.plane_normals[0])
+        self.assertEqual([True] * 20 + [False, True], geometry.bounded().tolist())
+
+        for name in CompiledGeometry.SHARED_ARRAYS:
+            self.assertFalse(getattr(geometry, name).flags.writeable, name)
+
+    def test_packed_intersections_match_shapes(self):
+        geometry = CompiledGeometry(self.objects)
+        rng = np.random.default_rng(6)
+        origins = rng.uniform(-5, 5, (100, 3))
+        directions = Vector3.normalize_batch(rng.normal(size=(100, 3)))
+
+        spheres = geometry.intersect_spheres(geometry.rows[:20], origins, directions)
+        planes = geometry.intersect_planes(geometry.rows[20:21], origins, directions)
+
+        for k, obj in enumerate(self.objects[:20]):
+            np.testing.assert_allclose(obj.calculate_intersection_batch(origins, directions), spheres[:, k])
+
+        np.testing.assert_allclose(self.objects[20].calculate_intersection_batch(origins, directions), planes[:, 0])
+
+    def test_update(self):
+        geometry = CompiledGeometry(self.objects)
+        self.objects[3].move(Vector3(0, 0, -10))
+
+        updated = geometry.update([3])
+
+        np.testing.assert_array_equal([0, 0, -10], updated.sphere_centers[3])
+        self.assertNotEqual(-10, geometry.sphere_centers[3, 2])
+        self.assertFalse(updated.sphere_centers.flags.writeable)
+
+    def test_render(self):
+        scene = compile_scene(self.objects, self.light, self.camera)
+        expected = render(self.objects, self.light, self.camera, shadow_samples=2, backend="numpy", seed=1)
+
+        np.testing.assert_array_equal(expected, scene.render(shadow_samples=2, backend="numpy", seed=1))
+        np.testing.assert_array_equal(expected, pickle.loads(pickle.dumps(scene)).render(shadow_samples=2,
+                                                                                       backend="numpy", seed=1))
+
+    def test_parallel_render_shares_arrays(self):
+        # Enough spheres for their centers to be placed in shared memory
+        rng = np.random.default_rng(7)
+        objects = [Sphere(Vector3(*rng.uniform(-20, 20, 2), -30), Vector3.zeros(), 0.2, self.material)
+                   for _ in range(3000)]
+        scene = compile_scene(objects, self.light, self.camera)
+        centers = scene.geometry.sphere_centers
+        self.assertGreaterEqual(centers.nbytes, SHARED_TEXTURE_MIN_BYTES)
+
+        expected = scene.render(shadow_samples=1, backend="numpy")
+        actual = scene.render(shadow_samples=1, backend="numpy", workers=2, tile_size=8)
+
+        np.testing.assert_array_equal(expected, actual)
+        self.assertIs(centers, scene.geometry.sphere_centers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+from ..src.raytracer import *
+
+
+class DenoiseTest(unittest.TestCase):
+    def setUp(self):
+        material = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+
+        self.objects = [
+            Sphere(Vector3(x, -0.4, z), Vector3.zeros(), 0.2, material)
+            for x in (-1, 0, 1)
+            for z in (-2, -1)
+        ]
+        self.objects.append(Plane(Vector3(0, -1, 0), Vector3.zeros(), material))
+        self.light = PointLight(Vector3(5, 5, 5), Vector3.zeros(), 3, Color.white(), Color.white(), Color.white())
+        self.camera = Camera(Vector3(0, 0, 1.5), Vector3.zeros(), 48, 36, 1)
+
+    def test_auxiliary_buffers(self):
+        expected = render(self.objects, self.light, self.camera, shadow_samples=2, backend="numpy", seed=1,
+                          tile_size=16)
+        buffers = {}
+
+        for backend, antialiasing, workers in (("numpy", "fixed", 1), ("python", "fixed", 1),
+                                               ("numpy", "adaptive", 1), ("numpy", "fixed", 2)):
+            auxiliary = AuxiliaryBuffers()
+            image = render(self.objects, self.light, self.camera, shadow_samples=2, backend=backend, seed=1,
+                           antialiasing=antialiasing, workers=workers, tile_size=16, auxiliary=auxiliary)
+            buffers[backend, antialiasing, workers] = auxiliary
+
+            # The auxiliary pass draws no random numbers
+            if backend == "numpy" and antialiasing == "fixed":
+                np.testing.assert_array_equal(expected, image)
+
+        reference = buffers["numpy", "fixed", 1]
+
+        for auxiliary in buffers.values():
+            for name, _ in AUXILIARY_FIELDS:
+                np.testing.assert_array_equal(getattr(reference, name), getattr(auxiliary, name), name)
+
+        # The top rows see the background, the bottom rows the plane
+        self.assertTrue((reference.object[0] == -1).all())
+        self.assertTrue((reference.object[-1] == len(self.objects) - 1).all())
+        np.testing.assert_allclose([0, 1, 0], reference.normal[-1, 0], atol=1E-6)
+        np.testing.assert_allclose([0.6, 0.6, 0.6], reference.albedo[-1, 0], atol=1E-6)
+        self.assertTrue((reference.unshadowed[-1] > 0).all())
+
+    def test_denoise_reduces_error(self):
+        camera = Camera(Vector3(0, 0, 1.5), Vector3.zeros(), 64, 48, 1)
+        options = dict(backend="numpy", dtype=np.float32, seed=1)
+        reference = render(self.objects, self.light, camera, shadow_samples=64, **options)
+        noisy = render(self.objects, self.light, camera, shadow_samples=1, **options)
+        denoised = render(self.objects, self.light, camera, shadow_samples=1, denoise=True, **options)
+
+        noisy_error = np.sqrt(np.mean((noisy - reference) ** 2))
+        denoised_error = np.sqrt(np.mean((denoised - reference) ** 2))
+
+        self.assertLess(denoised_error, noisy_error * 0.75)
+
+    def test_denoise_radiance_keeps_edges(self):
+        auxiliary = AuxiliaryBuffers()
+        auxiliary.allocate(16, 16)
+        auxiliary.normal[:] = (0, 0, 1)
+        auxiliary.depth[:] = 2
+        auxiliary.albedo[:] = 0.5
+        auxiliary.unshadowed[:] = 0.8
+        auxiliary.object[:, 8:] = 1
+        auxiliary.object[:, :8] = 0
+
+        # A shadowed object next to a lit one, the shadow carries noise
+        rng = np.random.default_rng(0)
+        shadow = np.where(np.arange(16) < 8, 0.25, 1.0)[None, :, None]
+        radiance = np.repeat(0.8 * np.clip(shadow + rng.normal(0, 0.05, (16, 16, 1)) * (shadow < 1), 0, 1), 3, axis=2)
+
+        denoised = denoise_radiance(radiance, auxiliary)
+
+        np.testing.assert_allclose(0.8, denoised[:, 8:], rtol=1E-6)
+        self.assertLess(denoised[:, :8].std(), radiance[:, :8].std() / 2)
+        np.testing.assert_allclose(0.2, denoised[:, :8].mean(), atol=0.01)
+
+    def test_denoise_radiance_keeps_noise_free_penumbras(self):
+        auxiliary = AuxiliaryBuffers()
+        auxiliary.allocate(16, 16)
+        auxiliary.normal[:] = (0, 0, 1)
+        auxiliary.depth[:] = 2
+        auxiliary.albedo[:] = 0.5
+        auxiliary.unshadowed[:] = 0.8
+        auxiliary.object[:] = 0
+
+        # A penumbra rendered with enough samples has no noise left to filter, its gradient stays as it is
+        radiance = np.repeat(0.8 * np.linspace(0.1, 0.9, 16)[None, :, None], 16, axis=0).repeat(3, axis=2)
+
+        np.testing.assert_allclose(radiance, denoise_radiance(radiance, auxiliary), rtol=1E-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
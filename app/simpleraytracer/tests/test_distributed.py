@@ -0,0 +1,152 @@
+import multiprocessing
+import socket
+import threading
+import time
+import unittest
+from multiprocessing.connection import Client
+
+from ..src.distributed import *
+from ..src.raytracer import *
+
+AUTHKEY = b'test'
+
+
+class DistributedTest(unittest.TestCase):
+    def setUp(self):
+        material = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+
+        self.objects = [Sphere(Vector3(x, -0.4, -1.5), Vector3.zeros(), 0.3, material) for x in (-1, 0, 1)]
+        self.objects.append(Plane(Vector3(0, -1, 0), Vector3.zeros(), material))
+        self.light = PointLight(Vector3(5, 5, 5), Vector3.zeros(), 3, Color.white(), Color.white(), Color.white())
+        self.camera = Camera(Vector3(0, 0, 1.5), Vector3.zeros(), 32, 24, 1)
+        self.options = dict(shadow_samples=2, backend="numpy", seed=1, tile_size=8)
+
+    def test_seeded_render_is_independent_of_tiles(self):
+        expected = render(self.objects, self.light, self.camera, **self.options)
+
+        for options in (dict(tile_size=5), dict(tile_size=None), dict(workers=2), dict(backend="python")):
+            np.testing.assert_array_equal(expected, render(self.objects, self.light, self.camera,
+                                                           **{**self.options, **options}), str(options))
+
+        # Unseeded renders draw a new seed every frame
+        options = {**self.options, "seed": None}
+        self.assertFalse(np.array_equal(render(self.objects, self.light, self.camera, **options),
+                                        render(self.objects, self.light, self.camera, **options)))
+
+    def test_requeues_tile_of_dying_worker(self):
+        expected = render(self.objects, self.light, self.camera, **self.options)
+
+        with RenderCoordinator(authkey=AUTHKEY) as coordinator:
+            image, workers = self.__render_with_failing_worker(coordinator, close=True)
+
+            np.testing.assert_array_equal(expected, image)
+            self.assertEqual(1, coordinator.requeued_tiles)
+
+            # The workers stay connected for the next frame
+            np.testing.assert_array_equal(expected, render(self.objects, self.light, self.camera,
+                                                           coordinator=coordinator, **self.options))
+
+        for worker in workers:
+            worker.join(10)
+            self.assertEqual(0, worker.exitcode)
+
+    def test_requeues_tile_after_timeout(self):
+        expected = render(self.objects, self.light, self.camera, **self.options)
+
+        with RenderCoordinator(authkey=AUTHKEY, tile_timeout=0.5) as coordinator:
+            image, workers = self.__render_with_failing_worker(coordinator, close=False)
+
+            np.testing.assert_array_equal(expected, image)
+            self.assertEqual(1, coordinator.requeued_tiles)
+
+        for worker in workers:
+            worker.join(10)
+
+    def test_fails_without_workers(self):
+        with RenderCoordinator(authkey=AUTHKEY, idle_timeout=0.5) as coordinator:
+            with self.assertRaises(TimeoutError):
+                render(self.objects, self.light, self.camera, coordinator=coordinator, **self.options)
+
+            # A frame that failed leaves the coordinator ready for the next one, which waits for the worker to start
+            coordinator.idle_timeout = 30
+            worker = multiprocessing.Process(target=run_worker, args=(coordinator.address, AUTHKEY))
+            worker.start()
+            np.testing.assert_array_equal(render(self.objects, self.light, self.camera, **self.options),
+                                          render(self.objects, self.light, self.camera, coordinator=coordinator,
+                                                 **self.options))
+
+        worker.join(10)
+        self.assertEqual(0, worker.exitcode)
+
+    def test_rejects_wrong_authkey(self):
+        with RenderCoordinator(authkey=AUTHKEY) as coordinator:
+            with self.assertRaises(multiprocessing.AuthenticationError):
+                Client(coordinator.address, authkey=b'wrong')
+
+            self.assertEqual(0, coordinator.workers)
+
+    def test_silent_client_does_not_block_workers(self):
+        expected = render(self.objects, self.light, self.camera, **self.options)
+        coordinator = RenderCoordinator(authkey=AUTHKEY)
+
+        # A client that connects and never authenticates holds up nobody but itself
+        with socket.create_connection(coordinator.address):
+            worker = multiprocessing.Process(target=run_worker, args=(coordinator.address, AUTHKEY))
+            worker.start()
+
+            try:
+                np.testing.assert_array_equal(expected, render(self.objects, self.light, self.camera,
+                                                               coordinator=coordinator, **self.options))
+            finally:
+                start = time.monotonic()
+                coordinator.close()
+
+            self.assertLess(time.monotonic() - start, 5)
+
+        worker.join(10)
+        self.assertEqual(0, worker.exitcode)
+
+    def test_requires_authkey(self):
+        for authkey in (None, b'', 'test'):
+            with self.assertRaises(ValueError):
+                RenderCoordinator(authkey=authkey)
+
+            with self.assertRaises(ValueError):
+                run_worker(("127.0.0.1", 1), authkey, connect_timeout=0)
+
+    def __render_with_failing_worker(self, coordinator, close):
+        """
+        Renders on 2 worker processes after a worker that took the first tile and then either disconnected or hung.
+        """
+        result = {}
+
+        def render_frame():
+            result["image"] = render(self.objects, self.light, self.camera, coordinator=coordinator, **self.options)
+
+        failing = Client(coordinator.address, authkey=AUTHKEY)
+        thread = threading.Thread(target=render_frame)
+        thread.start()
+
+        try:
+            self.assertEqual('scene', failing.recv()[0])
+            self.assertEqual('tile', failing.recv()[0])
+
+            if close:
+                failing.close()
+
+            workers = [multiprocessing.Process(target=run_worker, args=(coordinator.address, AUTHKEY))
+                       for _ in range(2)]
+
+            for worker in workers:
+                worker.start()
+
+            thread.join(30)
+            self.assertFalse(thread.is_alive())
+        finally:
+            failing.close()
+
+        return result["image"], workers
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from ..src.geometry import *
+
+
+class GeometryTest(unittest.TestCase):
+    def test_fused_operations(self):
+        a = Vector3(1, 2, 3)
+        b = Vector3(-2, 0.5, 4)
+        c = Vector3(0.5, -1, 2)
+
+        self.assertEqual(Vector3.dot(Vector3.subtract(a, b), c), Vector3.sub_dot(a, b, c))
+
+        expected = Vector3.add(a, Vector3.scalar_mul(3, b))
+        actual = Vector3.madd(a, 3, b)
+        self.assertEqual((expected.x, expected.y, expected.z), (actual.x, actual.y, actual.z))
+
+        expected = Vector3.normalize(Vector3.subtract(a, b))
+        actual = Vector3.sub_normalize(a, b)
+        self.assertEqual((expected.x, expected.y, expected.z), (actual.x, actual.y, actual.z))
+
+    def test_types_have_no_instance_dict(self):
+        for value in [Vector3(0, 0, 0), Point(0, 0, 0), Color(0, 0, 0), Ray(None, None), Matrix4X4.identity_mat()]:
+            self.assertFalse(hasattr(value, '__dict__'))
+
+    def test_matrix_columns(self):
+        m = Matrix4X4.mul_mat(Matrix4X4.translation_mat(Vector3(1, 2, 3)), Matrix4X4.scaling_mat(Vector3(2, 2, 2)))
+
+        self.assertEqual([2, 0, 0, 0], [m.column1.x, m.column1.y, m.column1.z, m.column1.w])
+        self.assertEqual([1, 2, 3, 1], [m.column4.x, m.column4.y, m.column4.z, m.column4.w])
+
+    def test_matrix_inverse(self):
+        m = Matrix4X4.mul_mat(
+            Matrix4X4.translation_mat(Vector3(1, 2, 3)),
+            Matrix4X4.mul_mat(Matrix4X4.rotation_mat(0.7, Vector3(0, 1, 0)), Matrix4X4.scaling_mat(Vector3(2, 3, 0.5)))
+        )
+
+        identity = Matrix4X4.to_array(Matrix4X4.mul_mat(m, m.inverse))
+        np.testing.assert_allclose(identity, np.eye(4), atol=1E-12)
+        self.assertIs(m.inverse, m.inverse)
+
+        with self.assertRaises(ZeroDivisionError):
+            Matrix4X4.scaling_mat(Vector3(1, 0, 1)).inverse
+
+    def test_color_is_clamped_only_on_request(self):
+        color = Color.add(Color(0.8, 0.5, -0.2), Color(0.4, 0.1, 0))
+
+        self.assertAlmostEqual(1.2, color.r)
+        self.assertEqual((1, 0.6, 0), (Color.clamp(color).r, round(Color.clamp(color).g, 6), Color.clamp(color).b))
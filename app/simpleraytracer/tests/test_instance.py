@@ -0,0 +1,84 @@
+import unittest
+
+from ..src.bvh import *
+from ..src.mesh import *
+from ..src import raytracer
+
+
+class InstanceTest(unittest.TestCase):
+    def setUp(self):
+        texture = np.random.default_rng(0).integers(0, 256, (16, 32, 3), dtype=np.uint8)
+        self.material = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color(0.3, 0.3, 0.3), 50, texture)
+        self.light = PointLight(Vector3(3, 3, 0), Vector3.zeros(), 0.5, Color.white(), Color.white(), Color.white())
+        self.camera = Camera(Vector3.zeros(), Vector3.zeros(), 24, 18, 1)
+
+    def test_instance_renders_like_its_base(self):
+        base = Sphere(Vector3.zeros(), Vector3.zeros(), 1, self.material)
+        floor = Plane(Vector3(0, -1, 0), Vector3.zeros(), self.material)
+
+        direct = [Sphere(Vector3(0, 0, -4), Vector3.zeros(), 1, self.material), floor]
+        instanced = [Instance(base, Vector3(0, 0, -4), Vector3.zeros()), floor]
+
+        for backend in ("numpy", "python"):
+            expected = raytracer.render(direct, self.light, self.camera, shadow_samples=2, backend=backend, seed=1)
+            actual = raytracer.render(instanced, self.light, self.camera, shadow_samples=2, backend=backend, seed=1)
+
+            np.testing.assert_array_equal(expected, actual)
+
+    def test_scaled_instance_of_a_mesh(self):
+        rng = np.random.default_rng(1)
+        vertices = rng.uniform(-1, 1, (60, 3))
+        faces = np.arange(60).reshape((-1, 3))
+        scale = np.array([2, 0.5, 1.5])
+
+        instance = Instance(TriangleMesh(Vector3.zeros(), Vector3.zeros(), vertices, faces, self.material),
+                            Vector3(1, 2, 3), Vector3(0.4, 0, 0.2), Vector3(*scale))
+        expected = TriangleMesh(Vector3(1, 2, 3), Vector3(0.4, 0, 0.2), vertices * scale, faces, self.material)
+
+        origins = rng.uniform(-5, 5, (200, 3))
+        directions = Vector3.normalize_batch(rng.normal(size=(200, 3)))
+        distances = instance.calculate_intersection_batch(origins, directions)
+
+        np.testing.assert_allclose(distances, expected.calculate_intersection_batch(origins, directions))
+        self.assertTrue(np.isfinite(distances).any())
+
+        hits = np.isfinite(distances)
+        points = origins[hits] + directions[hits] * distances[hits, None]
+        np.testing.assert_allclose(np.abs(instance.normal_batch(points)), np.abs(expected.normal_batch(points)),
+                                   atol=1E-9)
+
+        box = instance.bounding_box()
+        self.assertTrue((Vector3.to_array(box.minimum) <= expected.node_min[0] + 1E-9).all())
+        self.assertTrue((Vector3.to_array(box.maximum) >= expected.node_max[0] - 1E-9).all())
+
+    def test_instances_share_their_base_in_a_bvh(self):
+        rng = np.random.default_rng(2)
+        base = Sphere(Vector3.zeros(), Vector3.zeros(), 0.5, self.material)
+        instances = [Instance(base, Vector3(*rng.uniform(-10, 10, 3)), Vector3.zeros()) for _ in range(200)]
+        spheres = [Sphere(i.position, Vector3.zeros(), 0.5, self.material) for i in instances]
+
+        origins = rng.uniform(-12, 12, (100, 3))
+        directions = Vector3.normalize_batch(rng.normal(size=(100, 3)))
+
+        expected = BVH(spheres).closest_intersection_batch(origins, directions)
+        actual = BVH(instances).closest_intersection_batch(origins, directions)
+
+        np.testing.assert_allclose(expected[0], actual[0])
+        np.testing.assert_array_equal(expected[1], actual[1])
+        self.assertTrue(all(instance.base is base for instance in instances))
+
+
+    def test_zero_length_directions_miss(self):
+        instance = Instance(Sphere(Vector3.zeros(), Vector3.zeros(), 1, self.material), Vector3(0, 0, -4),
+                            Vector3.zeros())
+        directions = np.array([[0.0, 0.0, -1.0], [0.0, 0.0, 0.0]])
+
+        with np.errstate(all='raise'):
+            distances = instance.calculate_intersection_batch(np.zeros(3), directions)
+
+        np.testing.assert_allclose([3, np.inf], distances)
+        self.assertEqual(math.inf, instance.calculate_intersection(Ray(Vector3.zeros(), Vector3(0, 0, 0))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import tempfile
+import unittest
+
+from ..src.mesh import *
+from ..src import raytracer
+
+# A unit cube with one quad per side, the top is textured with a full 0..1 uv square
+CUBE_OBJ = """
+v -0.5 -0.5 -0.5
+v 0.5 -0.5 -0.5
+v 0.5 0.5 -0.5
+v -0.5 0.5 -0.5
+v -0.5 -0.5 0.5
+v 0.5 -0.5 0.5
+v 0.5 0.5 0.5
+v -0.5 0.5 0.5
+vt 0 0
+vt 1 0
+vt 1 1
+vt 0 1
+f 1/1 4/4 3/3 2/2
+f 5/1 6/2 7/3 8/4
+f 1/1 2/2 6/3 5/4
+f 4/1 8/2 7/3 3/4
+f 1/1 5/2 8/3 4/4
+f -7/1 -6/2 -2/3 -3/4
+"""
+
+
+class TriangleMeshTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cube.obj')
+
+        with open(self.path, 'w') as file:
+            file.write(CUBE_OBJ)
+
+        self.material = Material(Color.black(), Color.white(), Color.black(), 100)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def random_mesh(rng, count):
+        vertices = rng.uniform(-2, 2, (count * 3, 3))
+        vertices += np.repeat(rng.uniform(-5, 5, (count, 3)), 3, axis=0)
+
+        return vertices, np.arange(count * 3).reshape((-1, 3))
+
+    def test_load_obj(self):
+        mesh = TriangleMesh.load_obj(self.path, Vector3(0, 0, -3), Vector3.zeros(), self.material)
+
+        self.assertEqual(mesh.triangle_count, 12)
+        # Corners are only shared when both their position and uv match
+        self.assertEqual(len(mesh.vertices), 18)
+        self.assertEqual(mesh.uvs.shape, (18, 2))
+        self.assertIsNone(mesh.local_normals)
+
+        box = mesh.bounding_box()
+        np.testing.assert_allclose(Vector3.to_array(box.minimum)[:3], [-0.5, -0.5, -3.5])
+        np.testing.assert_allclose(Vector3.to_array(box.maximum)[:3], [0.5, 0.5, -2.5])
+
+    def test_load_obj_errors(self):
+        path = os.path.join(self.directory.name, 'broken.obj')
+
+        with open(path, 'w') as file:
+            file.write('v 0 0 0\nv 1 0 0\nf 1 2 3\n')
+
+        with self.assertRaisesRegex(ValueError, 'broken.obj:3'):
+            TriangleMesh.load_obj(path, Vector3.zeros(), Vector3.zeros(), self.material)
+
+    def test_intersection_matches_brute_force(self):
+        rng = np.random.default_rng(3)
+        vertices, faces = self.random_mesh(rng, 500)
+        mesh = TriangleMesh(Vector3(1, 2, 3), Vector3(0.3, 0.2, 0.1), vertices, faces, self.material, leaf_size=4)
+
+        origins = rng.uniform(-10, 10, (300, 3))
+        directions = Vector3.normalize_batch(rng.normal(size=(300, 3)))
+        distances, triangles = mesh.intersect_batch(origins, directions)
+
+        # One leaf holding every triangle is the brute force test
+        expected = getattr(TriangleMesh, '_TriangleMesh__intersect_triangles')(
+            origins, directions, mesh.v0, mesh.e1, mesh.e2
+        ).min(axis=1)
+
+        np.testing.assert_allclose(distances, expected)
+        self.assertTrue(np.isfinite(distances).any())
+
+        hits = np.isfinite(distances)
+        located, _ = mesh.locate(origins[hits] + directions[hits] * distances[hits, None])
+        np.testing.assert_array_equal(located, triangles[hits])
+
+        ray = Ray(Vector3(*origins[0]), Vector3(*directions[0]))
+        self.assertAlmostEqual(mesh.calculate_intersection(ray), expected[0])
+
+    def test_move_refits(self):
+        rng = np.random.default_rng(4)
+        vertices, faces = self.random_mesh(rng, 100)
+        mesh = TriangleMesh(Vector3.zeros(), Vector3.zeros(), vertices, faces, self.material)
+        mesh.move(Vector3(10, 0, 0), Vector3(0, 1, 0))
+
+        rebuilt = TriangleMesh(Vector3(10, 0, 0), Vector3(0, 1, 0), vertices, faces, self.material)
+        origins = rng.uniform(-10, 20, (200, 3))
+        directions = Vector3.normalize_batch(rng.normal(size=(200, 3)))
+
+        np.testing.assert_allclose(mesh.intersect_batch(origins, directions)[0],
+                                   rebuilt.intersect_batch(origins, directions)[0])
+
+    def test_render_textured_mesh(self):
+        texture = np.zeros((8, 8, 3), dtype=np.uint8)
+        texture[:4] = 255
+        material = Material(Color.black(), Color.black(), Color.black(), 100, texture)
+
+        # Seen from above, the top side shows the white and black halves of the texture
+        mesh = TriangleMesh.load_obj(self.path, Vector3(0, -2, 0), Vector3.zeros(), material)
+        camera = Camera(Vector3.zeros(), Vector3(-math.pi / 2, 0, 0), 16, 16, 0.4)
+        light = PointLight(Vector3(0, 5, 0), Vector3.zeros(), 0.01, Color.white(), Color.white(), Color.white())
+
+        images = [
+            raytracer.render([mesh], light, camera, shadow_samples=1, backend=backend)
+            for backend in ("numpy", "python")
+        ]
+
+        np.testing.assert_array_equal(images[0], images[1])
+        self.assertGreater(images[0][:, :, 0].max(), 200)
+        self.assertLess(images[0][:, :, 0].min(), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
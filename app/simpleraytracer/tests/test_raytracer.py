@@ -1,7 +1,37 @@
+import os
+import tempfile
 import unittest
 
+from ..src import raytracer
 from ..src.raytracer import *
 
+# Module private functions have to be looked up by name, inside the test class their names would be mangled
+find_closest_intersection = getattr(raytracer, '__find_closest_intersection')
+calculate_soft_shadow = getattr(raytracer, '__calculate_soft_shadow_numpy')
+
+
+def two_object_scene(light_radius=1E-9, camera_z=1.5, width=20, height=15, texture=None, bright=None):
+    """
+    A unit sphere resting on a plane, lit by a point light above and to the right of the camera.
+
+    :param light_radius: float, the default makes every shadow ray point at the light center
+    :param camera_z: float distance of the camera from the center of the sphere
+    :param width: int
+    :param height: int
+    :param texture: numpy.ndarray texture of the material, None for no texture
+    :param bright: Color of the light, None for white
+    :return: (array<Object>, PointLight, Camera)
+    """
+    mat = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100, texture)
+    objects = [
+        Sphere(Vector3(0, 0, 0), Vector3.zeros(), 1, mat),
+        Plane(Vector3(0, -1, 0), Vector3.zeros(), mat)
+    ]
+    color = Color.white() if bright is None else bright
+    light = PointLight(Vector3(5, 5, 5), Vector3.zeros(), light_radius, color, color, color)
+
+    return objects, light, Camera(Vector3(0, 0, camera_z), Vector3.zeros(), width, height, 1)
+
 
 class RaytracerTest(unittest.TestCase):
     def test_closest_intersection(self):
@@ -9,17 +39,281 @@ class RaytracerTest(unittest.TestCase):
         sphere_first = Sphere(Vector3(0, 0, 35), Vector3.zeros(), 5, mat)
         sphere_second = Sphere(Vector3(0, 0, 65), Vector3.zeros(), 10, mat)
 
-        distance, obj = __find_closest_intersection(Ray(Vector3.zeros(), Vector3(0, 0, 1)), [sphere_first, sphere_second])
+        distance, obj = find_closest_intersection(Ray(Vector3.zeros(), Vector3(0, 0, 1)), [sphere_first, sphere_second])
 
         self.assertEqual(30.0, distance)
         self.assertEqual(sphere_first, obj)
 
     def test_calculate_soft_shadow(self):
-        # The light is placed at (5, 20, 0) with a radius of 2, the sphere is sitting under it at (5, 10, 0)
-        # with a radius of 2.
-        spheres = [Sphere(Vector3(5, 10, 0), Vector3.zeros(), 2, Material())]
-        samples = [Vector3(i, 20, 0) for i in np.linspace(4, 6, 100)]
+        # The light is placed at (5, 20, 0), the sphere is sitting under it at (5, 10, 0) with a radius of 2.
+        # The point under the sphere is in its umbra, the point far to the side sees the whole light and the point
+        # in between sees part of it.
+        bvh = BVH([Sphere(Vector3(5, 10, 0), Vector3.zeros(), 2, Material())])
+        light = PointLight(Vector3(5, 20, 0), Vector3.zeros(), 1, Color.white(), Color.white(), Color.white())
+        points = np.array([[5, 0, 0], [25, 0, 0], [9, 0, 0]], dtype=float)
+        normals = np.tile([0.0, 1.0, 0.0], (3, 1))
+        probabilities = np.ones((3, 1))
+        shifts = sample_uniform(1, sample_keys(slice(0, 1), slice(0, 3), 3, 1)[0, :, 0], 2)
+
+        visible = calculate_soft_shadow(points, normals, probabilities, bvh, [light], 64, shifts)
+
+        self.assertEqual((3, 1), visible.shape)
+        self.assertEqual(0, visible[0, 0])
+        self.assertEqual(64, visible[1, 0])
+        self.assertTrue(0 < visible[2, 0] < 64)
+
+        # Without shadow rays no light is reached
+        np.testing.assert_array_equal(
+            np.zeros((3, 1)), calculate_soft_shadow(points, normals, probabilities, bvh, [light], 0, shifts)
+        )
+
+    def test_numpy_backend_matches_python_backend(self):
+        # A tiny light radius makes every shadow ray point at the light center, so both backends are deterministic
+        texture = np.random.default_rng(0).integers(0, 256, (32, 64, 3), dtype=np.uint8)
+        objects, light, camera = two_object_scene(width=16, height=12, texture=texture)
+
+        expected = render(objects, light, camera, shadow_samples=3)
+        actual = render(objects, light, camera, shadow_samples=3, backend="numpy")
+
+        self.assertEqual(expected.shape, actual.shape)
+        self.assertLessEqual(np.abs(expected.astype(int) - actual.astype(int)).max(), 1)
+
+    def test_unknown_backend(self):
+        camera = Camera(Vector3(0, 0, 1.5), Vector3.zeros(), 4, 4, 1)
+
+        with self.assertRaises(ValueError):
+            render([], None, camera, backend="cuda")
+
+    def test_light_list(self):
+        objects, light, camera = two_object_scene(camera_z=3)
+        half = Color(0.5, 0.5, 0.5)
+
+        # Two halves of the light sum up to the whole light, a light out of range adds nothing
+        lights = [
+            PointLight(Vector3(5, 5, 5), Vector3.zeros(), 1E-9, half, half, half),
+            PointLight(Vector3(5, 5, 5), Vector3.zeros(), 1E-9, half, half, half),
+            PointLight(Vector3(0, 50, 0), Vector3.zeros(), 1E-9, Color.white(), Color.white(), Color.white(), range=10)
+        ]
+
+        for backend in ("python", "numpy"):
+            expected = render(objects, light, camera, shadow_samples=4, backend=backend).astype(np.int64)
+            actual = render(objects, lights, camera, shadow_samples=4, backend=backend).astype(np.int64)
+
+            self.assertLessEqual(np.abs(expected - actual).max(), 1)
+
+        with self.assertRaises(ValueError):
+            render(objects, [], camera)
+
+    def test_sampled_lights_match_between_backends(self):
+        objects, _, camera = two_object_scene(camera_z=3)
+        dim = Color(0.3, 0.3, 0.3)
+        lights = [
+            PointLight(Vector3(3, 5, 5), Vector3.zeros(), 0.5, dim, dim, dim),
+            PointLight(Vector3(-4, 3, 2), Vector3.zeros(), 0.5, dim, Color(0.3, 0.1, 0.1), dim, range=8),
+            DirectionalLight(Vector3.zeros(), Vector3(0.3, 0, 0.4), dim, Color(0.1, 0.1, 0.2), dim, angle=0.05)
+        ]
+
+        for options in ({}, {"shadow_sampling": "adaptive"}):
+            expected = render(objects, lights, camera, shadow_samples=8, seed=1, **options).astype(np.int64)
+            actual = render(objects, lights, camera, shadow_samples=8, seed=1, backend="numpy", **options)
+
+            self.assertLessEqual(np.abs(expected - actual).max(), 1)
+
+        # With enough shadow rays picking one light per ray converges to shading with every light
+        separate = sum(
+            render(objects, light, camera, shadow_samples=256, seed=2, backend="numpy").astype(np.int64)
+            for light in lights
+        )
+        combined = render(objects, lights, camera, shadow_samples=256, seed=2, backend="numpy")
+
+        self.assertLess(np.abs(combined - separate).mean(), 1)
+
+    def test_directional_light(self):
+        mat = Material(Color.black(), Color.white(), Color.black(), 100)
+        sphere = Sphere(Vector3(0, 1, 0), Vector3.zeros(), 0.5, mat)
+        plane = Plane(Vector3(0, 0, 0), Vector3.zeros(), mat)
+
+        # Tilted by 60 degrees away from the zenith, the light reaches the plane at half strength
+        light = DirectionalLight(Vector3.zeros(), Vector3(0, 0, math.pi / 3), Color.black(), Color.white(),
+                                 Color.black())
+        self.assertAlmostEqual(0.5, plane.phong(light, Vector3(0, 5, 0), Vector3(3, 0, 0), plane.surface_normal).r)
+
+        # Shining straight down the sphere casts a hard shadow right below itself
+        light.move(rotation=Vector3.zeros())
+        origin = Vector3(0, 1E-3, 0)
+        self.assertIsNotNone(is_occluded(Ray(origin, light.direction(origin)), light.distance(origin), [sphere]))
+
+        # Seen from the scene it matches a point light far away in the same direction
+        light.move(rotation=Vector3(0, 0, math.pi / 4))
+        far = Vector3(-1E6, 1E6, 0)
+        point_light = PointLight(far, Vector3.zeros(), 1E-9, Color.black(), Color.white(), Color.black())
+        camera = Camera(Vector3(0, 5, 0), Vector3(-math.pi / 2, 0, 0), 16, 16, 0.25)
+
+        for backend in ("python", "numpy"):
+            expected = render([sphere, plane], point_light, camera, shadow_samples=2, backend=backend)
+            actual = render([sphere, plane], light, camera, shadow_samples=2, backend=backend)
+
+            self.assertLessEqual(np.abs(expected.astype(np.int64) - actual).max(), 1)
+            self.assertEqual(0, actual.min())
+
+    def test_camera_ray_directions(self):
+        camera = Camera(Vector3(0, 0, 3), Vector3(0.1, 0.2, 0), 6, 4, 1)
+        directions = camera.ray_directions()
+
+        self.assertEqual((4, 6, 4, 3), directions.shape)
+        self.assertFalse(directions.flags.writeable)
+
+        # The sub-pixels of the fixed pattern, built one by one
+        samples_y = np.linspace(camera.top.y, camera.bottom.y, camera.height)
+        samples_x, step = np.linspace(camera.left.x, camera.right.x, camera.width, retstep=True)
+        x, y, offset = samples_x[2], samples_y[1], step / 4
+        for k, (dx, dy) in enumerate([(1, 1), (-1, 1), (1, -1), (-1, -1)]):
+            pixel = Matrix4X4.mul_vector3(camera.modelMat, Vector3(x + dx * offset, y + dy * offset, -0.5))
+            expected = Vector3.to_array(Vector3.sub_normalize(pixel, camera.center))[:3]
+            np.testing.assert_allclose(expected, directions[1, 2, k])
+
+        np.testing.assert_array_equal(camera.directions_through(samples_x[[2]], samples_y[[1]]),
+                                      camera.ray_directions("center")[1, 2])
+
+        # Cameras with the same view share the table, moving the camera builds a new one
+        self.assertIs(directions, Camera(Vector3(0, 0, 3), Vector3(0.1, 0.2, 0), 6, 4, 1).ray_directions())
+        camera.move(Vector3(0, 0, 2))
+        self.assertIsNot(directions, camera.ray_directions())
+
+        with self.assertRaises(ValueError):
+            camera.ray_directions("jittered")
+
+    def test_split_tiles(self):
+        tiles = split_tiles(5, 7, 4)
+
+        self.assertEqual([(slice(0, 4), slice(0, 4)), (slice(0, 4), slice(4, 7)),
+                          (slice(4, 5), slice(0, 4)), (slice(4, 5), slice(4, 7))], tiles)
+
+    def test_parallel_render_matches_serial_render(self):
+        # The texture is large enough to be placed in shared memory
+        texture = np.random.default_rng(0).integers(0, 256, (128, 256, 3), dtype=np.uint8)
+        objects, light, camera = two_object_scene(texture=texture)
+        mat = objects[0].material
+
+        levels = mat.texture.levels
+
+        expected = render(objects, light, camera, shadow_samples=2, backend="numpy")
+        actual = render(objects, light, camera, shadow_samples=2, backend="numpy", workers=2, tile_size=8)
+
+        np.testing.assert_array_equal(expected, actual)
+        self.assertIs(levels, mat.texture.levels)
+
+    def test_is_occluded(self):
+        mat = Material(Color.white(), Color.white(), Color.white(), 100)
+        near = Sphere(Vector3(0, 0, 10), Vector3.zeros(), 1, mat)
+        far = Sphere(Vector3(0, 0, 30), Vector3.zeros(), 1, mat)
+        ray = Ray(Vector3.zeros(), Vector3(0, 0, 1))
+
+        self.assertIsNone(is_occluded(ray, 5, [near, far]))
+        self.assertIs(near, is_occluded(ray, 20, BVH([far, near])))
+        # The last occluder is tested first, any blocker is a valid answer
+        self.assertIs(far, is_occluded(ray, 40, [near, far], last_occluder=far))
+        self.assertIs(near, is_occluded(ray, 20, [near, far], last_occluder=far))
+
+    def test_render_progressive_converges_to_render(self):
+        objects, light, camera = two_object_scene(width=14, height=10)
+
+        passes = list(render_progressive(objects, light, camera, shadow_samples=3))
+        fractions = [fraction for _, fraction in passes]
+
+        # A preview, four anti-aliasing passes and two more shadow passes
+        self.assertEqual(7, len(passes))
+        self.assertEqual(sorted(fractions), fractions)
+        self.assertEqual(1.0, fractions[-1])
+        self.assertEqual((10, 14, 3), passes[0][0].shape)
+
+        expected = render(objects, light, camera, shadow_samples=3, backend="numpy")
+        self.assertLessEqual(np.abs(np.round(passes[-1][0]) - expected).max(), 1)
+
+    def test_adaptive_antialiasing(self):
+        objects, light, camera = two_object_scene()
+
+        fixed = render(objects, light, camera, shadow_samples=1, backend="numpy").astype(np.int64)
+        numpy_adaptive = render(objects, light, camera, shadow_samples=1, backend="numpy", antialiasing="adaptive")
+        python_adaptive = render(objects, light, camera, shadow_samples=1, antialiasing="adaptive")
+
+        np.testing.assert_allclose(numpy_adaptive, python_adaptive, atol=1)
+        # Smooth areas are shaded from the pixel center only, edges are averaged like the fixed pattern
+        self.assertLess(np.abs(numpy_adaptive - fixed).mean(), 2)
+
+        with self.assertRaises(ValueError):
+            render(objects, light, camera, antialiasing="stochastic")
+
+    def test_adaptive_shadow_sampling(self):
+        objects, light, camera = two_object_scene(light_radius=1, camera_z=3)
+
+        fixed = render(objects, light, camera, shadow_samples=32, backend="numpy").astype(np.int64)
+
+        for backend in ("python", "numpy"):
+            adaptive = render(objects, light, camera, shadow_samples=32, backend=backend, shadow_sampling="adaptive")
+            # Fully lit and fully shadowed pixels agree exactly, only the penumbra is noisy
+            self.assertLess(np.abs(adaptive - fixed).mean(), 1)
+
+        with self.assertRaises(ValueError):
+            render(objects, light, camera, shadow_sampling="importance")
+
+    def test_seeded_render_is_reproducible(self):
+        objects, light, camera = two_object_scene(light_radius=1, camera_z=3)
+
+        for backend in ("python", "numpy"):
+            # Every pixel and sample draws from its own keyed stream, so neither the tiles nor the workers matter
+            expected = render(objects, light, camera, shadow_samples=4, backend=backend, seed=7, tile_size=8)
+
+            for options in (dict(tile_size=8, workers=2), dict(tile_size=3), dict(tile_size=None)):
+                actual = render(objects, light, camera, shadow_samples=4, backend=backend, seed=7, **options)
+
+                np.testing.assert_array_equal(expected, actual, f"{backend} {options}")
+
+    def test_render_to_memory_mapped_output(self):
+        objects, light, camera = two_object_scene()
+        background = np.random.default_rng(0).integers(0, 256, (15, 20, 3), dtype=np.uint16)
+
+        expected = render(objects, light, camera, background, shadow_samples=1, backend="numpy")
+
+        with tempfile.TemporaryDirectory() as directory:
+            background_path = os.path.join(directory, "background.npy")
+            output_path = os.path.join(directory, "image.npy")
+            np.save(background_path, background)
+
+            for workers in (1, 2):
+                image = render(objects, light, camera, background_path, shadow_samples=1, backend="numpy",
+                               workers=workers, tile_size=8, output=output_path)
+
+                self.assertIsInstance(image, np.memmap)
+                np.testing.assert_array_equal(expected, np.load(output_path))
+                del image
+
+        with self.assertRaises(ValueError):
+            render(objects, light, camera, output=np.zeros((10, 10, 3), np.uint16))
+
+    def test_tonemap(self):
+        radiance = np.array([[-0.5, 0.25, 1.0, 3.0]], dtype=np.float32)
+
+        np.testing.assert_array_equal([[0, 64, 255, 255]], tonemap(radiance, np.uint8))
+        np.testing.assert_allclose([[0, 51, 127.5, 191.25]], tonemap(radiance, np.float32, "reinhard"))
+        np.testing.assert_allclose([[-127.5, 63.75, 255, 765]], tonemap(radiance, np.float32, "none"))
+        np.testing.assert_array_equal([[0, 128, 255, 255]], tonemap(radiance, np.uint16, gamma=2))
+        np.testing.assert_array_equal([[0, 128, 255, 255]], tonemap(radiance / 4, np.uint8, exposure=4, gamma=2))
+        self.assertEqual(np.uint16, tonemap(radiance).dtype)
+
+    def test_high_dynamic_range_output(self):
+        objects, light, camera = two_object_scene(camera_z=3, bright=Color(3, 3, 3))
+
+        for backend in ("python", "numpy"):
+            hdr = render(objects, light, camera, shadow_samples=1, backend=backend, dtype=np.float32,
+                         tone_mapping="none")
+            image = render(objects, light, camera, shadow_samples=1, backend=backend, dtype=np.uint8)
 
-        shadow_value = __calculate_soft_shadow(samples, spheres, Vector3(5, 20, 0), Vector3(38.1, 0, 0))
+            # The samples are only clamped once they are averaged, so the float image keeps the highlights
+            self.assertEqual(np.float32, hdr.dtype)
+            self.assertGreater(hdr.max(), 255)
+            self.assertEqual(np.uint8, image.dtype)
+            np.testing.assert_array_equal(tonemap(hdr / 255, np.uint8), image)
 
-        self.assertEqual(0.5, shadow_value)
+        with self.assertRaises(ValueError):
+            render(objects, light, camera, tone_mapping="filmic")
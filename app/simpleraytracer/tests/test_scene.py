@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+import unittest
+
+from ..src.raytracer import *
+from ..src.scene import *
+
+SCENE = {
+    "camera": {"position": [0, 0, 1.5], "width": 20, "height": 15},
+    "light": {"type": "point", "position": [5, 5, 5], "radius": 1E-9},
+    "materials": {
+        "textured": {"ambient": [0.1, 0.1, 0.1], "diffuse": [0.6, 0.6, 0.6], "texture": "texture.npy"}
+    },
+    "objects": [
+        {"type": "sphere", "position": [0, 0, 0], "radius": 1, "material": "textured"},
+        {"type": "plane", "position": [0, -1, 0], "material": {"diffuse": [0.5, 0.5, 0.5]}}
+    ],
+    "render": {"shadow_samples": 1, "backend": "numpy"}
+}
+
+
+class SceneTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.texture = np.random.default_rng(0).integers(0, 256, (64, 128, 3), dtype=np.uint8)
+        np.save(os.path.join(self.directory.name, "texture.npy"), self.texture)
+
+    def tearDown(self):
+        Texture.clear_cache()
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+
+        with open(path, "w") as file:
+            file.write(content)
+
+        return path
+
+    def test_load_json_scene(self):
+        scene = Scene.load(self.write("scene.json", json.dumps(SCENE)))
+
+        sphere, plane = scene.objects
+        self.assertIsInstance(sphere, Sphere)
+        self.assertIsInstance(plane, Plane)
+        self.assertEqual((20, 15), (scene.camera.width, scene.camera.height))
+        self.assertEqual({"shadow_samples": 1, "backend": "numpy"}, scene.options)
+
+        # The texture path is resolved next to the scene file and only loaded when it is used
+        self.assertIsInstance(sphere.material._Material__texture, str)
+        np.testing.assert_allclose(sphere.material.texture.levels[0], self.texture / 255, atol=1E-6)
+        self.assertIsNone(plane.material.texture)
+
+        expected = render(scene.objects, scene.light, scene.camera, shadow_samples=1, backend="numpy")
+        np.testing.assert_array_equal(expected, scene.render())
+
+    def test_load_toml_scene(self):
+        path = self.write("scene.toml", "\n".join([
+            '[camera]',
+            'position = [0, 0, 1.5]',
+            'width = 8',
+            'height = 6',
+            '[light]',
+            'type = "point"',
+            'position = [5, 5, 5]',
+            '[[objects]]',
+            'type = "sphere"',
+            'position = [0, 0, 0]',
+            'radius = 0.5'
+        ]))
+
+        scene = Scene.load(path)
+
+        self.assertEqual(0.5, scene.objects[0].radius)
+        self.assertEqual((6, 8, 3), scene.render().shape)
+
+    def test_binary_round_trip(self):
+        scene = Scene.parse(SCENE, self.directory.name)
+        path = os.path.join(self.directory.name, "scene.bin")
+
+        scene.save(path)
+        loaded = Scene.load(path)
+
+        # Textures that were not loaded yet are stored by their path
+        self.assertLess(os.path.getsize(path), self.texture.nbytes)
+        np.testing.assert_array_equal(scene.render(seed=1), loaded.render(seed=1))
+
+        with self.assertRaises(SceneError):
+            Scene.load(self.write("scene.dat", "not a scene"))
+
+    def test_validation(self):
+        invalid = [
+            ({"camera": {"position": [0, 0], "width": 8, "height": 6}}, "camera.position"),
+            ({"camera": {"position": [0, 0, 1], "width": 8.5, "height": 6}}, "camera.width"),
+            ({"light": {"type": "area", "position": [0, 0, 0]}}, "light.type"),
+            ({"light": {"type": "directional", "position": [0, 0, 0], "radius": 1}}, 'light: unknown key "radius"'),
+            ({"lights": []}, "scene"),
+            ({"objects": [{"type": "cube", "position": [0, 0, 0]}]}, "objects[0].type"),
+            ({"objects": [{"type": "sphere", "position": [0, 0, 0], "material": "missing"}]}, "objects[0].material"),
+            ({"objects": [{"type": "plane", "position": [0, 0, 0], "radius": 1}]}, "objects[0]: unknown key"),
+            ({"materials": {"red": {"texture": 1}}}, "materials.red.texture"),
+            ({"objects": [{"type": "mesh", "position": [0, 0, 0], "path": "missing.obj"}]}, "objects[0].path"),
+            ({"render": {"shadow_samplez": 1}}, 'render: unknown key "shadow_samplez"'),
+            ({"render": {"shadow_samples": "4"}}, "render.shadow_samples"),
+            ({"render": {"backend": "gpu"}}, "render.backend"),
+            ({"render": {"denoise": 1}}, "render.denoise"),
+            ({"render": {"progress": None}}, "render.progress"),
+            ({"render": {"background_image": 1}}, "render.background_image")
+        ]
+
+        for change, message in invalid:
+            with self.assertRaises(SceneError) as context:
+                Scene.parse({**SCENE, **change}, self.directory.name)
+
+            self.assertTrue(str(context.exception).startswith(message), str(context.exception))
+
+    def test_light_list(self):
+        lights = [
+            {"type": "point", "position": [5, 5, 5], "radius": 1E-9, "range": 20},
+            {"type": "directional", "position": [0, 0, 0], "rotation": [0, 0, 0.5], "angle": 0.01}
+        ]
+        data = {key: value for key, value in SCENE.items() if key != "light"}
+
+        scene = Scene.parse({**data, "lights": lights}, self.directory.name)
+
+        point, directional = scene.light
+        self.assertEqual(20, point.range)
+        self.assertIsInstance(directional, DirectionalLight)
+        self.assertEqual(0.01, directional.angle)
+
+        with self.assertRaises(SceneError) as context:
+            Scene.parse({**data, "lights": [{"type": "directional"}]}, self.directory.name)
+
+        self.assertTrue(str(context.exception).startswith('lights[0]: missing "position"'))
+
+    def test_mesh_path_is_relative_to_the_scene(self):
+        self.write("triangle.obj", "v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n")
+        mesh = {"type": "mesh", "path": "triangle.obj", "position": [0, 0, -1], "material": "textured"}
+
+        scene = Scene.parse({**SCENE, "objects": [mesh]}, self.directory.name)
+
+        self.assertIsInstance(scene.objects[0], TriangleMesh)
+        self.assertEqual(1, scene.objects[0].triangle_count)
+
+    def test_background_path_is_relative_to_the_scene(self):
+        background = np.full((15, 20, 3), 40, dtype=np.uint8)
+        np.save(os.path.join(self.directory.name, "background.npy"), background)
+        data = {**SCENE, "render": {**SCENE["render"], "background_image": "background.npy"}}
+
+        scene = Scene.parse(data, self.directory.name)
+
+        self.assertEqual(os.path.join(self.directory.name, "background.npy"), scene.options["background_image"])
+        np.testing.assert_array_equal(render(scene.objects, scene.light, scene.camera, background, shadow_samples=1,
+                                             backend="numpy"), scene.render())
+
+    def test_predecoded_texture_is_preferred(self):
+        image_path = self.write("texture.png", "")
+        os.utime(image_path, (0, 0))
+        np.save(image_path + ".npy", self.texture)
+
+        self.assertEqual(image_path + ".npy", Texture.load(image_path).path)
@@ -0,0 +1,261 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from ..src.server import *
+
+SCENE = {
+    "camera": {"position": [0, 0, 3], "width": 16, "height": 12},
+    "light": {"type": "point", "position": [5, 5, 5], "radius": 1E-9},
+    "objects": [
+        {"type": "sphere", "position": [0, 0, 0], "radius": 1},
+        {"type": "plane", "position": [0, -1, 0]}
+    ],
+    "render": {"shadow_samples": 1, "backend": "numpy", "tile_size": 8, "seed": 1}
+}
+
+
+def scene(**render):
+    return {**SCENE, "render": {**SCENE["render"], **render}}
+
+
+async def request(path, method, target, body=None):
+    """
+    Sends a request to the server on the Unix socket at path.
+
+    :return: (int status, bytes content), chunked content is joined
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    content = b'' if body is None else json.dumps(body).encode()
+    writer.write(f'{method} {target} HTTP/1.1\r\nContent-Length: {len(content)}\r\n\r\n'.encode() + content)
+    await writer.drain()
+
+    head, _, content = (await reader.read()).partition(b'\r\n\r\n')
+    writer.close()
+
+    if b'Transfer-Encoding: chunked' in head:
+        chunks = []
+
+        while True:
+            size, _, content = content.partition(b'\r\n')
+            size = int(size, 16)
+
+            if not size:
+                break
+
+            chunks.append(content[:size])
+            content = content[size + 2:]
+
+        # Nothing follows the last chunk
+        assert content == b'\r\n', content
+        content = b''.join(chunks)
+
+    return int(head.split(b' ')[1]), content
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_evicts_least_recently_used(self):
+        image = np.zeros((8, 8, 3), np.uint16)
+        cache = ResultCache(self.directory.name)
+        cache.put('a', image)
+        cache.max_bytes = 2 * os.path.getsize(cache.path('a'))
+        cache.put('b', image + 1)
+
+        os.utime(cache.path('a'), ns=(1, 1))
+        os.utime(cache.path('b'), ns=(2, 2))
+        np.testing.assert_array_equal(image, cache.get('a'))
+
+        cache.put('c', image + 2)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        np.testing.assert_array_equal(image + 2, cache.get('c'))
+
+    def test_scene_key(self):
+        key = scene_key(SCENE, self.directory.name)
+
+        self.assertEqual(key, scene_key(scene(workers=4), self.directory.name))
+        self.assertNotEqual(key, scene_key(scene(shadow_samples=2), self.directory.name))
+        self.assertNotEqual(key, scene_key({**SCENE, "camera": {**SCENE["camera"], "width": 8}}, self.directory.name))
+
+        # Files named by the scene are part of its content
+        path = os.path.join(self.directory.name, "texture.npy")
+        np.save(path, np.zeros((4, 4, 3), np.uint8))
+        textured = {**SCENE, "materials": {"textured": {"texture": "texture.npy"}}}
+        before = scene_key(textured, self.directory.name)
+
+        np.save(path, np.zeros((8, 8, 3), np.uint8))
+        self.assertNotEqual(before, scene_key(textured, self.directory.name))
+
+
+class RenderServerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = RenderServer(os.path.join(self.directory.name, "cache"), workers=1)
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_render_and_cache(self):
+        await self.server.start()
+        job = self.server.submit(SCENE)
+        events = [event async for event in job.watch()]
+
+        self.assertEqual(["queued", "started"] + ["tile"] * 4 + ["done"], [event["event"] for event in events])
+        self.assertEqual({"event": "tile", "id": job.id, "rows": [8, 12], "cols": [8, 16], "finished": 4, "total": 4},
+                         events[-2])
+        np.testing.assert_array_equal(Scene.parse(SCENE).render(), self.server.image(job.id))
+
+        cached = self.server.submit(scene(workers=2))
+        self.assertEqual("done", await cached.wait())
+        self.assertTrue(cached.cached)
+        np.testing.assert_array_equal(self.server.image(job.id), self.server.image(cached.id))
+
+    async def test_priorities_and_cancellation(self):
+        slow = {"backend": "python", "shadow_samples": 4, "tile_size": 2}
+        low = self.server.submit(scene(seed=2, **slow))
+        high = self.server.submit(scene(seed=3, **slow), priority=5)
+        dropped = self.server.submit(scene(seed=4), priority=1)
+
+        # Identical scenes share the pending job
+        self.assertIs(low, self.server.submit(scene(seed=2, **slow)))
+
+        self.server.cancel(dropped.id)
+        await self.server.start()
+        await asyncio.sleep(0)
+
+        self.assertEqual(("running", "queued", "cancelled"), (high.state, low.state, dropped.state))
+
+        self.server.cancel(high.id)
+        self.assertEqual("cancelled", await high.wait())
+        self.assertEqual("done", await low.wait())
+        self.assertNotIn(high.key, self.server.cache)
+        self.assertIsNone(self.server.image(dropped.id))
+
+    async def test_http(self):
+        path = os.path.join(self.directory.name, "server.sock")
+        http = await self.server.serve(path=path)
+
+        def request_server(method, target, body=None):
+            return request(path, method, target, body)
+
+        async with http:
+            status, content = await request_server('POST', '/jobs', {"scene": SCENE, "priority": 2})
+            self.assertEqual(202, status)
+            job = json.loads(content)
+
+            status, content = await request_server('GET', f'/jobs/{job["id"]}/events')
+            events = [json.loads(line) for line in content.splitlines()]
+            self.assertEqual("done", events[-1]["event"])
+            self.assertEqual(4, sum(event["event"] == "tile" for event in events))
+
+            status, content = await request_server('GET', f'/jobs/{job["id"]}/image')
+            self.assertEqual(200, status)
+            np.testing.assert_array_equal(Scene.parse(SCENE).render(), np.load(io.BytesIO(content)))
+
+            status, content = await request_server('GET', f'/jobs/{job["id"]}')
+            self.assertEqual("done", json.loads(content)["state"])
+
+            self.assertEqual(404, (await request_server('DELETE', '/jobs/99'))[0])
+
+            # Malformed requests and options that clients may not set are refused
+            outside = os.path.join(os.path.dirname(self.directory.name), "outside.npy")
+            textured = {**SCENE, "materials": {"red": {"texture": outside}}}
+
+            invalid = [
+                {"scene": {"camera": {}}},
+                {"scene": SCENE, "priority": [1]},
+                {"scene": SCENE, "priority": {}},
+                {"scene": [SCENE]},
+                {"scene": SCENE, "extra": 1},
+                [],
+                {"scene": {**SCENE, "objects": [1]}},
+                {"scene": scene(background_image="background.npy")},
+                {"scene": scene(workers=64)},
+                {"scene": scene(shadow_samples=100000)},
+                {"scene": scene(max_subsamples=1000)},
+                {"scene": {**SCENE, "camera": {**SCENE["camera"], "width": 4000, "height": 3000}}},
+                {"scene": textured}
+            ]
+
+            for body in invalid:
+                status, content = await request_server('POST', '/jobs', body)
+                self.assertEqual(400, status, body)
+                self.assertIn("error", json.loads(content))
+
+    async def test_untrusted_paths_stay_in_base_path(self):
+        self.server.base_path = os.path.join(self.directory.name, "scenes")
+        os.makedirs(self.server.base_path)
+        np.save(os.path.join(self.server.base_path, "texture.npy"), np.zeros((4, 4, 3), np.uint8))
+        textured = {**SCENE, "materials": {"textured": {"texture": "texture.npy"}}}
+
+        self.assertEqual("queued", self.server.submit(textured, untrusted=True).state)
+
+        for path in ("../texture.npy", os.path.join(self.directory.name, "texture.npy")):
+            with self.assertRaises(SceneError):
+                self.server.submit({**SCENE, "materials": {"textured": {"texture": path}}}, untrusted=True)
+
+
+    async def test_finds_cached_scenes_before_loading_them(self):
+        await self.server.start()
+        loads = []
+        parse = Scene.parse
+
+        def parse_on_thread(*args, **kwargs):
+            loads.append(threading.current_thread())
+            return parse(*args, **kwargs)
+
+        with mock.patch.object(Scene, 'parse', side_effect=parse_on_thread):
+            job = await self.server.submit_async(SCENE, untrusted=True)
+            self.assertIs(job, await self.server.submit_async(SCENE, untrusted=True))
+            self.assertEqual("done", await job.wait())
+
+            cached = await self.server.submit_async(SCENE, untrusted=True)
+            self.assertEqual("done", cached.state)
+            self.assertTrue(cached.cached)
+
+            # Options that clients may not set are refused before the cache is asked
+            with self.assertRaises(SceneError):
+                await self.server.submit_async(scene(workers=64), untrusted=True)
+
+        # The scene was loaded once, off the thread of the event loop
+        self.assertEqual(1, len(loads))
+        self.assertIsNot(threading.current_thread(), loads[0])
+
+    async def test_events_end_with_error(self):
+        path = os.path.join(self.directory.name, "server.sock")
+        http = await self.server.serve(path=path)
+
+        async def failing_watch(job):
+            yield {"event": "queued", "id": job.id}
+            raise RuntimeError("lost")
+
+        async with http:
+            job = self.server.submit(SCENE)
+
+            with mock.patch.object(RenderJob, 'watch', failing_watch):
+                status, content = await request(path, 'GET', f'/jobs/{job.id}/events')
+
+            self.assertEqual(200, status)
+            self.assertEqual([{"event": "queued", "id": job.id},
+                              {"event": "error", "id": job.id, "error": "RuntimeError: lost"}],
+                             [json.loads(line) for line in content.splitlines()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import threading
+import unittest
+
+from ..src.raytracer import *
+
+
+class RenderStatsTest(unittest.TestCase):
+    def setUp(self):
+        mat = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+        self.objects = [
+            Sphere(Vector3(0, 0, 0), Vector3.zeros(), 1, mat),
+            Plane(Vector3(0, -1, 0), Vector3.zeros(), mat)
+        ]
+        self.light = PointLight(Vector3(5, 5, 5), Vector3.zeros(), 1, Color.white(), Color.white(), Color.white())
+        self.camera = Camera(Vector3(0, 0, 3), Vector3.zeros(), 16, 12, 1)
+
+    def test_counts_match_between_backends(self):
+        counts = []
+
+        for backend in ("python", "numpy"):
+            stats = RenderStats()
+            image = render(self.objects, self.light, self.camera, shadow_samples=3, backend=backend, seed=1,
+                           tile_size=8, stats=stats)
+
+            np.testing.assert_array_equal(
+                render(self.objects, self.light, self.camera, shadow_samples=3, backend=backend, seed=1, tile_size=8),
+                image
+            )
+
+            # Every sub-pixel ray that hits an object casts all of its shadow rays
+            self.assertEqual(16 * 12 * 4, stats.primary_rays)
+            self.assertEqual(0, stats.shadow_rays % 3)
+            self.assertGreater(stats.shadow_rays, 0)
+            self.assertEqual({"Sphere", "Plane"}, set(stats.intersection_tests))
+            self.assertGreater(stats.bvh_node_visits, 0)
+            self.assertEqual(4, len(stats.tile_times))
+            self.assertEqual((12, 16), stats.pixel_cost.shape)
+            self.assertLessEqual(stats.pixel_cost.sum(), stats.total_time + 1E-9)
+            self.assertEqual(1.0, stats.heatmap().max())
+
+            counts.append((stats.primary_rays, stats.shadow_rays))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_collect_restores_functions(self):
+        stats = RenderStats()
+        originals = (BVH.closest_intersection, BVH.__dict__["_BVH__slab"], Sphere.calculate_intersection, Texture.sample)
+
+        with stats.collect([
+            (BVH, "closest_intersection", "intersection", None),
+            (BVH, "_BVH__slab", None, None),
+            (Sphere, "calculate_intersection", None, None),
+            (Texture, "sample", "texture", None)
+        ]):
+            self.assertIsNot(originals[0], BVH.closest_intersection)
+            BVH(self.objects).closest_intersection(Ray(Vector3(0, 0, 3), Vector3(0, 0, -1)))
+
+        self.assertGreater(stats.times["intersection"], 0)
+        self.assertEqual(
+            originals,
+            (BVH.closest_intersection, BVH.__dict__["_BVH__slab"], Sphere.calculate_intersection, Texture.sample)
+        )
+
+    def test_collect_only_counts_its_own_thread(self):
+        bvh = BVH(self.objects)
+        ray = Ray(Vector3(0, 0, 3), Vector3(0, 0, -1))
+        original = BVH.closest_intersection
+        probes = [
+            (BVH, "closest_intersection", "intersection", lambda stats, *_: stats.count_intersection_tests("BVH"))
+        ]
+        inner = RenderStats()
+        inner_started = threading.Event()
+        outer_finished = threading.Event()
+
+        def collect_inner():
+            with inner.collect(probes):
+                inner_started.set()
+                outer_finished.wait(10)
+                bvh.closest_intersection(ray)
+
+        stats = RenderStats()
+        thread = threading.Thread(target=collect_inner)
+
+        with stats.collect(probes):
+            thread.start()
+            inner_started.wait(10)
+
+            # A thread without stats of its own is not counted
+            counted = threading.Thread(target=bvh.closest_intersection, args=(ray,))
+            counted.start()
+            counted.join()
+
+            bvh.closest_intersection(ray)
+
+        # The wrapper stays until the last collect that uses it exits
+        self.assertIsNot(original, BVH.closest_intersection)
+        outer_finished.set()
+        thread.join(10)
+
+        self.assertEqual({"BVH": 1}, stats.intersection_tests)
+        self.assertEqual({"BVH": 1}, inner.intersection_tests)
+        self.assertIs(original, BVH.closest_intersection)
+
+    def test_merge(self):
+        first = RenderStats()
+        first.primary_rays = 2
+        first.count_intersection_tests("Sphere", 3)
+
+        second = RenderStats()
+        second.primary_rays = 5
+        second.count_intersection_tests("Sphere", 1)
+        second.count_intersection_tests("Plane", 4)
+        second.times["phong"] = 0.5
+
+        first.merge(second)
+
+        self.assertEqual(7, first.primary_rays)
+        self.assertEqual({"Sphere": 4, "Plane": 4}, first.intersection_tests)
+        self.assertEqual(0.5, first.as_dict()["times"]["phong"])
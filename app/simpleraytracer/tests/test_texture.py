@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from ..src.texture import *
+
+
+class TextureTest(unittest.TestCase):
+    def test_conversion_and_mip_levels(self):
+        image = np.zeros((5, 8, 4), dtype=np.uint8)
+        image[..., 0] = 255
+
+        texture = Texture(image)
+
+        self.assertEqual((5, 8, 3), texture.shape)
+        self.assertEqual(np.float32, texture.levels[0].dtype)
+        self.assertEqual([(5, 8), (3, 4), (2, 2), (1, 1)], [level.shape[:2] for level in texture.levels])
+        np.testing.assert_allclose([1, 0, 0], texture.levels[-1][0, 0])
+
+    def test_bilinear_sampling(self):
+        texture = Texture(np.array([[[0.0] * 3, [1.0] * 3]]))
+        colors = texture.sample(np.array([0.0, 0.25, 1.0]), np.zeros(3))
+
+        np.testing.assert_allclose([[0] * 3, [0.25] * 3, [1] * 3], colors)
+
+    def test_trilinear_sampling_blends_levels(self):
+        image = np.zeros((4, 4, 3))
+        image[::2, ::2] = 1
+        texture = Texture(image)
+
+        np.testing.assert_allclose([1, 1, 1], texture.sample(0.0, 0.0, 0))
+        np.testing.assert_allclose([0.25] * 3, texture.sample(0.0, 0.0, 1))
+        np.testing.assert_allclose([0.625] * 3, texture.sample(0.0, 0.0, 0.5))
+
+    def test_load_is_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'texture.npy')
+            np.save(path, np.full((4, 4, 3), 128, dtype=np.uint8))
+
+            first = Texture.load(path)
+            second = Texture.load(os.path.relpath(path))
+
+            self.assertIs(first, second)
+            Texture.clear_cache()
+            self.assertIsNot(first, Texture.load(path))
@@ -0,0 +1,96 @@
+import argparse
+import sys
+import time
+import tracemalloc
+
+from simpleraytracer import *
+
+COUNTED_TYPES = [Vector3, Point, Color, Ray, Matrix4X4]
+
+
+def count_instances(types):
+    """
+    Wraps the constructors of the given types so every instance they create is counted.
+
+    :param types: array<type>
+    :return: dict<str, int>, function that restores the original constructors
+    """
+    counts = {cls.__name__: 0 for cls in types}
+    originals = {cls: cls.__dict__.get('__init__') for cls in types}
+
+    def wrap(cls, init):
+        def counted_init(self, *args, **kwargs):
+            counts[cls.__name__] += 1
+            init(self, *args, **kwargs)
+
+        return counted_init
+
+    for cls in types:
+        cls.__init__ = wrap(cls, cls.__init__)
+
+    def restore():
+        for cls, init in originals.items():
+            if init is None:
+                del cls.__init__
+            else:
+                cls.__init__ = init
+
+    return counts, restore
+
+
+def instance_size(obj):
+    # Instances without __slots__ also carry a dict of their attributes
+    size = sys.getsizeof(obj)
+
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+
+    return size
+
+
+def scene(size):
+    camera = Camera(Vector3(0, 0, 1.5), Vector3.zeros(), size, size, 1)
+    light = PointLight(Vector3(5, 5, 5), Vector3.zeros(), 1, Color(1, 1, 1), Color(0.945, 0.703, 0.253),
+                       Color(0.945, 0.703, 0.253))
+    mat = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+    objects = [
+        Sphere(Vector3(0, 0, 0), Vector3.zeros(), 1, mat),
+        Plane(Vector3(0, -1, 0), Vector3.zeros(), mat)
+    ]
+
+    return objects, light, camera
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Counts the geometry objects allocated per ray by the python backend")
+    parser.add_argument("--size", type=int, default=32)
+    parser.add_argument("--shadow-samples", type=int, default=5)
+    args = parser.parse_args()
+
+    objects, light, camera = scene(args.size)
+
+    counts, restore = count_instances(COUNTED_TYPES)
+    try:
+        start = time.perf_counter()
+        render(objects, light, camera, shadow_samples=args.shadow_samples, tile_size=None)
+        elapsed = time.perf_counter() - start
+    finally:
+        restore()
+
+    # Every traced ray (primary or shadow) is a Ray instance
+    rays = counts['Ray']
+    total = sum(counts.values())
+
+    tracemalloc.start()
+    render(objects, light, camera, shadow_samples=args.shadow_samples, tile_size=None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"rays traced: {rays}, {elapsed / rays * 1E6:.1f} us/ray")
+    print(f"objects per ray: {total / rays:.1f} ({', '.join(f'{k} {v / rays:.1f}' for k, v in counts.items())})")
+    print(f"bytes per Vector3: {instance_size(Vector3(0, 0, 0))}, Color: {instance_size(Color(0, 0, 0))}")
+    print(f"peak traced memory: {peak / 1024:.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import time
+
+from simpleraytracer import *
+
+
+def random_scene(count, rng):
+    mat = Material(Color.white(), Color.white(), Color.white(), 100)
+    radius = 2.0 / count ** (1 / 3)
+
+    objects = [Sphere(Vector3(*rng.uniform(-10, 10, 3)), Vector3.zeros(), radius, mat) for _ in range(count)]
+    objects.append(Plane(Vector3(0, -11, 0), Vector3.zeros(), mat))
+
+    return objects
+
+
+def brute_force(rays, objects):
+    for ray in rays:
+        min(obj.calculate_intersection(ray) for obj in objects)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how BVH queries scale with the number of spheres")
+    parser.add_argument("--counts", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--rays", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    origins = rng.uniform(-12, 12, (args.rays, 3))
+    directions = Vector3.normalize_batch(rng.normal(size=(args.rays, 3)))
+    rays = [Ray(Vector3(*o), Vector3(*d)) for o, d in zip(origins, directions)]
+
+    print(f"{'objects':>8} {'build s':>9} {'linear us/ray':>14} {'bvh us/ray':>11} {'bvh batch us/ray':>17}")
+
+    for count in args.counts:
+        objects = random_scene(count, rng)
+
+        start = time.perf_counter()
+        bvh = BVH(objects)
+        build = time.perf_counter() - start
+
+        # The linear scan is only timed on a subset of the rays, it gets slow quickly
+        subset = rays[:max(1, args.rays * 100 // count)]
+        start = time.perf_counter()
+        brute_force(subset, objects)
+        linear = (time.perf_counter() - start) / len(subset)
+
+        start = time.perf_counter()
+        for ray in rays:
+            bvh.closest_intersection(ray)
+        scalar = (time.perf_counter() - start) / len(rays)
+
+        start = time.perf_counter()
+        bvh.closest_intersection_batch(origins, directions)
+        batch = (time.perf_counter() - start) / len(rays)
+
+        print(f"{count:>8} {build:>9.3f} {linear * 1E6:>14.1f} {scalar * 1E6:>11.1f} {batch * 1E6:>17.2f}")
+
+
+if __name__ == '__main__':
+    main()
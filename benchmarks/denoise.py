@@ -0,0 +1,89 @@
+import argparse
+import sys
+import time
+
+from simpleraytracer import *
+
+
+def soft_shadow_scene(width, height):
+    """
+    Small spheres hovering over a plane under a large light, like the shadow heavy scene of the suite, so most of the
+    plane is in a penumbra.
+    """
+    mat = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+    objects = [
+        Sphere(Vector3(x, -0.4, z), Vector3.zeros(), 0.2, mat)
+        for x in (-1, 0, 1)
+        for z in (-2, -1, 0)
+    ]
+    objects.append(Plane(Vector3(0, -1, 0), Vector3.zeros(), mat))
+    light = PointLight(Vector3(5, 5, 5), Vector3.zeros(), 3, Color.white(), Color.white(), Color.white())
+
+    return objects, light, Camera(Vector3(0, 0, 1.5), Vector3.zeros(), width, height, 1)
+
+
+def timed_render(bvh, light, camera, **options):
+    start = time.perf_counter()
+    image = render(bvh, light, camera, backend="numpy", dtype=np.float32, seed=1, **options)
+
+    return image / 255, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares renders with few shadow samples, raw and denoised, "
+                                                 "with a render with many samples, and fails if denoising makes a "
+                                                 "render worse or does not match a raw render with 4 times the "
+                                                 "samples")
+    parser.add_argument("--width", type=int, default=160)
+    parser.add_argument("--height", type=int, default=120)
+    parser.add_argument("--samples", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--reference-samples", type=int, default=512)
+    parser.add_argument("--target", type=int, default=4,
+                        help="samples of the denoised render that has to match a raw render with 4 times the samples")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="how much the error of that denoised render may exceed the one of the raw render")
+    args = parser.parse_args()
+
+    objects, light, camera = soft_shadow_scene(args.width, args.height)
+    bvh = BVH(objects)
+
+    reference, reference_time = timed_render(bvh, light, camera, shadow_samples=args.reference_samples)
+    print(f"reference: {args.reference_samples} shadow samples in {reference_time:.2f}s")
+    print(f"{'samples':>8} {'raw s':>7} {'raw rmse':>9} {'denoised s':>11} {'denoised rmse':>14}")
+    raw_errors, denoised_errors = {}, {}
+
+    for samples in args.samples:
+        raw, raw_time = timed_render(bvh, light, camera, shadow_samples=samples)
+        denoised, denoised_time = timed_render(bvh, light, camera, shadow_samples=samples, denoise=True)
+
+        raw_error = np.sqrt(np.mean((raw - reference) ** 2))
+        denoised_error = np.sqrt(np.mean((denoised - reference) ** 2))
+
+        print(f"{samples:>8} {raw_time:>7.2f} {raw_error:>9.4f} {denoised_time:>11.2f} {denoised_error:>14.4f}")
+        raw_errors[samples], denoised_errors[samples] = raw_error, denoised_error
+
+    # Denoising never makes a render worse, and with a quarter of the samples it matches the raw render
+    failures = [
+        f"denoised {samples} samples: {error:.4f} > raw {samples} samples: {raw_errors[samples]:.4f}"
+        for samples, error in denoised_errors.items()
+        if error > raw_errors[samples]
+    ]
+
+    target = 4 * args.target
+    if target not in raw_errors:
+        raw, _ = timed_render(bvh, light, camera, shadow_samples=target)
+        raw_errors[target] = np.sqrt(np.mean((raw - reference) ** 2))
+        print(f"{target:>8} {'':>7} {raw_errors[target]:>9.4f}")
+
+    if args.target in denoised_errors and denoised_errors[args.target] > raw_errors[target] * (1 + args.tolerance):
+        failures.append(f"denoised {args.target} samples: {denoised_errors[args.target]:.4f} > raw {target} samples: "
+                        f"{raw_errors[target]:.4f} + {args.tolerance:.0%}")
+
+    for failure in failures:
+        print(f"FAILED {failure}", file=sys.stderr)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Small scene that the command line renderer is timed with, its first tile is cheap
+SCENE = {
+    "camera": {"position": [0, 0, 3], "width": 64, "height": 48},
+    "light": {"type": "point", "position": [5, 5, 5], "radius": 1},
+    "objects": [
+        {"type": "sphere", "position": [0, 0, 0], "radius": 1},
+        {"type": "plane", "position": [0, -1, 0]}
+    ],
+    "render": {"shadow_samples": 4, "tile_size": 16}
+}
+
+
+def time_process(args, env):
+    """
+    Runs a process and times it from its start until it exits, and until it prints its first line to stderr.
+
+    :param args: array<str>
+    :param env: dict
+    :return: float seconds until the first line or None, float seconds until the exit
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(args, stderr=subprocess.PIPE, env=env)
+
+    first_line = process.stderr.readline()
+    first = time.perf_counter() - start if first_line else None
+
+    process.stderr.read()
+    process.wait()
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} exited with {process.returncode}")
+
+    return first, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the import time and the time from process start to the "
+                                                 "first rendered tile of the simpleraytracer command")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the fastest one is kept")
+    args = parser.parse_args()
+
+    # The package is run from the source tree, like the benchmark suite
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, ["app", os.environ.get("PYTHONPATH")]))}
+
+    with tempfile.TemporaryDirectory() as directory:
+        scene_path = os.path.join(directory, "scene.json")
+
+        with open(scene_path, "w") as file:
+            json.dump(SCENE, file)
+
+        commands = {
+            "interpreter": [sys.executable, "-c", "pass"],
+            "import numpy": [sys.executable, "-c", "import numpy"],
+            "import simpleraytracer": [sys.executable, "-c", "import simpleraytracer"],
+            "render": [sys.executable, "-m", "simpleraytracer", scene_path, "--output",
+                       os.path.join(directory, "image.png"), "--progress"]
+        }
+
+        print(f"{'command':>24} {'first tile s':>13} {'total s':>8}")
+
+        for name, command in commands.items():
+            runs = [time_process(command, env) for _ in range(args.repeat)]
+            first = min((first for first, _ in runs if first is not None), default=None)
+            total = min(total for _, total in runs)
+
+            print(f"{name:>24} {'' if first is None else f'{first:.3f}':>13} {total:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+"""
+Benchmark suite with canonical scenes, run it from the repository root with
+
+    PYTHONPATH=app python -m benchmarks.suite --output results.json --baseline baseline.json
+"""
+from .runner import *
+from .scenes import *
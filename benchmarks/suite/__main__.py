@@ -0,0 +1,35 @@
+import argparse
+import sys
+
+from .runner import *
+from .scenes import SCENES
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the canonical scenes and compares them with a baseline")
+    parser.add_argument("--scenes", nargs="+", choices=list(SCENES), help="scenes to run, all of them by default")
+    parser.add_argument("--repeat", type=int, default=3, help="timed renders per scene, the fastest one is kept")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the resolution of every scene")
+    parser.add_argument("--output", help="writes the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare with, regressions make the exit status 1")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change that counts as a regression")
+    args = parser.parse_args()
+
+    results = run_suite(args.scenes, args.repeat, args.scale)
+
+    if args.output:
+        save_results(results, args.output)
+
+    if not args.baseline:
+        return 0
+
+    regressions = compare_results(results, load_results(args.baseline), args.threshold)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import json
+import platform
+import time
+import tracemalloc
+
+from simpleraytracer import *
+
+from .scenes import SCENES
+
+# Metrics compared against the baseline, and whether a higher value is better
+COMPARED_METRICS = {
+    "wall_time": False,
+    "rays_per_second": True,
+    "peak_memory": False
+}
+
+
+def run_benchmark(scene, repeat=3, scale=1.0):
+    """
+    Renders a benchmark scene repeat times and measures the fastest frame, then renders it once more under
+    tracemalloc to measure the peak memory, which is not timed since tracing slows down every allocation.
+
+    Only the anti-aliasing sub-pixel rays are counted towards rays_per_second, shadow rays are left out
+    because their number depends on the scene.
+
+    :param scene: BenchmarkScene
+    :param repeat: int
+    :param scale: float
+    :return: dict
+    """
+    objects, light, camera = scene.create(scale)
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render(objects, light, camera, **scene.options)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        render(objects, light, camera, **scene.options)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    rays = camera.width * camera.height * 4
+
+    return {
+        "width": camera.width,
+        "height": camera.height,
+        "options": scene.options,
+        "repeat": repeat,
+        "wall_time": min(times),
+        "rays_per_second": rays / min(times),
+        "peak_memory": peak_memory
+    }
+
+
+def run_suite(names=None, repeat=3, scale=1.0, log=print):
+    """
+    Runs the benchmarks of the named scenes, scenes that cannot be built (e.g. because an optional dependency
+    to decode their textures is missing) are reported as skipped.
+
+    :param names: array<str>, None runs every scene
+    :param repeat: int
+    :param scale: float
+    :param log: function(str)
+    :return: dict
+    """
+    results = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "scale": scale,
+        "scenes": {},
+        "skipped": {}
+    }
+
+    for name in names or SCENES:
+        try:
+            results["scenes"][name] = run_benchmark(SCENES[name], repeat, scale)
+        except (ImportError, OSError) as error:
+            results["skipped"][name] = str(error)
+            log(f"{name:<14} skipped: {error}")
+            continue
+
+        result = results["scenes"][name]
+        log(
+            f"{name:<14} {result['width']:>5}x{result['height']:<5} {result['wall_time']:>9.3f} s "
+            f"{result['rays_per_second']:>12.0f} rays/s {result['peak_memory'] / 2 ** 20:>9.1f} MiB"
+        )
+
+    return results
+
+
+def compare_results(results, baseline, threshold=0.1):
+    """
+    Compares benchmark results with a baseline, scenes that are missing from either of them are ignored.
+
+    :param results: dict
+    :param baseline: dict
+    :param threshold: float relative change at which a metric counts as regressed
+    :return: array<str> descriptions of the regressions
+    """
+    regressions = []
+
+    for name, result in results["scenes"].items():
+        expected = baseline["scenes"].get(name)
+
+        if expected is None:
+            continue
+
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if not expected[metric]:
+                continue
+
+            change = (result[metric] - expected[metric]) / expected[metric]
+
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{name}: {metric} {expected[metric]:.6g} -> {result[metric]:.6g} ({change:+.1%})")
+
+    return regressions
+
+
+def load_results(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_results(results, path):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
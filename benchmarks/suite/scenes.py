@@ -0,0 +1,131 @@
+import os
+
+from simpleraytracer import *
+
+TEXTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "textures")
+
+
+class BenchmarkScene:
+    """
+    A scene together with the render settings it is benchmarked with.
+    """
+
+    def __init__(self, name, description, build, width, height, options):
+        """
+        :param name: str
+        :param description: str
+        :param build: function(width, height) -> (array<Shape>, Light, Camera)
+        :param width: int
+        :param height: int
+        :param options: dict keyword arguments of render
+        """
+        self.name = name
+        self.description = description
+        self.build = build
+        self.width = width
+        self.height = height
+        self.options = options
+
+    def create(self, scale=1.0):
+        """
+        Builds the objects, light and camera of the scene, with the resolution multiplied by scale.
+
+        :param scale: float
+        :return: array<Shape>, Light, Camera
+        """
+        return self.build(max(1, round(self.width * scale)), max(1, round(self.height * scale)))
+
+
+def __default_light(radius=1):
+    return PointLight(
+        Vector3(5, 5, 5),
+        Vector3.zeros(),
+        radius,
+        Color(1, 1, 1),
+        Color(0.945, 0.703, 0.253),
+        Color(0.945, 0.703, 0.253)
+    )
+
+
+def __earth_scene(width, height):
+    # Same scene as run.py
+    mat = Material(
+        Color(0.1, 0.1, 0.1),
+        Color(0.6, 0.6, 0.6),
+        Color.white(),
+        100,
+        Texture.load(os.path.join(TEXTURE_PATH, 'earth.jpg'))
+    )
+    objects = [
+        Sphere(Vector3(0, 0, 0), Vector3.zeros(), 1, mat),
+        Plane(Vector3(0, -1, 0), Vector3.zeros(), mat)
+    ]
+
+    return objects, __default_light(), Camera(Vector3(0, 0, 1.5), Vector3.zeros(), width, height, 1)
+
+
+def __sphere_grid_scene(width, height, count=10):
+    mat = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+    spacing = 4.0 / count
+
+    objects = [
+        Sphere(Vector3(-2 + (i + 0.5) * spacing, -0.5, -1 - (j + 0.5) * spacing), Vector3.zeros(), spacing / 3, mat)
+        for i in range(count)
+        for j in range(count)
+    ]
+    objects.append(Plane(Vector3(0, -1, 0), Vector3.zeros(), mat))
+
+    return objects, __default_light(), Camera(Vector3(0, 1, 1.5), Vector3.zeros(), width, height, 1)
+
+
+def __dense_sphere_grid_scene(width, height):
+    # 32 x 32 spheres, enough objects that the BVH packets of the shadow rays split into small ones
+    return __sphere_grid_scene(width, height, count=32)
+
+
+def __shadow_heavy_scene(width, height):
+    # A large light over small spheres hovering above a plane, most of the plane is in a penumbra
+    mat = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+    objects = [
+        Sphere(Vector3(x, -0.4, z), Vector3.zeros(), 0.2, mat)
+        for x in (-1, 0, 1)
+        for z in (-2, -1, 0)
+    ]
+    objects.append(Plane(Vector3(0, -1, 0), Vector3.zeros(), mat))
+
+    return objects, __default_light(radius=3), Camera(Vector3(0, 0, 1.5), Vector3.zeros(), width, height, 1)
+
+
+def __large_scene(width, height):
+    mat = Material(Color(0.1, 0.1, 0.1), Color(0.6, 0.6, 0.6), Color.white(), 100)
+    objects = [
+        Sphere(Vector3(0, 0, 0), Vector3.zeros(), 1, mat),
+        Plane(Vector3(0, -1, 0), Vector3.zeros(), mat)
+    ]
+
+    return objects, __default_light(), Camera(Vector3(0, 0, 1.5), Vector3.zeros(), width, height, 1)
+
+
+SCENES = {
+    scene.name: scene
+    for scene in [
+        BenchmarkScene("earth", "Textured sphere and plane of run.py", __earth_scene, 255, 255, {
+            "shadow_samples": 5
+        }),
+        BenchmarkScene("sphere_grid", "10 x 10 grid of spheres on a plane", __sphere_grid_scene, 160, 120, {
+            "shadow_samples": 2
+        }),
+        BenchmarkScene("sphere_grid_1000", "32 x 32 grid of spheres on a plane traced with the numpy backend",
+                       __dense_sphere_grid_scene, 160, 120, {
+                           "shadow_samples": 4,
+                           "backend": "numpy"
+                       }),
+        BenchmarkScene("shadow_heavy", "Small spheres under a large light", __shadow_heavy_scene, 120, 90, {
+            "shadow_samples": 32
+        }),
+        BenchmarkScene("large", "1920 x 1080 frame traced with the numpy backend", __large_scene, 1920, 1080, {
+            "shadow_samples": 4,
+            "backend": "numpy"
+        })
+    ]
+}
@@ -1,47 +1,14 @@
 import os
+import sys
 
-import matplotlib.pyplot as plt  # For saving images
-from PIL import Image  # For opening images
-from simpleraytracer import *
-
-
-def main():
-    texture_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "textures")  # Textures path
-
-    earth_texture = Image.open(os.path.join(texture_path, 'earth.jpg'))
-    earth_tex = np.asarray(earth_texture)
-
-    """Define objects present in the scene"""
-    height, width = 255, 255
-    camera = Camera(Vector3(0, 0, 1.5), Vector3.zeros(), width, height, 1)
-
-    light = PointLight(
-        Vector3(5, 5, 5),
-        Vector3.zeros(),
-        1,
-        Color(1, 1, 1),
-        Color(0.945, 0.703, 0.253),
-        Color(0.945, 0.703, 0.253)
-    )
-
-    mat = Material(
-        Color(0.1, 0.1, 0.1),
-        Color(0.6, 0.6, 0.6),
-        Color.white(),
-        100,
-        earth_tex
-    )
-
-    objects = [
-        Sphere(Vector3(0, 0, 0), Vector3.zeros(), 1, mat),
-        Plane(Vector3(0, -1, 0), Vector3.zeros(), mat)
-    ]
-
-    image = render(objects, light, camera, shadow_samples=5)
-
-    plt.imshow(image, interpolation='nearest')
-    plt.show()
-
+from simpleraytracer.src.cli import main
 
 if __name__ == '__main__':
-    main()
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    """Render the earth scene to an image file, the textures are loaded when the scene is rendered"""
+    sys.exit(main([
+        os.path.join(directory, "scenes", "earth.json"),
+        "--output", os.path.join(directory, "results", "earth.png"),
+        *sys.argv[1:]
+    ]))
@@ -21,8 +21,15 @@ setup(
         "Operating System :: OS Independent",
     ],
     install_requires=["numpy"],
+    entry_points={
+        "console_scripts": [
+            "simpleraytracer=simpleraytracer.src.cli:main",
+            "simpleraytracer-worker=simpleraytracer.src.cli:worker_main",
+        ],
+    },
     extras_require={
         "dev": ["pytest>=7.0"],
+        "images": ["Pillow"],
     },
     python_requires=">=3.10",
 )